@@ -19,7 +19,7 @@
 # THE SOFTWARE.
 
 import maya.cmds as m
-from peel_solve import node_list, roots
+from peel_solve import node_list, roots, anim_index
 import math
 
 
@@ -27,28 +27,22 @@ def ls():
 
     """ Returns a list of of all animated nodes in the scene """
 
-    nodes = set()
+    nodes = anim_index.index().ls(types=["animCurveTA", "animCurveTL"])
+    if not nodes:
+        return []
 
-    for i in m.ls(type="animCurveTA"):
-        nodes.add(m.listConnections(i + ".o")[0])
-
-    for i in m.ls(type="animCurveTL"):
-        nodes.add(m.listConnections(i + ".o")[0])
-
-    return list(nodes)
+    return m.ls(nodes)
 
 
 def time_range(sel=None):
 
-    """ Returns the current animated time range in the scene.
+    """ Returns the current animated time range in the scene, or None if there are no keys.
     @param sel: optional list of animated nodes to use for the time range """
 
     if sel is None:
         sel = ls()
 
-    k = m.keyframe(sel, q=True)
-
-    return min(k), max(k)
+    return anim_index.time_range(sel)
 
 
 def clear_animation():
@@ -58,8 +52,11 @@ def clear_animation():
 
 def frame(sel=None):
     """ Set the playback options to frame the current animated range """
-    a, b = time_range(sel)
-    m.playbackOptions(min=math.floor(a), max=math.ceil(b))
+    keys = time_range(sel)
+    if keys is None:
+        print("No keys to frame")
+        return
+    m.playbackOptions(min=math.floor(keys[0]), max=math.ceil(keys[1]))
 
 
 def cut_keys():
@@ -100,7 +97,10 @@ def trim_anim(nodes=None):
     start = m.playbackOptions(q=True, min=True)
     end = m.playbackOptions(q=True, max=True)
 
-    a, b = time_range()
+    keys = time_range()
+    if keys is None:
+        return
+    a, b = keys
 
     if b > end:
         m.cutKey(nodes, time=(b, end))
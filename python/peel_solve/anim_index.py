@@ -0,0 +1,295 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import maya.OpenMaya as om
+import maya.OpenMayaAnim as oma
+import maya.cmds as m
+
+""" Index of the anim curves in the scene, so key ranges and animated nodes can be found without querying keys """
+
+
+class AnimIndex(object):
+    """ Maps the anim curves in the scene to the nodes they drive and caches the first and last key of each.
+    Entries are dropped by DG callbacks when curves are edited, added, removed or reconnected, or when the
+    nodes they drive are renamed or reparented, and are refreshed from the API the next time they are needed.
+
+    * self.curves - dict of curve name -> (curve type, [driven nodes], first key, last key)
+    * self.nodes - dict of driven node (long name) -> set of curve names
+    * self.stale - curve names that need to be re-read
+    """
+
+    def __init__(self):
+        self.curves = None
+        self.nodes = {}
+        self.stale = set()
+        self.extent = None
+        self.callbacks = []
+
+    def start(self):
+        """ install the callbacks that keep the index up to date """
+
+        if self.callbacks:
+            return
+
+        def rebuild(*args):
+            self.curves = None
+
+        self.callbacks = [
+            oma.MAnimMessage.addAnimCurveEditedCallback(self.on_edited),
+            om.MDGMessage.addNodeAddedCallback(self.on_added, "animCurve"),
+            om.MDGMessage.addNodeRemovedCallback(self.on_removed, "animCurve"),
+            om.MDGMessage.addConnectionCallback(self.on_connection),
+            om.MNodeMessage.addNameChangedCallback(om.MObject(), self.on_renamed),
+            om.MDagMessage.addAllDagChangesCallback(self.on_dag_changed),
+            om.MSceneMessage.addCallback(om.MSceneMessage.kAfterOpen, rebuild),
+            om.MSceneMessage.addCallback(om.MSceneMessage.kAfterNew, rebuild),
+            om.MEventMessage.addEventCallback("timeUnitChanged", rebuild),
+            om.MEventMessage.addEventCallback("Undo", rebuild),
+            om.MEventMessage.addEventCallback("Redo", rebuild)]
+
+    def stop(self):
+        """ remove the callbacks, the index will be rebuilt if it is used again """
+        for i in self.callbacks:
+            om.MMessage.removeCallback(i)
+        self.callbacks = []
+        self.curves = None
+
+    # Callbacks
+
+    def on_edited(self, edited, client_data=None):
+        for i in range(edited.length()):
+            self.stale.add(om.MFnDependencyNode(edited[i]).name())
+        self.extent = None
+
+    def on_added(self, obj, client_data=None):
+        self.stale.add(om.MFnDependencyNode(obj).name())
+        self.extent = None
+
+    def on_removed(self, obj, client_data=None):
+        self.drop(om.MFnDependencyNode(obj).name())
+        self.extent = None
+
+    def on_connection(self, src, dst, made, client_data=None):
+        node = src.node()
+        if node.hasFn(om.MFn.kAnimCurve):
+            self.stale.add(om.MFnDependencyNode(node).name())
+            self.extent = None
+
+    def on_renamed(self, obj, prev, client_data=None):
+        if self.curves is None:
+            return
+        if obj.hasFn(om.MFn.kAnimCurve):
+            self.drop(prev)
+            self.stale.discard(prev)
+            self.stale.add(om.MFnDependencyNode(obj).name())
+        else:
+            # the long names of the node and its children have changed
+            self.stale.update(self.driving(obj))
+
+    def on_dag_changed(self, msg, child, parent, client_data=None):
+        if self.curves is None:
+            return
+        try:
+            obj = child.node()
+        except RuntimeError:
+            return
+        self.stale.update(self.driving(obj))
+
+    # Index
+
+    def driving(self, obj):
+        """ returns the names of the anim curves connected to the node (MObject) and, for dag nodes, to its
+        descendants """
+
+        nodes = [obj]
+        if obj.hasFn(om.MFn.kDagNode):
+            nodes = []
+            it = om.MItDag()
+            it.reset(obj, om.MItDag.kDepthFirst)
+            while not it.isDone():
+                nodes.append(it.currentItem())
+                it.next()
+
+        ret = set()
+        for node in nodes:
+            plugs = om.MPlugArray()
+            try:
+                om.MFnDependencyNode(node).getConnections(plugs)
+            except RuntimeError:
+                # no connections
+                continue
+            for i in range(plugs.length()):
+                src = om.MPlugArray()
+                plugs[i].connectedTo(src, True, False)
+                for j in range(src.length()):
+                    curve = src[j].node()
+                    if curve.hasFn(om.MFn.kAnimCurve):
+                        ret.add(om.MFnDependencyNode(curve).name())
+        return ret
+
+    def drop(self, curve):
+        """ remove the curve from the index """
+        if self.curves is None or curve not in self.curves:
+            return
+        for node in self.curves.pop(curve)[1]:
+            if node in self.nodes:
+                self.nodes[node].discard(curve)
+                if not self.nodes[node]:
+                    del self.nodes[node]
+
+    def add(self, obj):
+        """ read the curve (MObject) in to the index """
+
+        dep = om.MFnDependencyNode(obj)
+        name = dep.name()
+        self.drop(name)
+
+        fn = oma.MFnAnimCurve(obj)
+        first = None
+        last = None
+        if fn.isTimeInput() and fn.numKeys() > 0:
+            unit = om.MTime.uiUnit()
+            first = fn.time(0).asUnits(unit)
+            last = fn.time(fn.numKeys() - 1).asUnits(unit)
+
+        driven = []
+        plugs = om.MPlugArray()
+        dep.findPlug("output").connectedTo(plugs, False, True)
+        for i in range(plugs.length()):
+            node = plugs[i].node()
+            if node.hasFn(om.MFn.kDagNode):
+                driven.append(om.MFnDagNode(node).fullPathName())
+            else:
+                driven.append(om.MFnDependencyNode(node).name())
+
+        self.curves[name] = (dep.typeName(), driven, first, last)
+        for node in driven:
+            self.nodes.setdefault(node, set()).add(name)
+
+    def update(self):
+        """ build the index if needed and refresh any stale entries """
+
+        self.start()
+
+        if self.curves is None:
+            self.curves = {}
+            self.nodes = {}
+            self.stale = set()
+            self.extent = None
+            it = om.MItDependencyNodes(om.MFn.kAnimCurve)
+            while not it.isDone():
+                self.add(it.thisNode())
+                it.next()
+
+        while self.stale:
+            name = self.stale.pop()
+            sel = om.MSelectionList()
+            try:
+                sel.add(name)
+            except RuntimeError:
+                # deleted or renamed since it was flagged
+                self.drop(name)
+                continue
+            obj = om.MObject()
+            sel.getDependNode(0, obj)
+            self.add(obj)
+
+    def ls(self, types=None):
+        """ returns the (long) names of the nodes driven by anim curves, optionally only for the curve types given """
+        self.update()
+        if types is None:
+            return list(self.nodes)
+        ret = set()
+        for curve_type, driven, _, _ in self.curves.values():
+            if curve_type in types:
+                ret.update(driven)
+        return list(ret)
+
+    def time_range(self, nodes=None):
+        """ returns (first, last) key time for the nodes, or all curves if nodes is None.  Returns None if there
+        are no keys.  Nodes that are not driven by an anim curve directly fall back to a keyframe query """
+
+        self.update()
+
+        if nodes is None:
+            if self.extent is None:
+                self.extent = self.extent_of(self.curves)
+            return self.extent
+
+        curves = set()
+        missing = []
+        for node in m.ls(nodes, long=True) or []:
+            if node in self.nodes:
+                curves.update(self.nodes[node])
+            else:
+                missing.append(node)
+
+        ret = self.extent_of(curves)
+
+        if missing:
+            keys = m.keyframe(missing, q=True)
+            if keys:
+                if ret is None:
+                    ret = (min(keys), max(keys))
+                else:
+                    ret = (min(ret[0], min(keys)), max(ret[1], max(keys)))
+
+        return ret
+
+    def extent_of(self, curves):
+        first = None
+        last = None
+        for curve in curves:
+            _, _, a, b = self.curves[curve]
+            if a is None:
+                continue
+            if first is None or a < first:
+                first = a
+            if last is None or b > last:
+                last = b
+        if first is None:
+            return None
+        return first, last
+
+
+INDEX = None
+
+
+def index():
+    """ returns the scene anim index, creating it if needed """
+    global INDEX
+    if INDEX is None:
+        INDEX = AnimIndex()
+    return INDEX
+
+
+def reset():
+    """ remove the index and its callbacks """
+    global INDEX
+    if INDEX is not None:
+        INDEX.stop()
+        INDEX = None
+
+
+def time_range(nodes=None):
+    """ returns the (first, last) key time for the nodes, or the whole scene. None if there are no keys """
+    return index().time_range(nodes)
@@ -0,0 +1,207 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import os
+import os.path
+
+import maya.cmds as cmds
+from maya import mel
+
+from peel_solve import file
+
+""" The steps of solving a c3d take: import in to the rig scene, set the range, solve and save a version in the
+ solves folder.  These do not need the ui, so they are used by the batch solve tool (batcher.py) and by the
+ headless batch runner (batch_runner.py). """
+
+
+SOLVES_FOLDER = r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves'
+
+
+def shot_name(c3d_file):
+    """ the shot name of a take, e.g. D:/shots/20210122_tracked_orders/_0000233_B_edt.c3d -> 0000233 """
+    return os.path.split(c3d_file)[1].split(".")[0].strip("_").split("_")[0]
+
+
+def select_root():
+    """selects the root in the scene (looks for transform object ending with 'c3d')"""
+    for transform_object in cmds.ls(transforms=True):
+        if str(transform_object).endswith("c3d"):
+            print("Selecting root:", transform_object)
+            return transform_object  # eg: "0000246_edt_c3d"
+    print("No root found")
+
+
+class ImportData:
+    def __init__(self):
+        self.file_browser()
+
+    def file_browser(self):
+        """ Opens a browser for user to select one c3d file. This method is used when import is done as a separate
+        one-time operation. It is not used for the batch_solve"""
+
+        basic_filter = "*.c3d"
+        last_directory = cmds.optionVar(q="lastPeelC3dDir")
+        c3d_files = cmds.fileDialog2(fm=1, fileFilter=basic_filter, dialogStyle=2, dir=last_directory)
+        if c3d_files is None or len(c3d_files) == 0:
+            raise RuntimeError("No c3d files selected for import")
+        c3d_file = c3d_files[0]
+
+        self.import_file(c3d_file)
+
+    @staticmethod
+    def import_file(c3d_file, merge=True, timecode=True, convert=False, debug=False):
+        """Assigns values to attributes for peelC3D import, selects the root, imports and checks if the imported
+        data pertains to the same dog as the previous data."""
+
+        # Settings for peelC3d import
+        cmds.optionVar(sv=("lastPeelC3dDir", os.path.split(c3d_file)[0]))
+
+        c3d_file = c3d_file.replace("\\", "/")
+
+        root = select_root()
+        if root is None:
+            raise RuntimeError("Could not find mocap root in the scene - is the rig loaded?")
+
+        dog_name = ImportData.get_dog_name(root)
+
+        if merge:
+            cmds.select(root)
+            cmds.delete(root, channels=True, hierarchy='below')
+
+        options = ";scale=1;unlabelled=0;nodrop=0;"
+        options += "timecode=%d;" % int(bool(timecode))
+        options += "convert=%d;" % int(bool(convert))
+        options += "merge=%d;" % int(bool(merge))
+        options += "debug=%d;" % int(bool(debug))
+        import_cmd = 'file -import -type "peelC3D" -options "%s" "%s";' % (options, c3d_file)
+
+        try:
+            mel.eval(import_cmd)
+        except RuntimeError:
+            raise RuntimeError("Unable to load c3d - is the plugin loaded?")
+
+        if merge:
+            # rename the root
+            root = cmds.rename(root, '_' + str(os.path.split(c3d_file)[1]).replace('.', '_'))
+
+        print("Checking if dogs match...")
+        new_dog_name = ImportData.get_dog_name(root)
+        if new_dog_name != dog_name:
+            raise RuntimeError("Not the same dog. Imported but not solved. Please start over.")
+
+    @staticmethod
+    def get_dog_name(root):
+        children = cmds.listRelatives(root) or []
+
+        for child in children:
+            if child.startswith("Tyrus"):
+                return "Tyrus"
+            if child.startswith("Sterling"):
+                return "Sterling"
+        print("Could not determine which dog.")
+        return "No dog found"
+
+
+class Solve:
+    def __init__(self, save_file_path=r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves\temp_saves\temp_save.c3d',
+                 solves_folder=None):
+
+        # data
+        self.solves_folder = solves_folder or SOLVES_FOLDER
+        self.save_file_path = save_file_path
+
+    @staticmethod
+    def delete_prev_anim():
+        """ Delete all animation"""
+
+        # Delete all channels
+        cmds.delete(all=True, channels=True)
+
+    @staticmethod
+    def delete_history():
+        """ Delete all history on joints"""
+
+        # Select all passive, i.e. joints
+        select_passive_cmd = "peelSolve2SelectType(3)"
+        try:
+            mel.eval(select_passive_cmd)
+        except RuntimeError as e:
+            print("Could not delete history on all joints")
+            return
+
+        # Delete history
+        cmds.delete(constructionHistory=True)
+
+    @staticmethod
+    def solve_c3d():
+        """Solves the data for the range in timeline using PeelSolve, returns False if the solve failed"""
+
+        solve_cmd = "peelSolve2Run(1)"
+        try:
+            mel.eval(solve_cmd)
+        except RuntimeError as e:
+            print("Could not solve due to following error:")
+            print(str(e))
+            return False
+        print("Solve completed.")
+        return True
+
+    def save_file(self, current_c3d=None):  # current c3d eg" D:/shots/20210122_tracked_orders/_0000224_B_edt.c3d
+        """ Saves the scene as the next version of the shot in the solves folder, returns the file name """
+
+        if not current_c3d:
+            current_c3d = self.save_file_path  # r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves\temp_saves\temp_save.c3d'
+
+        name = shot_name(current_c3d)  # eg: _000246_edt_c3d
+        print("shot_name after split operation", name)
+        file_name = file.create_file_name(name, self.solves_folder)
+        try:
+            cmds.file(rename=file_name)
+            cmds.file(save=True, type="mayaBinary")
+        except RuntimeError:
+            # give back the version reserved by create_file_name
+            if os.path.isfile(file_name) and os.path.getsize(file_name) == 0:
+                os.remove(file_name)
+            raise
+        print("File saved as: ", file_name)
+        return file_name
+
+
+def solve_take(c3d_file, start=None, end=None, solves_folder=None):
+    """ import, solve and save one take in the current scene, which must have the rig in it.  start and end set
+    the range to solve, otherwise the playback range is used.  Returns the saved file name """
+
+    ImportData.import_file(c3d_file)
+
+    if select_root() is None:
+        raise RuntimeError("Root could not be found. Solve failed.")
+
+    if start is not None and end is not None:
+        cmds.playbackOptions(minTime=start, maxTime=end)
+
+    solve_obj = Solve(solves_folder=solves_folder)
+    solve_obj.delete_prev_anim()
+    solve_obj.delete_history()
+    if not solve_obj.solve_c3d():
+        raise RuntimeError("Solve failed: " + c3d_file)
+
+    return solve_obj.save_file(c3d_file)
@@ -0,0 +1,155 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import json
+import os
+import os.path
+import threading
+import time
+
+""" The state of a batch solve on disk, so a batch that stops part way (maya crashing, the machine restarting)
+ can be resumed without redoing the takes that are done.  For each take it records the status and times of its
+ stages and the files they made:
+
+ * solve - import the c3d in to the rig, solve and save (the steps before the save only exist in the scene, so
+   the stage is redone from the import if it did not finish)
+ * playblast - image sequences of each view of the saved scene
+ * encode - the movies made from the image sequences
+
+ Used by the batch solve tool (batcher.py) and the headless runner (batch_runner.py), which resume from a
+ manifest with --resume.  Does not depend on maya. """
+
+
+STAGES = ["solve", "playblast", "encode"]
+
+
+def default_path(folder):
+    """ a new manifest file name in folder """
+    return os.path.join(folder, time.strftime("batch_%Y%m%d_%H%M%S.json"))
+
+
+class Manifest(object):
+    """ A batch manifest file.
+
+    * self.data - {'created', 'settings', 'takes'}, each take is a dict of 'c3d', 'start', 'end', 'stages'
+      (stage -> {'status': running/done/failed, 'started', 'finished', 'error'}) and 'outputs'
+
+    Changes are written straight away.  The encoder finishes stages from its own thread, so changes are locked.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, takes, **settings):
+        """ start a manifest for takes, a list of {'c3d', 'start', 'end'}.  settings are kept for resuming """
+        data = {'created': time.time(), 'settings': settings, 'takes': []}
+        for take in takes:
+            data['takes'].append({'c3d': take['c3d'], 'start': take.get('start'), 'end': take.get('end'),
+                                  'stages': {}, 'outputs': {}})
+        ret = cls(path, data)
+        ret.save()
+        return ret
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as fp:
+            return cls(path, json.load(fp))
+
+    @property
+    def takes(self):
+        return self.data['takes']
+
+    @property
+    def settings(self):
+        return self.data.get('settings', {})
+
+    def save(self):
+        """ write the manifest, replacing the file in one step so a crash never leaves half of it """
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp = self.path + ".%d.tmp" % os.getpid()
+        with open(tmp, "w") as fp:
+            json.dump(self.data, fp, indent=1)
+        if hasattr(os, "replace"):
+            os.replace(tmp, self.path)
+        else:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+
+    def start(self, index, stage):
+        with self.lock:
+            self.takes[index]['stages'][stage] = {'status': "running", 'started': time.time()}
+            self.save()
+
+    def finish(self, index, stage, ok=True, error=None, **outputs):
+        """ mark a stage of a take done or failed, outputs are added to the take's outputs """
+        with self.lock:
+            take = self.takes[index]
+            record = take['stages'].setdefault(stage, {'started': time.time()})
+            record['status'] = "done" if ok else "failed"
+            record['finished'] = time.time()
+            if error:
+                record['error'] = error
+            take['outputs'].update(outputs)
+            self.save()
+
+    def status(self, index, stage):
+        return self.takes[index]['stages'].get(stage, {}).get('status')
+
+    def next_stage(self, index, stages=None):
+        """ the first stage of a take that is not done, None if they all are """
+        for stage in stages or STAGES:
+            if self.status(index, stage) != "done":
+                return stage
+        return None
+
+    def incomplete(self, stages=None):
+        """ indices of the takes that have stages still to do """
+        return [i for i in range(len(self.takes)) if self.next_stage(i, stages) is not None]
+
+    def summary(self, stages=None):
+        """ returns a line per take with the status of each stage """
+        ret = []
+        for take in self.takes:
+            states = []
+            for stage in stages or STAGES:
+                record = take['stages'].get(stage, {})
+                text = "%s:%s" % (stage, record.get('status', "-"))
+                if 'finished' in record and 'started' in record:
+                    text += "(%ds)" % (record['finished'] - record['started'])
+                states.append(text)
+            ret.append("%s  %s" % (take['c3d'], "  ".join(states)))
+        return ret
+
+
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:]:
+        print(path)
+        for line in Manifest.load(path).summary():
+            print("  " + line)
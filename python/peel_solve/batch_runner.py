@@ -0,0 +1,291 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import json
+import os
+import os.path
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue_module
+except ImportError:
+    import queue as queue_module
+
+from peel_solve import process
+from peel_solve.batch_manifest import Manifest, default_path
+
+""" Solves a list of c3d takes without the ui, spread across a pool of mayapy processes that each load maya
+ and the plugin once and then solve one take after another:
+
+    python -m peel_solve.batch_runner --template D:\\rig\\dog.mb --workers 4 takes.txt
+
+ takes.txt has a c3d file per line, optionally followed by the in and out frames to solve.  c3d files can also be
+ given on the command line.  Each worker opens the template scene once, then for each take imports it, solves it
+ and saves it as the next version in the solves folder (see batch.solve_take), and puts the scene back to the
+ template (see templates.RigSnapshot).  Does not need maya itself, only the workers do.
+
+ Progress is saved in a manifest (--manifest, default batch_<date>_<time>.json in the current directory), and a
+ batch that was stopped can be carried on with the takes that were not solved:
+
+    python -m peel_solve.batch_runner --resume batch_20210122_230000.json
+"""
+
+
+MAYAPY = os.environ.get("MAYAPY", r'C:\Program Files\Autodesk\Maya2020\bin\mayapy.exe')
+
+# Prefix of the line a worker prints for each take, everything else it prints is passed through as its log
+RESULT = "PEEL_BATCH_RESULT "
+
+
+def read_takes(path):
+    """ returns a list of takes, {'c3d', 'start', 'end'}, from a file with a c3d path per line optionally
+    followed by the in and out frames.  Blank lines and lines starting with # are skipped """
+
+    ret = []
+    with open(path, "r") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            take = {'c3d': line, 'start': None, 'end': None}
+            parts = line.rsplit(None, 2)
+            if len(parts) == 3:
+                try:
+                    take = {'c3d': parts[0], 'start': float(parts[1]), 'end': float(parts[2])}
+                except ValueError:
+                    pass
+            ret.append(take)
+    return ret
+
+
+class Worker(object):
+    """ A mayapy process solving takes sent to it one at a time on stdin """
+
+    def __init__(self, index, args, mayapy=None):
+        self.index = index
+        cmd = [mayapy or MAYAPY, "-u", "-m", "peel_solve.batch_runner", "--serve"] + args
+        kwargs = process.popen_kwargs()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, universal_newlines=True, **kwargs)
+
+    def solve(self, take):
+        """ send a take to the worker and return its result, or None if the worker has died """
+
+        try:
+            self.proc.stdin.write(json.dumps(take) + "\n")
+            self.proc.stdin.flush()
+        except (IOError, OSError, ValueError):
+            return None
+
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                return None
+            if line.startswith(RESULT):
+                return json.loads(line[len(RESULT):])
+            print("[%d] %s" % (self.index, line.rstrip()))
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+
+def run_batch(takes, workers=None, template=None, solves_folder=None, mayapy=None, manifest=None):
+    """ solve the takes across a pool of workers, returns a list of results in the order of the takes:
+    {'c3d', 'ok', 'saved', 'error', 'started', 'finished'}.  A worker that dies is replaced and the take it was
+    solving is reported as failed.  If a Manifest is given takes are indices in to it, and the solve stage of
+    each is recorded there """
+
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    args = []
+    if template:
+        args += ["--template", template]
+    if solves_folder:
+        args += ["--solves", solves_folder]
+
+    pending = queue_module.Queue()
+    for i, take in enumerate(takes):
+        if manifest is not None:
+            take = manifest.takes[take]
+        pending.put((i, take))
+
+    results = [None] * len(takes)
+
+    def work(index):
+        worker = None
+        while True:
+            try:
+                i, take = pending.get_nowait()
+            except queue_module.Empty:
+                break
+            print("[%d] Solving: %s" % (index, take['c3d']))
+            if manifest is not None:
+                manifest.start(takes[i], "solve")
+            result = None
+            if worker is None:
+                try:
+                    worker = Worker(index, args, mayapy)
+                except OSError as e:
+                    result = {'c3d': take['c3d'], 'ok': False,
+                              'error': "could not start %s: %s" % (mayapy or MAYAPY, str(e))}
+            if result is None:
+                result = worker.solve(take)
+                if result is None:
+                    result = {'c3d': take['c3d'], 'ok': False,
+                              'error': "worker exited with %s" % worker.proc.wait()}
+                    worker = None
+            results[i] = result
+            if manifest is not None:
+                if result['ok']:
+                    manifest.finish(takes[i], "solve", saved=result['saved'])
+                else:
+                    manifest.finish(takes[i], "solve", ok=False, error=result.get('error'))
+            print("[%d] %s: %s" % (index, "Done" if result['ok'] else "Failed", take['c3d']))
+        if worker is not None:
+            worker.close()
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(min(workers, len(takes)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
+
+def serve(template=None, solves_folder=None):
+    """ worker side: start maya, then solve each take read from stdin and print the result """
+
+    import maya.standalone
+    maya.standalone.initialize(name='python')
+
+    import maya.cmds as m
+    from peel_solve import solve, batch, templates
+    solve.load_plugin()
+
+    rig = None
+
+    def open_template():
+        """ open the template from the local disk, and keep its state to go back to between takes """
+        m.file(templates.local_copy(template), o=True, f=True)
+        # parsed once here rather than from the scene for every take
+        templates.setups(template)
+        templates.activate([template])
+        return templates.RigSnapshot()
+
+    for line in iter(sys.stdin.readline, ""):
+        if not line.strip():
+            continue
+        take = json.loads(line)
+        result = {'c3d': take['c3d'], 'started': time.time()}
+        try:
+            if not template:
+                m.file(new=True, force=True)
+            elif rig is None:
+                rig = open_template()
+            else:
+                try:
+                    rig.restore()
+                except RuntimeError as e:
+                    print("Opening the template again: " + str(e))
+                    rig = None
+                    rig = open_template()
+            result['saved'] = batch.solve_take(take['c3d'], take.get('start'), take.get('end'), solves_folder)
+            result['ok'] = True
+        except Exception:
+            result['ok'] = False
+            result['error'] = traceback.format_exc()
+            print(result['error'])
+            # the scene may be part way through anything, start the next take from the file
+            rig = None
+        result['finished'] = time.time()
+        sys.stdout.write(RESULT + json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Solve c3d takes in a pool of mayapy processes")
+    parser.add_argument("c3d", nargs="*", help="c3d files, or text files listing a c3d and its range per line")
+    parser.add_argument("--template", help="scene with the rig to import each take in to")
+    parser.add_argument("--solves", help="folder to save the solved scenes in")
+    parser.add_argument("--workers", type=int, help="number of mayapy processes, default: the number of cores")
+    parser.add_argument("--mayapy", help="mayapy executable, default: " + MAYAPY)
+    parser.add_argument("--manifest", help="file to save the progress of the batch in")
+    parser.add_argument("--resume", help="manifest of a batch to carry on with")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.template, args.solves)
+        return 0
+
+    if args.resume:
+        manifest = Manifest.load(args.resume)
+        template = args.template or manifest.settings.get('template')
+        solves_folder = args.solves or manifest.settings.get('solves')
+    else:
+        takes = []
+        for path in args.c3d:
+            if path.lower().endswith(".c3d"):
+                takes.append({'c3d': path, 'start': None, 'end': None})
+            else:
+                takes += read_takes(path)
+
+        if not takes:
+            parser.error("no takes to solve")
+
+        template = args.template
+        solves_folder = args.solves
+        manifest = Manifest.create(args.manifest or default_path(os.getcwd()), takes,
+                                   template=template, solves=solves_folder)
+
+    print("Batch manifest: " + manifest.path)
+    todo = manifest.incomplete(stages=["solve"])
+    if not todo:
+        print("Nothing to do, all the takes are solved")
+        return 0
+
+    start = time.time()
+    results = run_batch(todo, args.workers, template, solves_folder, args.mayapy, manifest)
+    failed = [i for i in results if not i['ok']]
+
+    print("Solved %d of %d takes in %ds" % (len(results) - len(failed), len(results), time.time() - start))
+    for result in failed:
+        print("Failed: %s\n%s" % (result['c3d'], result.get('error', "")))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
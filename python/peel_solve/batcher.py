@@ -1,12 +1,23 @@
 
 import os
+import traceback
 import pymel.core as pm
 import maya.cmds as cmds
 from maya import mel
 from PySide2 import QtWidgets, QtCore, QtGui
 from maya import OpenMayaUI as omui
 from shiboken2 import wrapInstance
-from . import file
+from .batch import ImportData, Solve, shot_name
+from . import batch
+from .playblast import PlayBlast
+from .encoder import Encoder
+from .batch_manifest import Manifest, default_path
+
+# Where batch manifests are saved
+BATCHES_FOLDER = os.path.join(batch.SOLVES_FOLDER, "batches")
+
+# Returned by a step that has to wait before it can run, e.g. for the encoder to catch up
+WAIT = "wait"
 
 
 class BatchSolve(QtWidgets.QDialog):
@@ -17,12 +28,23 @@ class BatchSolve(QtWidgets.QDialog):
         parent = wrapInstance(long(pointer), QtWidgets.QWidget)
         super(BatchSolve, self).__init__(parent)
 
-        # timer
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.tick)
-        self.timer.setInterval(5000)
-        self.timer.setSingleShot(False)
+        # steps for each take: (name, method, needs an idle cycle before it runs, manifest stage)
+        self.steps = [("import", self.step_import, False, "solve"),
+                      ("range", self.step_range, True, "solve"),
+                      ("prepare", self.step_prepare, True, "solve"),
+                      ("solve", self.step_solve, False, "solve"),
+                      ("save", self.step_save, False, "solve"),
+                      ("playblast", self.step_playblast, True, "playblast")]
         self.progress = 0
+        self.running = False
+
+        # progress is saved in the manifest so a batch can be resumed, see batch_manifest.py
+        self.manifest = None
+        self.todo = []
+        self.take = None
+
+        # videos are encoded in the background while the next take solves, at most this many takes behind
+        self.encoder = Encoder(backlog=2, remove_images=False)
 
         # data
         self.current_c3d = None
@@ -42,6 +64,8 @@ class BatchSolve(QtWidgets.QDialog):
         self.clear_button.pressed.connect(self.clear_table)
         self.batch_solve_button = QtWidgets.QPushButton("Batch solve and Render")
         self.batch_solve_button.pressed.connect(self.batch_solve)
+        self.resume_button = QtWidgets.QPushButton("Resume batch")
+        self.resume_button.pressed.connect(self.resume_batch)
         self.setLayout(self.import_layout)
 
         # methods
@@ -53,6 +77,7 @@ class BatchSolve(QtWidgets.QDialog):
         self.import_layout.addWidget(self.clear_button, 0, 5)
         self.import_layout.addWidget(self.takes_table, 1, 0, 5, 10)
         self.import_layout.addWidget(self.batch_solve_button, 6, 0)
+        self.import_layout.addWidget(self.resume_button, 6, 5)
 
         # setup takes table
         column_count = len(self.takes_table_headers)
@@ -70,93 +95,220 @@ class BatchSolve(QtWidgets.QDialog):
         header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
 
     def batch_solve(self):
-        """Starts the timer for the batch processing. Using a timer ensures that there is a small pause between
-        the different steps of the batch solve. Some actions in the peel tool only happen on still/idle time."""
-
-        self.timer.start()  # Goes to tick()
+        """Starts the batch processing.  Each step runs as soon as the previous one has finished, steps that need
+        maya to have been idle (some actions in the peel tool only happen on idle) are deferred to the next idle
+        cycle with evalDeferred instead of waiting a fixed time."""
 
-    def tick(self):
-        """This is where the main batch solve happens. It takes one c3d file at a time from the list, then imports it,
-        solves it (after setting frame range and selecting the root), saves it and playblasts it."""
-
-        if not self.c3d_files:
-            print("All done!", self.c3d_files)
-            self.timer.stop()
+        if self.running:
+            print("Batch solve is already running")
             return
 
-        if self.progress == 0:
-            # Find a c3d to work on
-            self.current_c3d = self.c3d_files.pop(0)
-
-            print("Now processing..............................................", self.current_c3d)
-            # Import
-            ImportData.import_file(self.current_c3d)
-            print("Imported file..............................................: ", self.current_c3d)
-            self.progress = 1
-            # self.timer.stop()
-            # return
-
-        if self.progress == 1:
-
-            # Select root
-            root = self.select_root()  # For this to work, root name has to end with "c3d"
-            if root is None:
-                print("Root could not be found. Solve failed.")
-                self.timer.stop()
-                return
-
-            # Set start and end frames on timeline
-            self.frame_range = self.get_frame_range(self.current_c3d)
-            if self.frame_range:
-                pm.playbackOptions(minTime=self.frame_range[0], maxTime=self.frame_range[1])
-            self.progress = 2
+        takes = []
+        for c3d_file in self.c3d_files or []:
+            frame_range = self.get_frame_range(c3d_file) or [None, None]
+            takes.append({'c3d': c3d_file, 'start': frame_range[0], 'end': frame_range[1]})
 
-        # this separation is important! else, solve does not take the user-defined frame range. also, maya freezes.
+        self.manifest = Manifest.create(default_path(BATCHES_FOLDER), takes)
+        print("Batch manifest: " + self.manifest.path)
+        self.start_batch()
 
-        if self.progress == 2:
-            print("Delete history set framerange..........................................: ", self.current_c3d)
-            # Delete animation and history
-            self.solve_obj = Solve()
-            self.solve_obj.delete_prev_anim()
-            self.solve_obj.delete_history()
-            print("Now starting solve on..............................................: ", self.current_c3d)
-            self.progress = 3
+    def resume_batch(self, path=None):
+        """Resumes a batch from its manifest, starting each take at its first stage that is not done"""
 
-        if self.progress == 3:
+        if self.running:
+            print("Batch solve is already running")
+            return
 
-            # Solve
-            self.solve_obj.solve_c3d()
-            print("Solve completed..............................................: ", self.current_c3d)
-            self.progress = 4
+        if path is None:
+            paths = cmds.fileDialog2(fm=1, fileFilter="*.json", dialogStyle=2, dir=BATCHES_FOLDER)
+            if not paths:
+                return
+            path = paths[0]
 
-        if self.progress == 4:
+        self.manifest = Manifest.load(path)
+        for line in self.manifest.summary():
+            print(line)
+        self.start_batch()
 
-            # Save
-            self.solve_obj.save_file(self.current_c3d)
-            print("Saved...............................................................: ", self.current_c3d)
-            self.progress = 5
+    def start_batch(self):
+        self.todo = self.manifest.incomplete()
+        self.take = None
+        self.progress = 0
+        self.running = True
+        self.run_steps()
 
-        if self.progress == 5:
+    def stop(self):
+        """Stops the batch after the current step"""
+        self.running = False
 
-            # Playblast
-            # Current_c3d eg: D:/CLIENTS/HOM/dog/outgoing/20210122_tracked_orders/0000233_B_edt.c3d
-            # shot_name eg: 0000233
-            shot_name = (((os.path.split(self.current_c3d)[1]).split(".")[0]).strip("_")).split("_")[0]
-            print("shot name for playblast = ", shot_name)
-            PlayBlast(shot_name)
-            self.progress = 6
+    def run_steps(self):
+        """This is where the main batch solve happens. It takes one c3d file at a time from the list, then imports it,
+        solves it (after setting frame range and selecting the root), saves it and playblasts it.  Steps are run
+        until the next one needs an idle cycle, then this is called again by evalDeferred."""
 
-        if self.progress == 6:
+        try:
+            while self.running:
+                if self.take is None:
+                    ret = self.next_take()
+                    if ret == WAIT:
+                        QtCore.QTimer.singleShot(500, self.run_steps)
+                        return
+                    if not ret:
+                        print("All done!", self.manifest.path)
+                        if self.encoder.pending():
+                            print("Still encoding %d takes in the background" % self.encoder.pending())
+                        self.running = False
+                        return
+                    if self.progress and self.steps[self.progress][2]:
+                        cmds.evalDeferred(self.run_steps, lowestPriority=True)
+                        return
+
+                name, step, idle, stage = self.steps[self.progress]
+                error = None
+                try:
+                    ret = step()
+                except Exception:
+                    error = traceback.format_exc()
+                    print(error)
+                    ret = False
+                if ret == WAIT:
+                    QtCore.QTimer.singleShot(500, self.run_steps)
+                    return
+                if ret is False:
+                    print("Batch stopped at %s: %s" % (name, self.current_c3d))
+                    self.manifest.finish(self.take, stage, ok=False, error=error or "%s failed" % name)
+                    self.running = False
+                    return
+
+                self.progress += 1
+                if self.progress == len(self.steps):
+                    self.progress = 0
+                    self.take = None
+                    continue
+
+                if self.steps[self.progress][2]:
+                    cmds.evalDeferred(self.run_steps, lowestPriority=True)
+                    return
+        except Exception:
+            # a failure outside the steps (picking the next take, the manifest, scheduling the next call) stops the
+            # batch, otherwise it would stay marked as running with nothing left to call this again
+            error = traceback.format_exc()
+            print(error)
+            self.running = False
+            if self.take is not None:
+                print("Batch stopped: %s" % self.current_c3d)
+                try:
+                    self.manifest.finish(self.take, self.steps[self.progress][3], ok=False, error=error)
+                except (IOError, OSError) as e:
+                    print("Could not update the manifest: " + str(e))
+
+    def next_take(self):
+        """Picks the next take in the manifest with stages still to do and the step to start it at.  Takes that
+        only need encoding are handed to the encoder.  Returns False when there are none left"""
+
+        while self.todo:
+            index = self.todo[0]
+            take = self.manifest.takes[index]
+            stage = self.manifest.next_stage(index)
+
+            if stage == "encode":
+                if self.encoder.full():
+                    return WAIT
+                self.todo.pop(0)
+                # movies from an encode that did not finish are incomplete
+                commands = take['outputs'].get('videos', [])
+                for command in commands:
+                    if os.path.exists(command['dest']):
+                        os.remove(command['dest'])
+                self.encode(index, shot_name(take['c3d']), commands)
+                continue
+
+            self.todo.pop(0)
+            self.take = index
+            self.current_c3d = take['c3d']
             self.progress = 0
+            if stage == "playblast":
+                cmds.file(take['outputs']['saved'], o=True, f=True)
+                self.progress = [i[0] for i in self.steps].index("playblast")
+            return True
+
+        return False
+
+    def encode(self, index, name, commands):
+        """Hands the encodes of a take to the background encoder, the manifest is updated when they finish"""
+
+        self.manifest.start(index, "encode")
+
+        def done(results):
+            failed = [i for i in results if i['returncode'] != 0]
+            error = "\n".join("%s: %s" % (i['dest'], i.get('error', "")) for i in failed)
+            self.manifest.finish(index, "encode", ok=not failed, error=error,
+                                 movies=[i['dest'] for i in results if i['returncode'] == 0])
+
+        self.encoder.submit(name, commands, callback=done)
+
+    def step_import(self):
+        print("Now processing..............................................", self.current_c3d)
+        self.manifest.start(self.take, "solve")
+        # Import
+        ImportData.import_file(self.current_c3d)
+        print("Imported file..............................................: ", self.current_c3d)
+
+    def step_range(self):
+        # Select root
+        root = self.select_root()  # For this to work, root name has to end with "c3d"
+        if root is None:
+            print("Root could not be found. Solve failed.")
+            return False
+
+        # Set start and end frames on timeline
+        take = self.manifest.takes[self.take]
+        self.frame_range = [take['start'], take['end']]
+        if self.frame_range[0] is not None and self.frame_range[1] is not None:
+            pm.playbackOptions(minTime=self.frame_range[0], maxTime=self.frame_range[1])
+
+    # this separation is important! else, solve does not take the user-defined frame range. also, maya freezes.
+
+    def step_prepare(self):
+        print("Delete history set framerange..........................................: ", self.current_c3d)
+        # Delete animation and history
+        self.solve_obj = Solve()
+        self.solve_obj.delete_prev_anim()
+        self.solve_obj.delete_history()
+        print("Now starting solve on..............................................: ", self.current_c3d)
+
+    def step_solve(self):
+        if not self.solve_obj.solve_c3d():
+            return False
+        print("Solve completed..............................................: ", self.current_c3d)
+
+    def step_save(self):
+        saved = self.solve_obj.save_file(self.current_c3d)
+        self.manifest.finish(self.take, "solve", saved=saved)
+        print("Saved...............................................................: ", self.current_c3d)
+
+    def step_playblast(self):
+        """Playblasts the views and hands the encoding to the background encoder, waiting first if it is too
+        far behind so the image sequences do not pile up"""
+        if self.encoder.full():
+            return WAIT
+
+        # Current_c3d eg: D:/CLIENTS/HOM/dog/outgoing/20210122_tracked_orders/0000233_B_edt.c3d
+        # shot_name eg: 0000233
+        name = shot_name(self.current_c3d)
+        print("shot name for playblast = ", name)
+        self.manifest.start(self.take, "playblast")
+        playblast = PlayBlast(name)
+        playblast.playblast(name)
+        commands = playblast.video_commands()
+        images = dict((view, i[1]) for view, i in playblast.views_imagefiles_dict.items())
+        self.manifest.finish(self.take, "playblast", images=images, videos=commands)
+        self.encode(self.take, playblast.shot_name, commands)
 
     @staticmethod
     def select_root():
         """selects the root in the scene (looks for transform object ending with 'c3d')"""
-        for transform_object in pm.ls(transforms=True):
-            if str(transform_object).endswith("c3d"):
-                print("Selecting root:", transform_object)
-                return transform_object  # eg: "0000246_edt_c3d"
-        print("No root found")
+        return batch.select_root()
 
     def get_frame_range(self, c3d_file):
         """Returns user-specified start and end frames if available."""
@@ -216,150 +368,6 @@ class BatchSolve(QtWidgets.QDialog):
         self.takes_table.clearContents()
 
 
-class ImportData:
-    def __init__(self):
-        self.file_browser()
-
-    def file_browser(self):
-        """ Opens a browser for user to select one c3d file. This method is used when import is done as a separate
-        one-time operation. It is not used for the batch_solve"""
-
-        basic_filter = "*.c3d"
-        last_directory = pm.optionVar(q="lastPeelC3dDir")
-        c3d_files = pm.fileDialog2(fm=1, fileFilter=basic_filter, dialogStyle=2, dir=last_directory)
-        if c3d_files is None or len(c3d_files) == 0:
-            raise RuntimeError("No c3d files selected for import")
-        c3d_file = c3d_files[0]
-
-        self.import_file(c3d_file)
-
-    @staticmethod
-    def import_file(c3d_file, merge=True, timecode=True, convert=False, debug=False):
-        """Assigns values to attributes for peelC3D import, selects the root, imports and checks if the imported
-        data pertains to the same dog as the previous data."""
-
-        # Settings for peelC3d import
-        pm.optionVar(sv=("lastPeelC3dDir", os.path.split(c3d_file)[0]))
-
-        # print("loading c3d: %s  merge: %s   timecode: %s    convert: %s" %
-        #       (str(c3d_file), str(merge), str(timecode), str(convert)))
-
-        c3d_file = c3d_file.replace("\\", "/")
-
-        # Check for root in scene.
-        # roots = pm.ls(selection=True)  # returns an array
-        #
-        # if roots is None or len(roots) == 0:
-        #     raise RuntimeError("Could not find mocap root in the scene - is the rig loaded and selected?")
-
-        root = BatchSolve.select_root()  # ............................................................................................................................check
-
-        dog_name = ImportData.get_dog_name(root)
-
-        if merge:
-            pm.select(root)
-            pm.delete(root, channels=True, hierarchy='below')
-
-        options = ";scale=1;unlabelled=0;nodrop=0;"
-        options += "timecode=%d;" % int(bool(timecode))
-        options += "convert=%d;" % int(bool(convert))
-        options += "merge=%d;" % int(bool(merge))
-        options += "debug=%d;" % int(bool(debug))
-        import_cmd = 'file -import -type "peelC3D" -options "%s" "%s";' % (options, c3d_file)
-
-        try:
-            mel.eval(import_cmd)
-        except RuntimeError:
-            raise RuntimeError("Unable to load c3d - is the plugin loaded?")
-
-        if merge:
-            # rename the root
-            root = pm.rename(root, '_' + str(os.path.split(c3d_file)[1]).replace('.', '_'))
-
-        print("Checking if dogs match...")
-        new_dog_name = ImportData.get_dog_name(root)
-        if new_dog_name != dog_name:
-            raise RuntimeError("Not the same dog. Imported but not solved. Please start over.")
-
-        # Todo: Save file!
-
-    @staticmethod
-    def get_dog_name(root):
-        children = pm.listRelatives(root)
-
-        for child in children:
-            if child.startswith("Tyrus"):
-                return "Tyrus"
-            if child.startswith("Sterling"):
-                return "Sterling"
-        print("Could not determine which dog.")
-        return "No dog found"
-
-
-class Solve:
-    def __init__(self, save_file_path=r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves\temp_saves\temp_save.c3d'):
-
-        # data
-        self.solves_folder = r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves'
-
-        # # methods
-        # self.delete_prev_anim()
-        # self.solve_c3d()
-        # self.save_file_path = save_file_path
-
-    @staticmethod
-    def delete_prev_anim():
-        """ Delete all animation"""
-
-        # Delete all channels
-        pm.delete(all=True, channels=True)
-
-    @staticmethod
-    def delete_history():
-        """ Delete all history on joints"""
-
-        # Select all passive, i.e. joints
-        select_passive_cmd = "peelSolve2SelectType(3)"
-        try:
-            mel.eval(select_passive_cmd)
-        except RuntimeError as e:
-            print("Could not delete history on all joints")
-            return
-
-        # Delete history
-        pm.delete(constructionHistory=True)
-
-    @staticmethod
-    def solve_c3d():
-        """Solves the data for the range in timeline using PeelSolve"""
-
-        solve_cmd = "peelSolve2Run(1)"
-        try:
-            mel.eval(solve_cmd)
-        except RuntimeError as e:
-            print("Could not solve due to following error:")
-            print(str(e))
-            return
-        print("Solve completed.")
-
-    def save_file(self, current_c3d=None):  # current c3d eg" D:/shots/20210122_tracked_orders/_0000224_B_edt.c3d
-        """ Gets the file name and saves it """
-        # if current_c3d:
-
-        if not current_c3d:
-            current_c3d = self.save_file_path  # r'D:\CLIENTS\HOM\dog\shots\auto_solves\solves\temp_saves\temp_save.c3d'
-
-        shot_path = os.path.split(current_c3d)
-        shot_name = (shot_path[1].strip("_")).split("_")[0]  # eg: _000246_edt_c3d
-        # else:
-        #     shot_name = BatchSolve.select_root()
-        print("shot_name after split operation", shot_name)
-        file_name = file.create_file_name(shot_name, self.solves_folder)
-        pm.saveAs(file_name)
-        print("File saved as: ", file_name)
-
-
-
 INSTANCE = None
 
 
@@ -372,6 +380,13 @@ def batch_solve():
     return INSTANCE
 
 
+def resume_batch(path=None):
+    """ Resume a batch from its manifest, path defaults to asking for one """
+    instance = batch_solve()
+    instance.resume_batch(path)
+    return instance
+
+
 def import_data():
     ImportData()
 
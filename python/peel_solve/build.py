@@ -19,7 +19,7 @@
 # THE SOFTWARE.
 
 import maya.cmds as m
-from peel_solve import solve, locator, roots, rigidbody, file
+from peel_solve import solve, locator, roots, rigidbody, file, templates
 
 import os.path
 import os
@@ -39,19 +39,10 @@ def reconnect():
 
 
 def find_template(basedir, actor):
+    """ returns the last file in basedir/actor that starts with the actor name.  Directory listings are
+    cached, see templates.INDEX """
 
-    res = []
-
-    actor_dir = os.path.join(basedir, actor)
-
-    for i in os.listdir(actor_dir):
-        if i.lower().startswith(actor.lower()):
-            res.append(i)
-
-    if len(res) == 0:
-        return None
-
-    return os.path.join(actor_dir, sorted(res)[-1])
+    return templates.INDEX.find(basedir, actor)
 
 
 def build_solve(src_path, template_dir, actors=None):
@@ -79,18 +70,20 @@ def build_solve(src_path, template_dir, actors=None):
     has_rig = False
 
     if actors:
+        paths = []
         for name in actors:
             t = find_template(template_dir, name.replace(' ', '_'))
             if t:
-                if has_rig:
-                    m.file(t, i=True)
-                else:
-                    # Open it so we can get the fps settings, etc
-                    m.file(t, o=True)
-                    has_rig = True
+                paths.append(t)
             else:
                 print("Could not find template for: " + name)
                 print("Dir: " + template_dir)
+
+        if paths:
+            # The first template is opened so we get the fps settings, etc, the others are imported.  The
+            # combined scene is cached locally, see templates.rig_scene
+            templates.open_rig(paths)
+            has_rig = True
     else:
         raise RuntimeError("Not implemented yet")
 
@@ -0,0 +1,151 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import struct
+
+""" Reads the header and parameters of a c3d file (not the point data), so takes can be indexed without loading
+ them in to maya.  Does not depend on maya. """
+
+
+# TIMECODE:STANDARD values and the timecode rate they represent
+STANDARDS = {'PAL': 25.0, 'NTSC': 30.0, 'FILM': 24.0, 'SMPTE': 30.0}
+
+
+def read_parameters(path):
+    """ returns (header, parameters) where header is a dict of the header values and parameters is a
+    dict of "GROUP:PARAM" -> value.  Values are lists of numbers, or a string for character data """
+
+    with open(path, "rb") as fp:
+        header_block = fp.read(512)
+        param_block = bytearray(header_block)[0]
+        if bytearray(header_block)[1] != 0x50:
+            raise ValueError("Not a c3d file: " + str(path))
+
+        fp.seek((param_block - 1) * 512)
+        start = bytearray(fp.read(4))
+        blocks = start[2]
+        processor = start[3] - 83
+
+        fp.seek((param_block - 1) * 512)
+        data = fp.read(blocks * 512)
+
+    endian = '>' if processor == 3 else '<'
+
+    def read_float(raw):
+        if processor == 2:
+            # DEC: words swapped and the exponent biased by two
+            return struct.unpack('<f', raw[2:4] + raw[0:2])[0] / 4.0
+        return struct.unpack(endian + 'f', raw)[0]
+
+    hdr = struct.unpack(endian + 'BBhhHHh', header_block[:12])
+    header = {'points': hdr[2], 'analog': hdr[3], 'first_frame': hdr[4], 'last_frame': hdr[5],
+              'rate': read_float(header_block[20:24])}
+
+    groups = {}
+    params = {}
+    pos = 4
+    while pos + 2 <= len(data):
+        name_len, gid = struct.unpack('bb', data[pos:pos + 2])
+        if name_len == 0:
+            break
+        name_len = abs(name_len)
+        name = data[pos + 2:pos + 2 + name_len].decode('ascii', 'replace').upper()
+        offset_pos = pos + 2 + name_len
+        offset = struct.unpack(endian + 'H', data[offset_pos:offset_pos + 2])[0]
+
+        if gid < 0:
+            groups[-gid] = name
+        else:
+            body = offset_pos + 2
+            size, ndims = struct.unpack('bb', data[body:body + 2])
+            dims = list(bytearray(data[body + 2:body + 2 + ndims]))
+            count = 1
+            for i in dims:
+                count *= i
+            raw = data[body + 2 + ndims:body + 2 + ndims + count * abs(size)]
+            if size == -1:
+                value = raw.decode('ascii', 'replace').strip()
+            elif size == 1:
+                value = list(bytearray(raw))
+            elif size == 2:
+                value = list(struct.unpack(endian + '%dh' % count, raw))
+            elif size == 4:
+                value = [read_float(raw[i:i + 4]) for i in range(0, len(raw), 4)]
+            else:
+                value = None
+            params[(gid, name)] = value
+
+        if offset == 0:
+            break
+        pos = offset_pos + offset
+
+    ret = {}
+    for (gid, name), value in params.items():
+        ret[groups.get(gid, str(gid)) + ":" + name] = value
+
+    return header, ret
+
+
+def info(path):
+    """ returns a dict describing the take:
+
+    * rate - point rate
+    * frames - number of frames
+    * timecode - timecode string when the recording started, or None
+    * tc_rate - timecode rate, or None
+    * drop - True for drop frame timecode
+    * first_field - first field of the take at the point rate (see time_util.c3d_start)
+    """
+
+    header, params = read_parameters(path)
+
+    def unsigned(words):
+        # 32 bit values are stored as two 16 bit words
+        return (words[0] & 0xffff) + ((words[1] & 0xffff) << 16)
+
+    rate = params.get('POINT:RATE', [header['rate']])[0]
+
+    frames = header['last_frame'] - header['first_frame'] + 1
+    first_field = header['first_frame']
+    if 'TRIAL:ACTUAL_START_FIELD' in params and 'TRIAL:ACTUAL_END_FIELD' in params:
+        first_field = unsigned(params['TRIAL:ACTUAL_START_FIELD'])
+        frames = unsigned(params['TRIAL:ACTUAL_END_FIELD']) - first_field + 1
+
+    ret = {'rate': rate, 'frames': frames, 'first_field': first_field,
+           'timecode': None, 'tc_rate': None, 'drop': False}
+
+    tc = params.get('TIMECODE:TIMECODE')
+    if tc and len(tc) >= 4:
+        ret['timecode'] = "%02d:%02d:%02d:%02d" % tuple(int(i) for i in tc[:4])
+        standard = params.get('TIMECODE:STANDARD')
+        if standard is not None and not isinstance(standard, list):
+            standard = standard.upper()
+            if standard in STANDARDS:
+                ret['tc_rate'] = STANDARDS[standard]
+            else:
+                try:
+                    ret['tc_rate'] = float(standard)
+                except ValueError:
+                    pass
+        drop = params.get('TIMECODE:DROP_FRAMES')
+        ret['drop'] = bool(drop and drop[0])
+
+    return ret
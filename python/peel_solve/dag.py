@@ -164,8 +164,9 @@ def anim_curve(node, attr, create=False):
 def apply_curve(node, attr, data, stepped=False):
     ''' creates an anim curve for the data (dict) '''
 
-    k = data.keys()
-    v = data.values()
+    # keys views can not be indexed on python 3, and the keys must be added in time order
+    k = sorted(data)
+    v = [data[i] for i in k]
 
     tt = oma.MFnAnimCurve.kTangentStep if stepped else oma.MFnAnimCurve.kTangentGlobal
 
@@ -0,0 +1,151 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import math
+
+import maya.OpenMaya as om
+import maya.OpenMayaAnim as oma
+import maya.cmds as m
+
+from peel_solve import node_list
+
+""" Tracks edits to the optical marker curves so only the changed frames need to be re-solved """
+
+
+class MarkerState(object):
+    """ Snapshot of the optical marker curves, with an anim curve edited callback to flag the curves
+    that have changed since the snapshot was taken.
+
+    * self.keys - dict of curve name -> {time: value}
+    * self.edited - set of curve names flagged by the callback
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.edited = set()
+        self.callback = None
+
+    def curves(self):
+        """ returns the anim curves driving the optical markers """
+        markers = node_list.all_markers()
+        if not markers:
+            return []
+        return list(set(m.listConnections(markers, s=True, d=False, type='animCurve') or []))
+
+    @staticmethod
+    def read(curve):
+        """ returns {time: value} for the curve """
+        k = m.keyframe(curve, q=True)
+        v = m.keyframe(curve, q=True, vc=True)
+        if k is None or v is None:
+            return {}
+        return dict(zip(k, v))
+
+    def snapshot(self):
+        """ record the current marker data as the clean state """
+        self.keys = dict((i, self.read(i)) for i in self.curves())
+        self.edited = set()
+
+    def start(self):
+        """ take a snapshot and start listening for curve edits """
+        self.snapshot()
+        if self.callback is None:
+            self.callback = oma.MAnimMessage.addAnimCurveEditedCallback(self.on_edited)
+
+    def stop(self):
+        """ stop listening for curve edits """
+        if self.callback is not None:
+            om.MMessage.removeCallback(self.callback)
+            self.callback = None
+
+    def on_edited(self, edited, client_data=None):
+        for i in range(edited.length()):
+            self.edited.add(om.MFnDependencyNode(edited[i]).name())
+
+    def dirty_frames(self):
+        """ returns a sorted list of frames where the marker data differs from the snapshot """
+
+        current = set(self.curves())
+
+        if self.callback is None:
+            # not listening for edits, compare every curve
+            check = current | set(self.keys)
+        else:
+            check = (self.edited & current) | (current ^ set(self.keys))
+
+        frames = set()
+        for curve in check:
+            before = self.keys.get(curve, {})
+            after = self.read(curve) if curve in current else {}
+            for t in set(before) | set(after):
+                if before.get(t) != after.get(t):
+                    frames.add(t)
+
+        return sorted(frames)
+
+    def dirty_ranges(self, pad=5):
+        """ returns a list of (start, end) frame ranges that need re-solving, padded by pad frames.
+        Ranges that overlap once padded are merged """
+
+        ranges = []
+        for t in self.dirty_frames():
+            start = math.floor(t) - pad
+            end = math.ceil(t) + pad
+            if ranges and start <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        return [tuple(i) for i in ranges]
+
+
+STATE = None
+
+
+def track():
+    """ Start tracking edits to the optical marker curves from the current state """
+    global STATE
+    if STATE is None:
+        STATE = MarkerState()
+    STATE.start()
+    return STATE
+
+
+def stop():
+    """ Stop tracking edits """
+    global STATE
+    if STATE is not None:
+        STATE.stop()
+        STATE = None
+
+
+def clean():
+    """ Mark the current marker data as solved.  Does nothing if tracking has not been started """
+    if STATE is not None:
+        STATE.snapshot()
+
+
+def ranges(pad=5):
+    """ returns the padded frame ranges that have changed since the last solve, or None if not tracking """
+    if STATE is None:
+        return None
+    return STATE.dirty_ranges(pad)
@@ -0,0 +1,189 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import glob
+import os
+import os.path
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import Queue as queue_module
+except ImportError:
+    import queue as queue_module
+
+from peel_solve import process
+
+""" Encodes playblast image sequences in a background thread, so maya can go on to the next take while ffmpeg
+ runs.  The number of takes waiting to be encoded is bounded so the image sequences on disk do not pile up
+ when encoding is slower than solving.  The views of a take are encoded at the same time (see encode_all).
+ Does not depend on maya. """
+
+
+# Number of lines of ffmpeg's output kept for a failed encode
+ERROR_LINES = 20
+
+# Seconds an encode can run before it is killed
+TIMEOUT = 1800
+
+# Encodes run at once by encode_all, ffmpeg uses several threads itself
+WORKERS = 5
+
+
+def run_command(args, timeout=None):
+    """ run a command without a console window, killing it after timeout seconds.
+    Returns (returncode, output, timed out), returncode is None if it could not be started """
+
+    kwargs = process.popen_kwargs()
+    if sys.platform == "win32":
+        kwargs['creationflags'] = 0x08000000  # CREATE_NO_WINDOW
+
+    # no stdin, so ffmpeg can not wait on a prompt to overwrite
+    with open(os.devnull, "r") as devnull:
+        try:
+            proc = subprocess.Popen(args, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, **kwargs)
+        except OSError as e:
+            return None, str(e), False
+
+        timed_out = []
+
+        def kill():
+            # the timer can fire just as the process exits on its own
+            if proc.poll() is None:
+                timed_out.append(True)
+                process.kill_tree(proc)
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            output = proc.communicate()[0]
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    return proc.returncode, output, bool(timed_out)
+
+
+def encode_command(command, timeout=TIMEOUT):
+    """ run one encode, a dict of 'args' and 'dest'.  Returns {'dest', 'returncode', 'seconds', 'error'} """
+
+    start = time.time()
+    returncode, output, timed_out = run_command(command['args'], timeout)
+    result = {'dest': command['dest'], 'returncode': returncode, 'seconds': time.time() - start}
+    if timed_out:
+        result['error'] = "timed out after %ds" % timeout
+    elif returncode != 0:
+        result['error'] = "\n".join(output.splitlines()[-ERROR_LINES:])
+
+    if 'error' in result:
+        print("Encode failed (%s): %s\n%s" % (returncode, command['dest'], result['error']))
+        # a movie cut short would pass for a finished one
+        if os.path.isfile(command['dest']):
+            try:
+                os.remove(command['dest'])
+            except OSError as e:
+                print("Could not remove %s: %s" % (command['dest'], str(e)))
+    else:
+        print("Encoded: %s  (%ds)" % (command['dest'], result['seconds']))
+    return result
+
+
+def encode_all(commands, workers=WORKERS, timeout=TIMEOUT):
+    """ run the encodes at the same time, at most workers at once.  Returns their results in the same order """
+
+    if not commands:
+        return []
+    pool = ThreadPool(max(1, min(workers, len(commands))))
+    try:
+        return pool.map(lambda command: encode_command(command, timeout), commands)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Encoder(object):
+    """ Background encoding of image sequences.
+
+    Each take is submitted as a list of commands, dicts of 'args' (the ffmpeg command line), 'dest' (the movie)
+    and optionally 'images' (a glob of the image sequence, removed after a successful encode if remove_images).
+
+    * self.backlog - number of takes that can be submitted and not yet encoded
+    * self.results - list of {'name', 'dest', 'returncode', 'seconds', 'error'} for the finished encodes
+    """
+
+    def __init__(self, backlog=2, remove_images=False, workers=WORKERS, timeout=TIMEOUT):
+        self.backlog = backlog
+        self.remove_images = remove_images
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = queue_module.Queue(maxsize=backlog)
+        self.results = []
+        self.thread = None
+
+    def full(self):
+        """ True if submitting another take would go over the backlog """
+        return self.queue.unfinished_tasks >= self.backlog
+
+    def pending(self):
+        """ number of takes submitted and not finished encoding """
+        return self.queue.unfinished_tasks
+
+    def submit(self, name, commands, callback=None):
+        """ queue the encodes of a take, blocking if the backlog is full.  callback is called from the encoding
+        thread with the results of the take's encodes when they are done """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put((name, commands, callback))
+
+    def wait(self):
+        """ block until everything submitted has been encoded """
+        self.queue.join()
+
+    def run(self):
+        while True:
+            name, commands, callback = self.queue.get()
+            try:
+                results = self.encode(name, commands)
+                if callback is not None:
+                    callback(results)
+            finally:
+                self.queue.task_done()
+
+    def encode(self, name, commands):
+        """ run the commands of a take, returns their results """
+        ret = encode_all(commands, self.workers, self.timeout)
+        for command, result in zip(commands, ret):
+            result['name'] = name
+            if result['returncode'] == 0 and self.remove_images and command.get('images'):
+                for image in glob.glob(command['images']):
+                    os.remove(image)
+            self.results.append(result)
+        return ret
@@ -19,16 +19,28 @@
 # THE SOFTWARE.
 
 
-from peel_solve import roots, node_list
+from peel_solve import roots, node_list, anim_index
 import maya.cmds as m
 from maya import mel
+import errno
+import math
 import os
 
 
 def create_file_name(shot_name, solves_folder):
-    """Returns the name the the solved MB file needs to be saved as"""
-    versioned_file = get_latest_version_file(shot_name)
-    return versioned_file  # eg: D:/shots/solves/000246/00246_solved_v02.mb
+    """Returns the name the the solved MB file needs to be saved as.  The file is created empty to reserve the
+    version, so workers saving takes of the same shot at the same time each get their own"""
+    while True:
+        versioned_file = get_latest_version_file(shot_name, solves_folder)
+        try:
+            fd = os.open(versioned_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            # taken by another worker, look again
+            continue
+        os.close(fd)
+        return versioned_file  # eg: D:/shots/solves/000246/00246_solved_v02.mb
 
 
 def get_latest_version_file(shot_name, solves_folder):  # Todo: some repetition with the other get_new_version method.
@@ -36,7 +48,12 @@ def get_latest_version_file(shot_name, solves_folder):  # Todo: some repetition
 
     # if first version, create folder with shot name, return file name for saving
     if not os.path.isdir(os.path.join(solves_folder, shot_name)):
-        os.mkdir(os.path.join(solves_folder, shot_name))
+        try:
+            os.mkdir(os.path.join(solves_folder, shot_name))
+        except OSError:
+            # made by another worker
+            if not os.path.isdir(os.path.join(solves_folder, shot_name)):
+                raise
         first_version_file = os.path.join(solves_folder, shot_name, shot_name + "_solved_v001.mb")
         return first_version_file
 
@@ -205,12 +222,12 @@ def save_fbx(outfile=None, force=False, reload=True, delete_mesh=True, unlock_jo
     # save the joint list before deleting the markers
     j = node_list.joints()
 
-    keys = m.keyframe(j, q=True)
+    keys = anim_index.time_range(j)
 
     if not keys:
         raise RuntimeError("No keys on skeleton")
 
-    m.playbackOptions(min=math.floor(min(keys)), max=math.ceil(max(keys)))
+    m.playbackOptions(min=math.floor(keys[0]), max=math.ceil(keys[1]))
 
     # clean the scene
 
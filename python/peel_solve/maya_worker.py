@@ -0,0 +1,276 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import json
+import os
+import os.path
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from peel_solve import queue, process
+
+""" Long running worker that loads maya and the plugins once and runs the maya jobs in the spool
+ (see queue.add_maya), instead of starting mayabatch for each job.  The worker restarts itself after a
+ number of jobs or when its memory has grown too much, use --supervise to respawn it:
+
+    mayapy -m peel_solve.maya_worker --supervise --jobs 50 --memory 4000
+
+ --standin runs the jobs without maya, for testing the spool on machines that do not have it. """
+
+
+# Exit code used by the worker to ask the supervisor for a fresh process
+RESTART = 3
+
+
+class MayaSession(object):
+    """ Runs jobs in maya standalone """
+
+    def start(self):
+        import maya.standalone
+        maya.standalone.initialize(name='python')
+
+        import maya.cmds as m
+        import maya.mel as mel
+        self.m = m
+        self.mel = mel
+
+        from peel_solve import solve
+        try:
+            solve.load_plugin()
+        except RuntimeError as e:
+            print("Could not load peelsolve: " + str(e))
+
+        try:
+            m.loadPlugin("fbxmaya")
+        except RuntimeError as e:
+            print("Could not load fbxmaya: " + str(e))
+
+    def reset(self):
+        """ empty scene between jobs """
+        self.m.file(new=True, force=True)
+        self.m.flushUndo()
+
+    def run(self, job):
+        self.reset()
+        self.m.file(job['src'], o=True, f=True)
+        for line in job.get('mel', []):
+            self.mel.eval(line)
+        namespace = {'__name__': '__peel_job__'}
+        for line in job.get('python', []):
+            exec(line, namespace)
+        self.m.file(rename=job['dest'])
+        file_type = "mayaAscii" if job['dest'].lower().endswith(".ma") else "mayaBinary"
+        self.m.file(save=True, type=file_type)
+
+
+class StandInSession(object):
+    """ Runs jobs without maya.  The python lines are run, the mel is printed and the source file is copied to
+    the destination, so the spool and the worker restarts can be tested """
+
+    def start(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def run(self, job):
+        for line in job.get('mel', []):
+            print("mel: " + line)
+        namespace = {'__name__': '__peel_job__'}
+        for line in job.get('python', []):
+            exec(line, namespace)
+        if os.path.isfile(job['src']):
+            shutil.copyfile(job['src'], job['dest'])
+
+
+def run_job(session, working_file):
+    """ run a claimed job in this process.  A thread renews the lease while the job runs and watches for the
+    job's cancel file and timeout.  A job running in maya can not be interrupted, so when it is cancelled or
+    times out the thread finishes it and exits the process with RESTART for the supervisor to replace """
+
+    name = os.path.split(working_file)[1]
+    with open(working_file, "r") as fp:
+        data = json.load(fp)
+    data['worker'] = queue.worker_id()
+    data['host'] = socket.gethostname()
+    data['started'] = time.time()
+
+    print("Running: " + queue.info(working_file))
+
+    deadline = data['started'] + data['timeout'] if data.get('timeout') else None
+    cancel_file = queue.spool_file("cancel", name)
+    done = threading.Event()
+    lock = threading.Lock()
+    lost = []
+    stopped = []
+
+    def stop(reason):
+        with lock:
+            if done.is_set():
+                return
+            stopped.append(reason)
+        print("Stopping %s: %s" % (name, reason))
+        try:
+            data['returncode'] = -1
+            data['err'] = "Job " + reason
+            queue.finish_attempt(working_file, data, reason)
+        finally:
+            os._exit(RESTART)
+
+    def heartbeat():
+        renewed = time.time()
+        while not done.wait(1.0):
+            if os.path.isfile(cancel_file):
+                return stop("cancelled")
+            if deadline is not None and time.time() > deadline:
+                return stop("timeout")
+            if time.time() - renewed > queue.LEASE_TIMEOUT / 4:
+                if not queue.renew_lease(name):
+                    lost.append(True)
+                    return
+                renewed = time.time()
+
+    t = threading.Thread(target=heartbeat)
+    t.daemon = True
+    t.start()
+
+    try:
+        session.run(data['maya'])
+        data['returncode'] = 0
+        data['err'] = ""
+    except Exception:
+        data['returncode'] = 1
+        data['err'] = traceback.format_exc()
+        print(data['err'])
+    finally:
+        with lock:
+            done.set()
+        # if the job was stopped this waits for the heartbeat thread to finish it and exit the process
+        t.join()
+
+    if lost:
+        print("Lost lease: " + name)
+        return
+
+    # peak of the whole worker process, which includes the jobs before this one
+    data['peak_rss'] = process.peak_rss()
+    data['rss'] = process.rss()
+
+    queue.finish_attempt(working_file, data)
+
+
+def serve(session, jobs=50, memory=None, idle=None, poll=1.0):
+    """ run maya jobs from the spool.  Returns RESTART after the number of jobs or when memory (MB) has been
+    added since the start, 0 if there has been no work for idle seconds.  The maya license held by the
+    session is counted in the host's resources while it runs (see queue.Resources) """
+
+    session.start()
+    resources = queue.Resources()
+    resources.acquire({'maya': 1})
+    try:
+        start_rss = process.rss()
+        count = 0
+        last = time.time()
+        beat = 0
+        archived = time.time()
+
+        while True:
+            if time.time() - beat > queue.LEASE_TIMEOUT / 4:
+                queue.requeue_expired()
+                queue.check_cancelled([])
+                beat = time.time()
+
+            if time.time() - archived > queue.ARCHIVE_INTERVAL:
+                queue.archive()
+                archived = time.time()
+
+            working_file = queue.claim_job(kinds=(".maya",))
+            if working_file is None:
+                if idle is not None and time.time() - last > idle:
+                    return 0
+                time.sleep(poll)
+                continue
+
+            run_job(session, working_file)
+            count += 1
+            last = time.time()
+
+            if jobs and count >= jobs:
+                print("Restarting after %d jobs" % count)
+                return RESTART
+
+            rss = process.rss()
+            if memory and start_rss is not None and rss is not None:
+                grown = (rss - start_rss) / (1024.0 * 1024.0)
+                if grown > memory:
+                    print("Restarting, memory has grown by %dMB" % grown)
+                    return RESTART
+    finally:
+        resources.release({'maya': 1})
+
+
+def supervise(args):
+    """ run the worker in a child process, starting a new one when it asks to restart or crashes """
+
+    while True:
+        proc = subprocess.Popen([sys.executable, "-m", "peel_solve.maya_worker"] + args)
+        code = proc.wait()
+        if code == 0:
+            return
+        if code != RESTART:
+            # jobs it was running are recovered when their leases expire
+            print("Worker exited with %d, restarting" % code)
+            time.sleep(5)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run maya jobs from the spool in a persistent process")
+    parser.add_argument("--spool", help="spool directory, default: " + queue.SPOOL)
+    parser.add_argument("--jobs", type=int, default=50, help="restart after this many jobs, 0 for never")
+    parser.add_argument("--memory", type=float, help="restart when memory has grown by this many MB")
+    parser.add_argument("--idle", type=float, help="exit after this many seconds without a job")
+    parser.add_argument("--standin", action="store_true", help="run the jobs without maya, for testing")
+    parser.add_argument("--supervise", action="store_true", help="run the worker in a child process "
+                                                                 "and restart it as needed")
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+
+    if args.supervise:
+        supervise([i for i in argv if i != "--supervise"])
+        return 0
+
+    if args.spool:
+        queue.SPOOL = args.spool
+
+    session = StandInSession() if args.standin else MayaSession()
+    return serve(session, jobs=args.jobs, memory=args.memory, idle=args.idle)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -72,6 +72,11 @@ def create():
         m.menuItem(label="Solve Single Frame", command=ps + "ps.frame()")
         m.menuItem(label="Solve All Frames", command=ps + "ps.solve()")
         m.menuItem(label="Refine All Frames", command=ps + "ps.solve('refine')")
+        m.menuItem(label="Track Marker Edits", command="import peel_solve.dirty as dirty;dirty.track()")
+        m.menuItem(label="Solve Edited Frames", command=ps + "ps.solve_dirty()")
+        m.menuItem(label="Solve Standalone by Root", command="import peel_solve.solve_setup as ss;"
+                                                             "ss.solve_parallel()")
+        m.menuItem(label="Auto Tune Solver Settings", command=ps + "ps.auto_tune()")
         m.menuItem(d=True)
         m.menuItem(label="Select", command=sel + "sel.select()")
         m.menuItem(ob=True, command=sel + "sel.options()")
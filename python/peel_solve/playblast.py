@@ -2,6 +2,10 @@ import os.path
 from maya import cmds
 import maya.OpenMaya as om
 import maya.OpenMayaUI as omui
+from peel_solve import encoder
+
+FFMPEG_EXE = r'd:\bin\ffmpeg.exe'
+
 
 class PlayBlast:  # provide shot name, eg: "000246"
     def __init__(self, shot_name=None, start_frame=None, end_frame=None):
@@ -30,12 +34,12 @@ class PlayBlast:  # provide shot name, eg: "000246"
         if start_frame is not None:
             self.start_frame = start_frame
         else:
-            self.start_frame = pm.playbackOptions(q=True, min=True)
+            self.start_frame = cmds.playbackOptions(q=True, min=True)
 
         if end_frame is not None:
             self.end_frame = end_frame
         else:
-            self.end_frame = pm.playbackOptions(q=True, max=True)
+            self.end_frame = cmds.playbackOptions(q=True, max=True)
 
         #
         self.cameras = {
@@ -85,9 +89,9 @@ class PlayBlast:  # provide shot name, eg: "000246"
 
 
         for cam in cmds.ls(type="camera"):
-            pm.setAttr(cam + ".horizontalPan", 0)
-            pm.setAttr(cam + ".verticalPan", 0)
-            pm.setAttr(cam + ".zoom", 1)
+            cmds.setAttr(cam + ".horizontalPan", 0)
+            cmds.setAttr(cam + ".verticalPan", 0)
+            cmds.setAttr(cam + ".zoom", 1)
 
 
     def playblast(self, shot_name):
@@ -102,23 +106,26 @@ class PlayBlast:  # provide shot name, eg: "000246"
 
         for view in self.cameras.keys():
 
-            self.setup_camera(view)
             print(view)
 
             camera_wise_folder = os.path.join(shot_folder, view)
             os.mkdir(camera_wise_folder)
             file_name = os.path.join(camera_wise_folder, shot_name + "_" + view)
-            cmds.lookThru(self.cameras[view])
-
-            cmds.playblast(widthHeight=(self.width, self.height),  epn=self.current_panel(),
-                         filename=file_name, showOrnaments=self.show_ornaments, percent=self.percent,
-                         format=self.format, compression=self.compression, framePadding=self.padding,
-                         startTime=self.start_frame, endTime=self.end_frame, viewer=False)
+            self.playblast_view(view, file_name)
 
             self.views_imagefiles_dict[view] = [shot_folder.split("\\")[-1], file_name]
         print("Playblasts complete. Saved at: ", shot_folder)
         return
 
+    def playblast_view(self, view, file_name):
+        """ playblast one of the views to an image sequence, file_name is the path without frame or extension """
+        self.setup_camera(view)
+        cmds.lookThru(self.cameras[view])
+        cmds.playblast(widthHeight=(self.width, self.height),  epn=self.current_panel(),
+                       filename=file_name, showOrnaments=self.show_ornaments, percent=self.percent,
+                       format=self.format, compression=self.compression, framePadding=self.padding,
+                       startTime=self.start_frame, endTime=self.end_frame, viewer=False)
+
     def current_camera(self):
 
         view = omui.M3dView.active3dView()
@@ -164,53 +171,67 @@ class PlayBlast:  # provide shot name, eg: "000246"
 
         return latest_version  # returns int
 
-    def convert_images_to_videos(self):
-        # create a folder for the videos
-        self.video_folder = os.path.join(self.video_folder, self.shot_name)
-        try:
-            os.mkdir(self.video_folder)
-        except OSError as e:
-            print("Video folder already exists at %s. Please delete it and retry ffmpeg" % self.video_folder)
-            print(str(e))
-            return
-
-        for view, file_names in self.views_imagefiles_dict.items():
-            image_seq_path = file_names[1] + '.%04d.' + self.compression  # this format is needed for ffmpeg command
-            self.run_ffmpeg_command(image_seq_path, self.video_folder + "\\" + view)
-
-    def run_ffmpeg_command(self, source_path=None, dest_path=None):
-        # TODO: check if files/folders exist
-
-        # find duration
-        start_frame = self.start_frame
-        if start_frame > self.end_frame:
-            print("Error: Start frame {} greater than end frame {}".format(start_frame, self.end_frame))
-            return
-        duration = self.end_frame - start_frame
+    def video_commands(self, ffmpeg=FFMPEG_EXE):
+        """ returns the ffmpeg commands to encode the playblasted views, for encoder.Encoder: a list of dicts of
+        'args', 'dest' and 'images' (a glob of the image sequence).  Views with an existing video are skipped """
 
-        source_path = source_path.replace("\\", "/")
-        dest_path = dest_path.replace("\\", "/") + ".mp4"
+        video_folder = os.path.join(self.video_folder, self.shot_name)
+        if not os.path.isdir(video_folder):
+            os.makedirs(video_folder)
 
+        ret = []
+        for view, file_names in self.views_imagefiles_dict.items():
+            source = file_names[1] + '.%04d.' + self.compression
+            dest = os.path.join(video_folder, view + ".mp4")
+            if os.path.exists(dest):
+                print("Video already exists, skipping. Please delete it and retry.", dest)
+                continue
+            ret.append({'args': ffmpeg_args(source, dest, self.start_frame, self.end_frame, ffmpeg=ffmpeg),
+                        'dest': dest, 'images': file_names[1] + '.*.' + self.compression})
+        return ret
+
+    def convert_images_to_videos(self, timeout=None):
+        """ encodes the playblasted views to videos, all at the same time.  Returns the results, see
+        encoder.encode_command """
+        results = encoder.encode_all(self.video_commands(), timeout=timeout or encoder.TIMEOUT)
+        failed = [i for i in results if i['returncode'] != 0]
+        print("Encoded %d of %d views" % (len(results) - len(failed), len(results)))
+        return results
+
+    def run_ffmpeg_command(self, source_path=None, dest_path=None, timeout=None):
+        """ encodes one image sequence to dest_path.mp4, returns the ffmpeg exit code or None if it failed to
+        run """
+        if self.start_frame > self.end_frame:
+            print("Error: Start frame {} greater than end frame {}".format(self.start_frame, self.end_frame))
+            return None
+
+        dest_path = dest_path + ".mp4"
         if os.path.exists(dest_path):
             print("Convert failed. Video already exists. Please delete it and retry.", dest_path)
-            return
+            return None
 
-        ffmpeg_command = "ffmpeg  -r 60 -f image2 -s 1280x720 -start_number {start_frame} -i". \
-                             format(start_frame=start_frame) + \
-                         " {source} -vframes {duration}  -vcodec libx264 -crf 25 -pix_fmt yuv420p {destination}". \
-                             format(source=source_path, duration=duration, destination=dest_path)
-        print("Command: ", ffmpeg_command)
-
-        os.chdir(r"d:\bin")  # change command prompt directory : point to the ffmpeg.exe file
-        try:
-            os.system(ffmpeg_command)
-        except RuntimeError as e:
-            print("ffmpeg command failed. video not created. Error message:")
-            print(str(e))
-            return
+        args = ffmpeg_args(source_path, dest_path, self.start_frame, self.end_frame, ffmpeg=FFMPEG_EXE)
+        print("Command: ", " ".join(args))
+        return encoder.encode_command({'args': args, 'dest': dest_path}, timeout or encoder.TIMEOUT)['returncode']
 
 
 def render_all_views(shot_name=None):
     """ Creates playblast videos of the top, front and side custom camera views """
     playblast = PlayBlast(shot_name)
-    playblast.playblast_and_convert()
\ No newline at end of file
+    playblast.playblast_and_convert()
+
+
+def render_view(view, file_name, shot_name=None):
+    """ Playblasts a single view of the current scene to file_name.####.jpg, used by spooled playblast jobs """
+    playblast = PlayBlast(shot_name)
+    folder = os.path.dirname(file_name)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    playblast.playblast_view(view, file_name)
+
+
+def ffmpeg_args(source_path, dest_path, start_frame, end_frame, ffmpeg="ffmpeg"):
+    """ ffmpeg command line to encode an image sequence (path with %04d for the frame) to an mp4 """
+    return [ffmpeg, "-r", "60", "-f", "image2", "-s", "1280x720", "-start_number", str(int(start_frame)),
+            "-i", source_path.replace("\\", "/"), "-vframes", str(int(end_frame - start_frame)),
+            "-vcodec", "libx264", "-crf", "25", "-pix_fmt", "yuv420p", dest_path.replace("\\", "/")]
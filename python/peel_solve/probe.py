@@ -0,0 +1,208 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import json
+import os
+import os.path
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+
+""" Reads the start timecode, rate and length of movie files with ffprobe.  Results are cached on disk by
+ path, size and modification time so a file is only probed once.  Does not depend on maya. """
+
+
+FFPROBE = "M:\\bin\\ffprobe.exe"
+
+
+def cache_path():
+    """ returns the location of the probe cache, set PEEL_PROBE_CACHE to override """
+    path = os.environ.get("PEEL_PROBE_CACHE")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".peel_solve", "probe_cache.json")
+
+
+class ProbeCache(object):
+    """ Probe results stored in a json file.
+
+    * self.data - dict of "path|size|mtime" -> probe result
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path()
+        self.lock = threading.Lock()
+        self.data = {}
+        self.modified = False
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as fp:
+                    self.data = json.load(fp)
+            except ValueError as e:
+                print("Ignoring invalid probe cache: %s  (%s)" % (self.path, str(e)))
+
+    @staticmethod
+    def key(file_path):
+        st = os.stat(file_path)
+        return "%s|%d|%d" % (os.path.normcase(os.path.abspath(file_path)), st.st_size, int(st.st_mtime))
+
+    def get(self, file_path):
+        with self.lock:
+            return self.data.get(self.key(file_path))
+
+    def set(self, file_path, value):
+        with self.lock:
+            self.data[self.key(file_path)] = value
+            self.modified = True
+
+    def save(self):
+        """ write the cache if anything has been added """
+        with self.lock:
+            if not self.modified:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = self.path + ".%d.tmp" % os.getpid()
+            with open(tmp, "w") as fp:
+                json.dump(self.data, fp, indent=1)
+            if hasattr(os, "replace"):
+                os.replace(tmp, self.path)
+            else:
+                if os.path.isfile(self.path):
+                    os.remove(self.path)
+                os.rename(tmp, self.path)
+            self.modified = False
+
+
+CACHE = None
+CACHE_LOCK = threading.Lock()
+
+
+def cache():
+    """ returns the shared probe cache, created once when first called from any thread """
+    global CACHE
+    if CACHE is None:
+        with CACHE_LOCK:
+            if CACHE is None:
+                CACHE = ProbeCache()
+    return CACHE
+
+
+def parse_rate(value):
+    """ converts an ffprobe rate, e.g. "30000/1001", to a float.  returns None for 0/0 """
+    if not value:
+        return None
+    if '/' in value:
+        num, den = value.split('/')
+        if float(den) == 0 or float(num) == 0:
+            return None
+        return float(num) / float(den)
+    return float(value)
+
+
+def run_ffprobe(file_path):
+    """ runs ffprobe on the file and returns {'timecode', 'rate', 'frames', 'duration'} """
+
+    if not os.path.isfile(file_path):
+        raise RuntimeError("Could not find: " + file_path)
+
+    cmd = [FFPROBE, "-v", "error", "-print_format", "json",
+           "-show_entries", "stream=codec_type,r_frame_rate,nb_frames,duration:stream_tags=timecode"
+                            ":format=duration:format_tags=timecode",
+           file_path]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("ffprobe failed on %s: %s" % (file_path, err.decode("utf8", "replace")))
+
+    data = json.loads(out.decode("utf8"))
+    if 'streams' not in data:
+        raise RuntimeError("Invalid file: " + str(file_path))
+
+    ret = {'timecode': None, 'rate': None, 'frames': None, 'duration': None}
+
+    for stream in data['streams']:
+        tags = stream.get('tags', {})
+        if 'timecode' in tags:
+            ret['timecode'] = str(tags['timecode'])
+            rate = parse_rate(stream.get('r_frame_rate'))
+            if rate is not None:
+                ret['rate'] = rate
+
+        if stream.get('codec_type') == 'video':
+            if ret['rate'] is None:
+                ret['rate'] = parse_rate(stream.get('r_frame_rate'))
+            if stream.get('nb_frames'):
+                ret['frames'] = int(stream['nb_frames'])
+            if stream.get('duration'):
+                ret['duration'] = float(stream['duration'])
+
+    fmt = data.get('format', {})
+    if ret['timecode'] is None and 'timecode' in fmt.get('tags', {}):
+        ret['timecode'] = str(fmt['tags']['timecode'])
+    if ret['duration'] is None and fmt.get('duration'):
+        ret['duration'] = float(fmt['duration'])
+    if ret['frames'] is None and ret['duration'] is not None and ret['rate']:
+        ret['frames'] = int(round(ret['duration'] * ret['rate']))
+
+    return ret
+
+
+def probe(file_path, use_cache=True):
+    """ returns the probe data for a movie, from the cache if the file has not changed """
+
+    if not use_cache:
+        return run_ffprobe(file_path)
+
+    c = cache()
+    ret = c.get(file_path)
+    if ret is None:
+        ret = run_ffprobe(file_path)
+        c.set(file_path, ret)
+    return ret
+
+
+def probe_many(paths, workers=8, use_cache=True):
+    """ probes the movies in a pool of threads.  returns a dict of path -> probe data, or the exception raised """
+
+    def work(path):
+        try:
+            return path, probe(path, use_cache)
+        except Exception as e:
+            return path, e
+
+    todo = list(paths)
+    if not todo:
+        return {}
+
+    pool = ThreadPool(max(1, min(workers, len(todo))))
+    try:
+        ret = dict(pool.map(work, todo))
+    finally:
+        pool.close()
+        pool.join()
+
+    if use_cache:
+        cache().save()
+
+    return ret
@@ -0,0 +1,169 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import errno
+import os
+import sys
+
+""" Memory use and termination of processes, for the spool workers.  psutil is used for memory if it is
+ installed, otherwise the windows api or /proc.  Does not depend on maya. """
+
+
+def win_counters(handle):
+    """ returns PROCESS_MEMORY_COUNTERS for a process handle, or None """
+    import ctypes
+    import ctypes.wintypes
+
+    class Counters(ctypes.Structure):
+        _fields_ = [("cb", ctypes.wintypes.DWORD),
+                    ("PageFaultCount", ctypes.wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = Counters()
+    counters.cb = ctypes.sizeof(Counters)
+    if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.c_void_p(int(handle)), ctypes.byref(counters),
+                                                counters.cb):
+        return counters
+    return None
+
+
+def proc_status(pid, key):
+    """ returns a value in kB from /proc/<pid>/status as bytes, or None """
+    try:
+        with open("/proc/%s/status" % pid, "r") as fp:
+            for line in fp:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def rss(pid=None):
+    """ returns the resident memory of a process (default: this one) in bytes, or None if it can not be read """
+
+    try:
+        import psutil
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    except ImportError:
+        pass
+
+    if sys.platform == "win32":
+        if pid is not None and pid != os.getpid():
+            return None
+        import ctypes
+        counters = win_counters(ctypes.windll.kernel32.GetCurrentProcess())
+        return counters.WorkingSetSize if counters else None
+
+    return proc_status("self" if pid is None else pid, "VmRSS")
+
+
+def peak_rss(proc=None):
+    """ returns the peak resident memory in bytes of a subprocess.Popen (default: this process), or None.
+    On windows this works after the process has exited, elsewhere the process must still be running
+    unless psutil is used to sample it """
+
+    if proc is None:
+        if sys.platform == "win32":
+            import ctypes
+            counters = win_counters(ctypes.windll.kernel32.GetCurrentProcess())
+            return counters.PeakWorkingSetSize if counters else None
+        return proc_status("self", "VmHWM")
+
+    if sys.platform == "win32" and getattr(proc, "_handle", None) is not None:
+        counters = win_counters(proc._handle)
+        return counters.PeakWorkingSetSize if counters else None
+
+    value = proc_status(proc.pid, "VmHWM")
+    if value is None:
+        value = rss(proc.pid)
+    return value
+
+
+def alive(pid):
+    """ returns True if a process with the pid is running on this machine """
+
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+
+    if sys.platform == "win32":
+        import ctypes
+        import ctypes.wintypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.wintypes.DWORD()
+        ok = ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return not ok or code.value == 259
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # exists but belongs to another user
+        return e.errno == errno.EPERM
+    return True
+
+
+def popen_kwargs():
+    """ arguments for subprocess.Popen so the process and its children can be killed with kill_tree() """
+    if sys.platform == "win32":
+        return {}
+    if sys.version_info[0] >= 3:
+        return {'start_new_session': True}
+    return {'preexec_fn': os.setsid}
+
+
+def kill_tree(proc):
+    """ kill a subprocess.Popen and every process it started.  On windows taskkill is used, elsewhere the
+    process group made by popen_kwargs() is killed """
+
+    if proc.poll() is not None:
+        return
+
+    if sys.platform == "win32":
+        import subprocess
+        subprocess.call(["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        import signal
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    if proc.poll() is None:
+        proc.kill()
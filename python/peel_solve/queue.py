@@ -1,14 +1,52 @@
+import collections
+import errno
 import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
 import os.path
+import re
+import socket
 import tempfile
 import subprocess
+import threading
+import time
+
+from peel_solve import spool_index, process
+
+
+# Spool root, set PEEL_SPOOL or use --spool to use another one, e.g. a local directory for testing
+SPOOL = os.environ.get("PEEL_SPOOL", r'M:\spool\jobs')
+
+# Seconds without a heartbeat before a job's lease expires and the job is put back in todo
+LEASE_TIMEOUT = float(os.environ.get("PEEL_SPOOL_LEASE", 120))
+
+# Seconds before the first retry of a failed idempotent job, doubled for each attempt up to RETRY_MAX
+RETRY_DELAY = 30.0
+RETRY_MAX = 3600.0
+
+# mayabatch used for maya jobs that are not run by a warm maya_worker, set PEEL_MAYA_BATCH to use another version
+MAYA_BATCH = os.environ.get("PEEL_MAYA_BATCH", r'C:\Program Files\Autodesk\Maya2020\bin\mayabatch.exe')
+
+# Seconds between archiving old finished jobs and compacting the journal in workers that keep running
+ARCHIVE_INTERVAL = 3600.0
+
+# Times a job is recovered from a worker that died before it is failed, so a job that crashes its worker is
+# not run forever
+MAX_REQUEUES = 3
 
 
 def spool_file(section, name=None):
     """ Create a path to a directory or file in the spool """
-    d = os.path.join(r'M:\spool\jobs', section)
+    d = os.path.join(SPOOL, section)
     if not os.path.isdir(d):
-        os.mkdir(d)
+        try:
+            os.mkdir(d)
+        except OSError:
+            # created by another worker
+            if not os.path.isdir(d):
+                raise
 
     if name is None:
         return d
@@ -34,80 +72,904 @@ def list_dir(section):
     return [i[0] for i in res]
 
 
+INDEX = None
+
+
+def index():
+    """ returns the journal index of the spool """
+    global INDEX
+    if INDEX is None or INDEX.root != SPOOL:
+        INDEX = spool_index.SpoolIndex(SPOOL)
+    return INDEX
+
+
+def status():
+    """ returns a dict of state -> job file paths, oldest first, from the journal """
+    return dict((state, [spool_file(state, i) for i in names]) for state, names in index().status().items())
+
+
+def archive(days=7.0):
+    """ move finished jobs older than days to the archive and compact the journal """
+    return index().archive(days)
+
+
 def info(job_file):
     data = json.load(open(job_file))
     file = os.path.splitext(os.path.split(job_file)[1])[0]
     name = ""
     code = ""
+    timing = ""
     if 'name' in data: name = data['name']
     if 'returncode' in data: code = str(data['returncode'])
-    return "%15s  %30s  %30s" % (file, name, code)
+    if 'skipped' in data: code = "skipped"
+    if 'started' in data and 'enqueued' in data:
+        timing = "waited %.1fs" % (data['started'] - data['enqueued'])
+        if 'finished' in data:
+            timing += " ran %.1fs" % (data['finished'] - data['started'])
+    return "%15s  %30s  %30s  %s" % (file, name, code, timing)
+
+
+def spool_job(data, suffix=".job", depends=None):
+    """ write a job and return its id (file name).  The file is renamed in to place once it is complete so
+    workers never see a partial job.  The suffix is the kind of job, see claim_job().
+    Jobs that depend on other jobs (list of ids) wait in waiting/ until they have all finished """
+
+    data.setdefault('enqueued', time.time())
+
+    section = "todo"
+    if depends:
+        data['depends'] = list(depends)
+        section = "waiting"
+
+    with tempfile.NamedTemporaryFile(dir=spool_file(section), delete=False, mode="w+",
+                                     suffix=suffix + ".tmp") as fp:
+        json.dump(data, fp, indent=4)
+    path = fp.name[:-len(".tmp")]
+    os.rename(fp.name, path)
+    name = os.path.split(path)[1]
+    index().append(name, section, resources=data.get('resources'), not_before=data.get('not_before'))
+
+    if depends:
+        # the dependencies may have finished already
+        promote_waiting()
+
+    return name
 
 
-def add_job(name, arguments, meta=None):
-    """ spool a new job """
+def add_job(name, arguments, meta=None, depends=None, resources=None, timeout=None, retries=0,
+            idempotent=False):
+    """ spool a new job, returns its id.  depends is a list of job ids that must finish successfully before
+    this job starts.  resources is what the job needs while it runs, e.g. {'maya': 1, 'memory': 8000,
+    'threads': 4}, see host_resources().  timeout is the wall clock limit in seconds.  Jobs that are
+    idempotent (safe to run again) are retried up to retries times if they fail or time out """
     data = {'name': name, 'arguments': arguments}
     if meta is not None:
         data['meta'] = meta
-    with tempfile.NamedTemporaryFile(dir=spool_file("todo"), delete=False, mode="w+", suffix=".job") as fp:
-        json.dump(data, fp, indent=4)
+    if resources:
+        data['resources'] = resources
+    if timeout:
+        data['timeout'] = timeout
+    if idempotent:
+        data['idempotent'] = True
+        data['retries'] = retries
+    return spool_job(data, depends=depends)
+
+
+def cancel(job_id):
+    """ ask for a job to be cancelled.  A file is dropped in cancel/, the worker running the job kills it and
+    jobs that have not started are finished without running.  Dependents of a cancelled job are skipped """
+    with open(spool_file("cancel", job_id), "w") as fp:
+        fp.write(worker_id())
+
+
+# Cache of finished job id -> True if it succeeded, finished records do not change
+RESULTS = {}
+
+
+def succeeded(job_id):
+    """ returns True if a finished job ran and returned 0 """
+    if job_id not in RESULTS:
+        try:
+            with open(spool_file("finished", job_id), "r") as fp:
+                RESULTS[job_id] = json.load(fp).get('returncode') == 0
+        except (IOError, OSError, ValueError):
+            return False
+    return RESULTS[job_id]
+
+
+def promote_waiting():
+    """ move waiting jobs whose dependencies have all succeeded to todo.  Jobs with a dependency that failed,
+    was skipped or is not in the spool are finished without running, which skips their dependents in turn.
+    Returns the number of jobs moved """
+
+    idx = index()
+    count = 0
+    for name in idx.status().get("waiting", []):
+        waiting_file = spool_file("waiting", name)
+        try:
+            with open(waiting_file, "r") as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            # moved by another worker
+            continue
+
+        failed = None
+        ready = True
+        for dep in data.get('depends', []):
+            job = idx.jobs.get(dep)
+            if job is None:
+                failed = "missing dependency: " + dep
+                break
+            if job['state'] != 'finished':
+                ready = False
+                continue
+            if not succeeded(dep):
+                failed = "dependency failed: " + dep
+                break
+
+        if failed is not None:
+            if finish_unrun("waiting", name, 'skipped', failed):
+                count += 1
+
+        elif ready:
+            try:
+                os.rename(waiting_file, spool_file("todo", name))
+            except OSError:
+                continue
+            idx.append(name, 'todo', resources=data.get('resources'), not_before=data.get('not_before'))
+            count += 1
+
+    return count
+
+
+def finish_unrun(section, name, key, reason):
+    """ finish a job in todo or waiting without running it, recording the reason under key """
+    if not take_lease(name):
+        return False
+    working_file = spool_file("working", name)
+    try:
+        os.rename(spool_file(section, name), working_file)
+        with open(working_file, "r") as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        release_lease(name)
+        return False
+    data[key] = reason
+    print("Not running %s, %s" % (name, reason))
+    finish_job(working_file, data)
+    return True
+
+
+def check_cancelled(running):
+    """ handle the files in cancel/.  Running jobs are killed, jobs that have not started are finished.
+    Requests for jobs running on other workers are left for them """
+
+    directory = spool_file("cancel")
+    requests = [i for i in os.listdir(directory) if not i.startswith(".")]
+    if not requests:
+        return
+
+    idx = index()
+    idx.refresh()
+    for name in requests:
+        for job in running:
+            if job.name == name and job.reason is None:
+                job.kill("cancelled")
+        state = idx.jobs.get(name, {}).get('state')
+        if state == 'working':
+            # removed when the job finishes
+            continue
+        if state in ['todo', 'waiting']:
+            finish_unrun(state, name, 'cancelled', "cancelled")
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def total_memory():
+    """ returns the physical memory of this machine in MB, or None if it is not known """
+    try:
+        import psutil
+        return psutil.virtual_memory().total // (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def host_resources(host=None):
+    """ returns what this host can run at once: {'threads', 'memory' (MB), 'maya' (licenses)}.
+    Defaults can be overridden per host with hosts/<hostname>.json in the spool.  A resource that is None
+    is not limited """
+
+    ret = {'threads': multiprocessing.cpu_count(), 'memory': total_memory(), 'maya': 1}
+    path = spool_file("hosts", (host or socket.gethostname()) + ".json")
+    if os.path.isfile(path):
+        with open(path, "r") as fp:
+            ret.update(json.load(fp))
+    return ret
+
+
+class Resources(object):
+    """ Counts the resources used by the jobs running on this host.  The usage is kept in usage/<host>.json in
+    the spool, by worker, so every worker process on the host shares it, including warm maya_workers holding
+    a license.  Entries of workers that are no longer running are dropped.
+
+    * self.capacity - dict of resource -> amount available, see host_resources()
+    * self.used - dict of resource -> amount used by this worker
+    * self.others - dict of resource -> amount used by the other workers on this host, when it was last read
+    """
+
+    def __init__(self, capacity=None, host=None):
+        host = host or socket.gethostname()
+        self.capacity = host_resources(host) if capacity is None else capacity
+        self.path = spool_file("usage", host + ".json")
+        self.file_lock = spool_index.FileLock(self.path + ".lock")
+        self.used = {}
+        self.others = {}
+        self.warned = set()
+
+    def load(self):
+        """ returns the usage file as {worker: {resource: amount}} without dead workers, and updates
+        self.others.  The caller holds the lock """
+        usage = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as fp:
+                    usage = json.load(fp)
+            except (IOError, OSError, ValueError) as e:
+                print("Could not read %s: %s" % (self.path, str(e)))
+
+        me = worker_id()
+        self.others = {}
+        for worker, need in list(usage.items()):
+            if worker == me:
+                continue
+            if not process.alive(int(worker.rsplit(":", 1)[-1])):
+                del usage[worker]
+                continue
+            for key, value in need.items():
+                self.others[key] = self.others.get(key, 0) + value
+        return usage
+
+    def save(self):
+        """ write this worker's usage """
+        with self.file_lock:
+            usage = self.load()
+            used = dict((k, v) for k, v in self.used.items() if v)
+            if used:
+                usage[worker_id()] = used
+            else:
+                usage.pop(worker_id(), None)
+            write_json(self.path, usage)
+
+    def fits(self, need):
+        """ returns True if a job needing the resources could start now, using the usage last read.  Jobs that
+        need more than this host has are never started here, a warning is printed the first time each is seen """
+        for key, value in need.items():
+            cap = self.capacity.get(key)
+            if cap is None:
+                continue
+            if value > cap:
+                warning = (key, value)
+                if warning not in self.warned:
+                    self.warned.add(warning)
+                    print("Jobs needing %s %s are left for another host, %s has %s" %
+                          (value, key, socket.gethostname(), cap))
+                return False
+            if self.others.get(key, 0) + self.used.get(key, 0) + value > cap:
+                return False
+        return True
+
+    def claim(self, kinds=(".job",)):
+        """ claim_job() for a job that fits in what is left on this host and acquire its resources.  The usage
+        is locked while claiming, so two workers on the host can not both take the last of a resource.
+        Returns the working file path or None """
+        with self.file_lock:
+            self.load()
+            working_file = claim_job(kinds, fits=self.fits)
+            if working_file is not None:
+                with open(working_file, "r") as fp:
+                    self.acquire(json.load(fp).get('resources') or {})
+        return working_file
+
+    def acquire(self, need):
+        for key, value in need.items():
+            self.used[key] = self.used.get(key, 0) + value
+        if need:
+            self.save()
+
+    def release(self, need):
+        for key, value in need.items():
+            self.used[key] = self.used.get(key, 0) - value
+        if need:
+            self.save()
+
+
+def worker_id():
+    """ identifies this worker process in leases and job records """
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def spool_time():
+    """ returns the time according to the spool's file server, by writing to a file and reading back its
+    modification time.  Lease ages are measured with this.  Setting a time explicitly (os.utime) would use this
+    machine's clock, a write is stamped by the server on SMB and NFS shares.  Servers that take the time from
+    the client still work, but then the worker clocks must be kept in sync (e.g. with w32time or ntp) """
+    path = spool_file("leases", ".clock")
+    with open(path, "w") as fp:
+        fp.write(worker_id())
+    return os.stat(path).st_mtime
+
+
+def lease_file(name):
+    return spool_file("leases", name + ".lease")
+
+
+# Attempts at reading a lease before giving up, a read can fail while the file server is busy
+LEASE_READS = 3
+
+
+def read_lease(path):
+    """ returns the lease as a dict, None if the file does not exist or {} if it could not be read """
+    for attempt in range(LEASE_READS):
+        if attempt:
+            time.sleep(0.2 * attempt)
+        try:
+            with open(path, "r") as fp:
+                return json.load(fp)
+        except (IOError, OSError) as e:
+            if getattr(e, 'errno', None) == errno.ENOENT:
+                return None
+        except ValueError:
+            pass
+    return {}
+
+
+def take_lease(name):
+    """ create the lease for a job, returns False if another worker holds it.  The lease is created
+    exclusively before the job is moved, so two workers can never both think they own a job """
+    path = lease_file(name)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        return False
+    with os.fdopen(fd, "w") as fp:
+        json.dump({'worker': worker_id(), 'job': name, 'claimed': time.time()}, fp)
+    return True
+
+
+def renew_lease(name):
+    """ renew the lease for a job by appending to it, so the file server stamps it (see spool_time).  Returns
+    False if this worker no longer holds it: the lease has gone (expired and recovered) or names another worker.
+    A lease that can not be read or written is kept, if that goes on it expires and is recovered """
+    path = lease_file(name)
+    lease = read_lease(path)
+    if lease is None:
+        return False
+    if lease and lease.get('worker') != worker_id():
+        return False
+    try:
+        with open(path, "a") as fp:
+            fp.write("\n")
+    except (IOError, OSError) as e:
+        print("Could not renew lease %s: %s" % (name, str(e)))
+    return True
+
+
+def release_lease(name):
+    try:
+        os.unlink(lease_file(name))
+    except OSError:
+        pass
 
 
+# Seconds between listings of the todo directory for jobs missing from the journal
+SCAN_INTERVAL = 60.0
+
+
+def claim_job(kinds=(".job",), fits=None):
+    """ Move the oldest job from the to-do directory to working.  The oldest job comes from the journal.  The
+    lease file is created exclusively and the rename is atomic, so if another worker claims the same job first
+    the next one is tried.  kinds are the job file suffixes this worker can run, fits is called with a job's
+    resources and jobs it rejects are left for later.  Returns the working file path or None """
+
+    idx = index()
+    failed = []
+    try:
+        while True:
+            name = idx.next_todo(kinds, fits)
+            if name is None:
+                # only look at the directory when the journal has nothing to do, and not on every poll while
+                # jobs are waiting for resources or retries
+                if idx.scan_todo(SCAN_INTERVAL):
+                    continue
+                return None
+
+            if not take_lease(name):
+                # taken by another worker
+                continue
+
+            working_file = spool_file("working", name)
+            try:
+                os.rename(spool_file("todo", name), working_file)
+            except OSError:
+                # taken by another worker before the lease, or removed.  If it is still there the rename failed
+                # for another reason (e.g. the file is open) and it is tried again on the next call
+                release_lease(name)
+                if os.path.isfile(spool_file("todo", name)):
+                    failed.append(name)
+                continue
+
+            idx.append(name, 'working', worker=worker_id())
+            return working_file
+    finally:
+        for name in failed:
+            idx.push(name)
+
+
+def requeue(name, reason):
+    """ move a job from working back to todo """
+
+    working_file = spool_file("working", name)
+    if not os.path.isfile(working_file):
+        return False
+
+    try:
+        with open(working_file, "r") as fp:
+            data = json.load(fp)
+        data.setdefault('requeued', []).append({'reason': reason, 'time': time.time()})
+        if len(data['requeued']) > MAX_REQUEUES:
+            data['returncode'] = -1
+            data['err'] = "Recovered from a lost worker %d times, giving up" % len(data['requeued'])
+            print("Failing %s: %s" % (name, data['err']))
+            finish_job(working_file, data)
+            return True
+        write_json(working_file, data)
+        os.rename(working_file, spool_file("todo", name))
+    except (IOError, OSError, ValueError) as e:
+        print("Could not requeue %s: %s" % (name, str(e)))
+        return False
+
+    index().append(name, 'todo', resources=data.get('resources'), not_before=data.get('not_before'))
+    print("Requeued: %s (%s)" % (name, reason))
+    return True
+
+
+def requeue_expired(timeout=None):
+    """ put jobs whose lease has not been renewed within timeout seconds back in todo.  The expired lease is
+    renamed first so only one worker recovers each job.  Returns the number of jobs requeued """
+
+    if timeout is None:
+        timeout = LEASE_TIMEOUT
+
+    now = spool_time()
+    count = 0
+    leased = set()
+
+    directory = spool_file("leases")
+    for f in os.listdir(directory):
+        if not f.endswith(".lease"):
+            continue
+        path = os.path.join(directory, f)
+        name = f[:-len(".lease")]
+        try:
+            age = now - os.stat(path).st_mtime
+        except OSError:
+            continue
+        if age < timeout:
+            leased.add(name)
+            continue
+
+        expired = "%s.%s.expired" % (path, worker_id().replace(":", "_"))
+        try:
+            os.rename(path, expired)
+        except OSError:
+            # recovered by another worker
+            continue
 
+        lease = read_lease(expired) or {}
+        if requeue(name, "lease expired: %s" % lease.get('worker', 'unknown')):
+            count += 1
+        os.unlink(expired)
 
-def run_job():
-    """ Get a file from the to-do directory, move it to working and start it """
-    todo_files = list_dir("todo")
-    if not todo_files:
+    # jobs in working without a lease, e.g. left by a worker that crashed while requeuing
+    for f in os.listdir(spool_file("working")):
+        path = os.path.join(spool_file("working"), f)
+        if f in leased or f.startswith(".") or f.endswith(".tmp") or os.path.isfile(lease_file(f)):
+            continue
+        try:
+            age = now - os.stat(path).st_mtime
+        except OSError:
+            continue
+        if age > timeout and take_lease(f):
+            if requeue(f, "no lease"):
+                count += 1
+            release_lease(f)
+
+    return count
+
+
+def write_json(path, data):
+    """ write a json file so readers never see it half written """
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as fp:
+        json.dump(data, fp, indent=4)
+    if hasattr(os, "replace"):
+        os.replace(tmp, path)
+    else:
+        if os.path.isfile(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+
+# Size of each job log file and number of rotated logs kept
+LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+
+# Number of lines of stdout/stderr kept in the finished job record
+TAIL_LINES = 200
+
+# Patterns used to read progress from job output, as (regex, percent function).  Only whole progress lines
+# match, e.g. "Progress: 42%", "42.5%", "Frame 10 of 200" or "Progress: 3/8", so numbers in paths and other
+# output are not taken for progress
+PROGRESS = [
+    (re.compile(r"^\s*(?:progress\s*:?\s*)?(\d+(?:\.\d+)?)\s*%\s*$", re.I), lambda g: float(g[0])),
+    (re.compile(r"^\s*frame\s+(-?\d+)\s*(?:of|/)\s*(\d+)\s*$", re.I),
+     lambda g: 100.0 * int(g[0]) / max(1, int(g[1]))),
+    (re.compile(r"^\s*(?:progress\s*:?\s*)?(\d+)\s*/\s*(\d+)\s*$", re.I),
+     lambda g: 100.0 * int(g[0]) / max(1, int(g[1]))),
+]
+
+
+def parse_progress(line):
+    """ returns the percentage complete from a line of output, or None """
+    for regex, fn in PROGRESS:
+        match = regex.search(line)
+        if match:
+            try:
+                return min(100.0, max(0.0, fn(match.groups())))
+            except ValueError:
+                continue
+    return None
+
+
+def progress(job_file):
+    """ returns the live progress of a running job: {'percent', 'line', 'updated'} or None """
+    path = spool_file("progress", os.path.splitext(os.path.split(job_file)[1])[0] + ".json")
+    try:
+        with open(path, "r") as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class RunningJob(object):
+    """ A job that has been started.  stdout and stderr are read by threads and streamed to a rotating log
+    file in logs/ so long jobs never collect their output in memory.  The last lines of each are kept for
+    the finished job record and progress read from the output is written to progress/ for monitors """
+
+    def __init__(self, working_file):
+        self.working_file = working_file
+        self.name = os.path.split(working_file)[1]
+        self.base = os.path.splitext(self.name)[0]
+
+        with open(working_file, "r") as fp:
+            self.data = json.load(fp)
+        self.data['worker'] = worker_id()
+        self.data['host'] = socket.gethostname()
+        self.data['started'] = time.time()
+        self.resources = self.data.get('resources', {})
+        self.lost = False
+        self.peak = None
+        self.reason = None
+
+        print("Running: " + info(working_file))
+        print(" ".join(self.data['arguments']))
+
+        self.log_file = spool_file("logs", self.base + ".log")
+        self.progress_file = spool_file("progress", self.base + ".json")
+        self.logger = logging.getLogger("peel_solve.queue." + self.base)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = logging.handlers.RotatingFileHandler(self.log_file, maxBytes=LOG_BYTES,
+                                                            backupCount=LOG_BACKUPS)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(self.handler)
+
+        self.tails = {'out': collections.deque(maxlen=TAIL_LINES), 'err': collections.deque(maxlen=TAIL_LINES)}
+        self.percent = None
+        self.pending = None
+        self.progress_time = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.error = None
+
+        try:
+            self.proc = subprocess.Popen(self.data["arguments"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         **process.popen_kwargs())
+        except OSError as e:
+            # e.g. the executable does not exist, the job is finished with the error
+            self.proc = None
+            self.error = str(e)
+            return
+
+        for key, stream in [('out', self.proc.stdout), ('err', self.proc.stderr)]:
+            t = threading.Thread(target=self.read, args=(key, stream))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def read(self, key, stream):
+        """ thread: stream lines from stdout or stderr to the log """
+        prefix = "" if key == 'out' else "ERR: "
+        for raw in iter(stream.readline, b''):
+            line = raw.decode("utf8", "replace").rstrip("\r\n")
+            self.tails[key].append(line)
+            self.logger.info(prefix + line)
+            percent = parse_progress(line)
+            if percent is not None:
+                self.update_progress(percent, line)
+        stream.close()
+
+    def update_progress(self, percent=None, line=None):
+        """ write the progress file, at most once a second.  Called with no arguments to flush the last update """
+        with self.lock:
+            if percent is not None:
+                self.percent = percent
+                self.pending = {'percent': percent, 'line': line}
+            now = time.time()
+            if self.pending is None or now - self.progress_time < 1.0:
+                return
+            self.pending['updated'] = now
+            write_json(self.progress_file, self.pending)
+            self.progress_time = now
+            self.pending = None
+
+    def poll(self):
+        """ returns True if the process has exited """
+        self.update_progress()
+        if self.proc is None:
+            return True
+        self.sample_memory()
+        if self.proc.poll() is not None:
+            return True
+        timeout = self.data.get('timeout')
+        if timeout and self.reason is None and time.time() - self.data['started'] > timeout:
+            self.kill("timeout")
+        return False
+
+    def kill(self, reason):
+        """ kill the job and everything it started """
+        print("Killing %s: %s" % (self.name, reason))
+        self.reason = reason
+        if self.proc is not None:
+            process.kill_tree(self.proc)
+
+    def sample_memory(self):
+        value = process.peak_rss(self.proc)
+        if value is not None and (self.peak is None or value > self.peak):
+            self.peak = value
+
+    def heartbeat(self):
+        """ renew the lease.  If the lease has expired and been taken away the job is stopped, it has been
+        requeued and will be run again """
+        if renew_lease(self.name):
+            return True
+
+        print("Lost lease: " + self.name)
+        self.lost = True
+        self.kill("lost lease")
+        return False
+
+    def wait(self):
+        if self.proc is not None:
+            self.proc.wait()
+
+    def finish(self):
+        """ record the output tail and return code and move the job to finished """
+
+        for t in self.threads:
+            t.join()
+
+        if self.proc is None:
+            self.tails['err'].append(self.error)
+            self.logger.info("ERR: " + self.error)
+            self.data["returncode"] = -1
+        else:
+            self.sample_memory()
+            self.data["returncode"] = self.proc.returncode
+            self.data["peak_rss"] = self.peak
+
+        # loggers are kept by name until removed, one per job would build up in a long running worker
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+        logging.Logger.manager.loggerDict.pop(self.logger.name, None)
+
+        self.data["out"] = "\n".join(self.tails['out'])
+        self.data["err"] = "\n".join(self.tails['err'])
+        self.data["log"] = self.log_file
+        if self.percent is not None:
+            self.data["progress"] = self.percent
+
+        if os.path.isfile(self.progress_file):
+            os.unlink(self.progress_file)
+
+        if self.lost:
+            # the job belongs to another worker now
+            return
+
+        finish_attempt(self.working_file, self.data, self.reason)
+
+
+def finish_attempt(working_file, data, reason=None):
+    """ record an attempt at running a job, data has its host, worker, started and returncode.  reason is why
+    it was stopped (timeout, cancelled), if it was.  The job is finished, or put back in todo if it failed and
+    can be retried """
+
+    attempt = {'host': data['host'], 'worker': data['worker'], 'started': data['started'],
+               'finished': time.time(), 'returncode': data['returncode'],
+               'reason': reason or ("ok" if data['returncode'] == 0 else "failed")}
+    data.setdefault('attempts', []).append(attempt)
+
+    cancel_file = spool_file("cancel", os.path.split(working_file)[1])
+    if reason == "cancelled":
+        data['cancelled'] = "cancelled"
+        if os.path.isfile(cancel_file):
+            os.unlink(cancel_file)
+    elif attempt['reason'] != "ok" and retry_job(working_file, data):
         return
 
-    oldest_file = todo_files[0]
-    oldest_name = os.path.split(oldest_file)[1]
+    finish_job(working_file, data)
+
 
-    working_file = spool_file("working", oldest_name)
-    os.rename(oldest_file, working_file)
+def retry_job(working_file, data):
+    """ put a failed job back in todo if it is idempotent and has retries left.  Each retry waits twice as
+    long as the last before it can start.  Returns True if the job was requeued """
 
-    with open(working_file, "r") as fp:
-        data = json.load(fp)
+    failures = len([i for i in data.get('attempts', []) if i['reason'] != "ok"])
+    if not data.get('idempotent') or failures > data.get('retries', 0):
+        return False
 
-    print("Running: " + info(working_file))
-    print(" ".join(data['arguments']))
-    proc = subprocess.Popen(data["arguments"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
+    name = os.path.split(working_file)[1]
+    delay = min(RETRY_MAX, RETRY_DELAY * 2 ** (failures - 1))
+    data['not_before'] = time.time() + delay
+    data.pop('returncode', None)
+
+    write_json(working_file, data)
+    os.rename(working_file, spool_file("todo", name))
+    release_lease(name)
+    index().append(name, 'todo', resources=data.get('resources'), not_before=data['not_before'])
+    print("Retrying %s in %ds (attempt %d of %d)" % (name, delay, failures + 1, data['retries'] + 1))
+    return True
 
-    data["out"] = out.decode("utf8")
-    data["err"] = err.decode("utf8")
-    data["returncode"] = proc.returncode
 
-    with open(spool_file("finished", oldest_name), "w") as fp:
+def finish_job(working_file, data):
+    """ write the job record to finished and release the job """
+    name = os.path.split(working_file)[1]
+    data['finished'] = time.time()
+    data.setdefault('host', socket.gethostname())
+    with open(spool_file("finished", name), "w") as fp:
         json.dump(data, fp, indent=4)
 
     os.unlink(working_file)
+    release_lease(name)
+    index().append(name, 'finished')
+
+    print("Finished: " + info(spool_file("finished", name)))
+
+    # start anything that was waiting for this job
+    promote_waiting()
+
+
+def run_job(poll=0.5):
+    """ Get a file from the to-do directory, move it to working and run it """
+    working_file = claim_job()
+    if working_file is None:
+        return
+
+    job = RunningJob(working_file)
+    beat = time.time()
+    while not job.poll():
+        time.sleep(poll)
+        check_cancelled([job])
+        if time.time() - beat > LEASE_TIMEOUT / 4:
+            job.heartbeat()
+            beat = time.time()
+    job.finish()
 
     return True
 
 
-def do_work():
-    while run_job():
-        pass
+def do_work(workers=None, poll=0.5, forever=False, resources=None):
+    """ Run jobs until the to-do directory is empty, up to workers (default: cpu count) at once.
+    Finished processes are reaped and new jobs started as soon as a slot is free.  Only jobs whose declared
+    resources fit in what is left on this host are started (see Resources), jobs that do not fit are passed
+    over for smaller ones.  Leases of running jobs are renewed and jobs with expired leases requeued every
+    quarter of the lease timeout.  With forever the worker keeps waiting for new jobs """
 
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, int(workers))
 
-def add_maya(src, dest, mel):
-    cmd = ["file -f -o \"%s\"" % src ]
-    if isinstance(mel, list):
-        cmd += list
-    else:
-        cmd.append(str(mel))
+    if resources is None:
+        resources = Resources()
+
+    requeue_expired()
+    promote_waiting()
+    beat = time.time()
+    archived = time.time()
+
+    running = []
+    while True:
+        check_cancelled(running)
+
+        for job in [i for i in running if i.poll()]:
+            job.finish()
+            resources.release(job.resources)
+            running.remove(job)
+
+        if time.time() - beat > LEASE_TIMEOUT / 4:
+            for job in running:
+                job.heartbeat()
+            requeue_expired()
+            promote_waiting()
+            beat = time.time()
+
+        if time.time() - archived > ARCHIVE_INTERVAL:
+            archive()
+            archived = time.time()
+
+        while len(running) < workers:
+            working_file = resources.claim()
+            if working_file is None:
+                break
+            running.append(RunningJob(working_file))
+
+        if not running and not forever and not index().delayed():
+            return
+
+        time.sleep(poll)
+
+
+def add_maya(src, dest, mel, warm=True, name=None, python=None, depends=None, timeout=None, run=True):
+    """ spool a job that opens src, runs the mel and python lines and saves the scene as dest.
+    With warm the job is run by a maya_worker that already has maya loaded, and waits in the spool until one is
+    running (mayapy -m peel_solve.maya_worker), otherwise a MAYA_BATCH process is started for it by do_work,
+    which is called here unless run is False.  timeout is the wall clock limit in seconds.  Returns the job id """
+
+    if not isinstance(mel, list):
+        mel = [str(mel)]
+
+    if name is None:
+        name = "MAYA: " + os.path.splitext(os.path.split(dest)[1])[0]
+
+    if warm:
+        job = {'src': src, 'dest': dest, 'mel': mel, 'python': python or []}
+        data = {'name': name, 'maya': job}
+        if timeout:
+            data['timeout'] = timeout
+        return spool_job(data, suffix=".maya", depends=depends)
+
+    cmd = ["file -f -o \"%s\"" % src]
+    cmd += mel
+    for line in python or []:
+        cmd.append("python(\"%s\");" % line.replace("\\", "\\\\").replace("\"", "\\\""))
     cmd.append("file -rename \"%s\"" % dest)
     cmd.append("file -save")
 
-    with tempfile.NamedTemporaryFile(dir=r"M:\spool\tmp", delete=False, mode="w+", suffix=".mel") as script:
+    with tempfile.NamedTemporaryFile(dir=spool_file("scripts"), delete=False, mode="w+", suffix=".mel") as script:
         for line in cmd:
             script.write(line + "\n")
 
-    maya_exe = r'C:\Program Files\Autodesk\Maya2020\bin\mayabatch.exe'
-    add_job([maya_exe, "-script", script.name])
-    do_work()
+    ret = add_job(name, [MAYA_BATCH, "-script", script.name], depends=depends, resources={'maya': 1},
+                  timeout=timeout)
+    if run:
+        do_work()
+    return ret
 
 
 def test():
@@ -121,12 +983,38 @@ def test():
 
 
 if __name__ == "__main__":
-    print("here")
-    for i in list_dir("todo"):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Run the jobs in the spool")
+    parser.add_argument("--spool", help="spool directory, default: " + SPOOL)
+    parser.add_argument("--workers", type=int, help="number of jobs to run at once, default: cpu count")
+    parser.add_argument("--lease", type=float, help="lease timeout in seconds, default: %d" % LEASE_TIMEOUT)
+    parser.add_argument("--forever", action="store_true", help="keep waiting for new jobs")
+    parser.add_argument("--list", action="store_true", help="list the spool and exit")
+    parser.add_argument("--cancel", nargs="+", metavar="JOB", help="cancel jobs and exit")
+    args = parser.parse_args()
+
+    if args.spool:
+        SPOOL = args.spool
+    if args.lease:
+        LEASE_TIMEOUT = args.lease
+
+    if args.cancel:
+        for i in args.cancel:
+            cancel(os.path.split(i)[1])
+        sys.exit(0)
+
+    spool = status()
+    for i in spool["waiting"]:
+        print("WAITING ", info(i))
+    for i in spool["todo"]:
         print("TODO:   ", info(i))
-    for i in list_dir("working"):
+    for i in spool["working"]:
         print("WORKING ", info(i))
-    for i in list_dir("finished"):
+    for i in spool["finished"]:
         print("DONE   ", info(i))
 
-    do_work()
\ No newline at end of file
+    if not args.list:
+        archive()
+        do_work(args.workers, forever=args.forever)
@@ -0,0 +1,315 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import csv
+import json
+import os
+import os.path
+import sys
+import time
+
+from peel_solve import queue
+
+""" Throughput, queue wait and run time of the spool jobs, per job type, exported as a prometheus text file
+ (for the node_exporter textfile collector) and csv:
+
+    python -m peel_solve.queue_metrics --prom M:\\metrics\\spool.prom --csv M:\\metrics\\spool.csv
+"""
+
+
+# Histogram buckets in seconds
+BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400]
+
+# Windows in seconds the throughput is measured over
+WINDOWS = {'1h': 3600, '24h': 86400}
+
+# Cache of finished job id -> record for the jobs finished within the longest window, finished records do not
+# change
+RECORDS = {}
+
+# Job type -> Stats of the finished jobs older than the longest window, which only keep their counts, and the ids
+# of the jobs that have been added to them
+OLD = {}
+OLD_IDS = set()
+
+
+def job_type(data, job_id=""):
+    """ the type of a job: its 'type' if set, the name prefix before ':' (e.g. SOLVE, ENCODE) or its kind """
+    if data.get('type'):
+        return data['type']
+    name = data.get('name', "")
+    if ":" in name:
+        return name.split(":")[0].strip()
+    return os.path.splitext(job_id)[1].lstrip(".") or "job"
+
+
+def status_of(data):
+    if 'cancelled' in data:
+        return "cancelled"
+    if 'skipped' in data:
+        return "skipped"
+    if data.get('returncode') == 0:
+        return "ok"
+    return "failed"
+
+
+def finished_records(now=None):
+    """ returns the records of the jobs finished within the longest window, only reading the ones that have not
+    been read before.  Older jobs are added to OLD once and their records dropped """
+
+    now = time.time() if now is None else now
+    horizon = now - max(WINDOWS.values())
+    finished = queue.index().status().get("finished", [])
+
+    ret = []
+    for job_id in finished:
+        if job_id in OLD_IDS:
+            continue
+        if job_id not in RECORDS:
+            try:
+                with open(queue.spool_file("finished", job_id), "r") as fp:
+                    RECORDS[job_id] = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+        data = RECORDS[job_id]
+        if data.get('finished', 0) < horizon:
+            OLD.setdefault(job_type(data, job_id), Stats()).add(data, keep=False)
+            OLD_IDS.add(job_id)
+            del RECORDS[job_id]
+            continue
+        ret.append((job_id, data))
+
+    # archived jobs are not listed again, their counts stay in OLD
+    finished = set(finished)
+    OLD_IDS.intersection_update(finished)
+    for job_id in [i for i in RECORDS if i not in finished]:
+        del RECORDS[job_id]
+
+    return ret
+
+
+def escape(value):
+    """ a label value for the prometheus text format """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Histogram(object):
+    """ cumulative histogram in the prometheus style.  values holds only the values added with keep, for the
+    percentiles """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or BUCKETS
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.values = []
+
+    def add(self, value, keep=True):
+        if keep:
+            self.values.append(value)
+        self.count += 1
+        self.total += value
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.values.extend(other.values)
+
+
+class Stats(object):
+    """ aggregates for one job type """
+
+    def __init__(self):
+        self.status = {'ok': 0, 'failed': 0, 'skipped': 0, 'cancelled': 0}
+        self.wait = Histogram()
+        self.runtime = Histogram()
+        self.finished = []
+        self.peak_rss = None
+
+    def add(self, data, keep=True):
+        """ add a finished job record.  Without keep only the counts are updated, not the finished times and
+        values used for the throughput and percentiles """
+        self.status[status_of(data)] += 1
+        if 'finished' in data and keep:
+            self.finished.append(data['finished'])
+        if 'started' in data and 'enqueued' in data:
+            self.wait.add(max(0.0, data['started'] - data['enqueued']), keep)
+        if 'started' in data and 'finished' in data:
+            self.runtime.add(max(0.0, data['finished'] - data['started']), keep)
+        if data.get('peak_rss') and (self.peak_rss is None or data['peak_rss'] > self.peak_rss):
+            self.peak_rss = data['peak_rss']
+
+    def merge(self, other):
+        for status, count in other.status.items():
+            self.status[status] += count
+        self.wait.merge(other.wait)
+        self.runtime.merge(other.runtime)
+        self.finished.extend(other.finished)
+        if other.peak_rss is not None and (self.peak_rss is None or other.peak_rss > self.peak_rss):
+            self.peak_rss = other.peak_rss
+
+    def throughput(self, window, now):
+        """ jobs finished per hour over the last window seconds """
+        count = len([i for i in self.finished if now - i <= window])
+        return count * 3600.0 / window
+
+
+def aggregate(records=None):
+    """ returns a dict of job type -> Stats, of the records given or the finished jobs in the spool (including
+    the counts of the ones in OLD).  The percentiles are over the jobs of the longest window """
+    ret = {}
+    if records is None:
+        records = finished_records()
+        for t, old in OLD.items():
+            ret.setdefault(t, Stats()).merge(old)
+    for job_id, data in records:
+        ret.setdefault(job_type(data, job_id), Stats()).add(data)
+    return ret
+
+
+def prometheus(stats, now=None):
+    """ returns the aggregates in the prometheus text format """
+
+    now = time.time() if now is None else now
+    lines = []
+
+    def metric(name, kind, text):
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+    metric("peel_spool_jobs", "gauge", "Jobs in each state of the spool")
+    for state, jobs in sorted(queue.index().status().items()):
+        lines.append('peel_spool_jobs{state="%s"} %d' % (escape(state), len(jobs)))
+
+    # a gauge as the finished jobs are archived after a while (see spool_index.archive), archived jobs stay
+    # counted while this keeps running
+    metric("peel_spool_finished", "gauge", "Finished jobs in the spool by type and status")
+    for t, s in sorted(stats.items()):
+        for status, count in sorted(s.status.items()):
+            lines.append('peel_spool_finished{type="%s",status="%s"} %d' % (escape(t), status, count))
+
+    metric("peel_spool_throughput_per_hour", "gauge", "Jobs finished per hour over a rolling window")
+    for t, s in sorted(stats.items()):
+        for label, window in sorted(WINDOWS.items()):
+            lines.append('peel_spool_throughput_per_hour{type="%s",window="%s"} %g'
+                         % (escape(t), label, s.throughput(window, now)))
+
+    for attr, name, text in [('wait', "peel_spool_wait_seconds", "Time from enqueue to start"),
+                             ('runtime', "peel_spool_runtime_seconds", "Time from start to finish")]:
+        metric(name, "histogram", text)
+        for t, s in sorted(stats.items()):
+            h = getattr(s, attr)
+            for le, count in zip(h.buckets, h.counts):
+                lines.append('%s_bucket{type="%s",le="%g"} %d' % (name, escape(t), le, count))
+            lines.append('%s_bucket{type="%s",le="+Inf"} %d' % (name, escape(t), h.count))
+            lines.append('%s_sum{type="%s"} %g' % (name, escape(t), h.total))
+            lines.append('%s_count{type="%s"} %d' % (name, escape(t), h.count))
+
+    metric("peel_spool_peak_rss_bytes", "gauge", "Largest peak resident memory of a job")
+    for t, s in sorted(stats.items()):
+        if s.peak_rss is not None:
+            lines.append('peel_spool_peak_rss_bytes{type="%s"} %d' % (escape(t), s.peak_rss))
+
+    return "\n".join(lines) + "\n"
+
+
+CSV_COLUMNS = ["type", "ok", "failed", "skipped", "cancelled", "per_hour_1h", "per_hour_24h",
+               "wait_p50", "wait_p95", "runtime_p50", "runtime_p95", "runtime_max", "peak_rss"]
+
+
+def csv_rows(stats, now=None):
+    now = time.time() if now is None else now
+    ret = []
+    for t, s in sorted(stats.items()):
+        ret.append([t, s.status['ok'], s.status['failed'], s.status['skipped'], s.status['cancelled'],
+                    s.throughput(WINDOWS['1h'], now), s.throughput(WINDOWS['24h'], now),
+                    percentile(s.wait.values, 50), percentile(s.wait.values, 95),
+                    percentile(s.runtime.values, 50), percentile(s.runtime.values, 95),
+                    max(s.runtime.values) if s.runtime.values else None, s.peak_rss])
+    return ret
+
+
+def write_prometheus(path, stats=None):
+    """ write the prometheus text file, replacing it in one step so the collector never reads half of it """
+    if stats is None:
+        stats = aggregate()
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as fp:
+        fp.write(prometheus(stats))
+    if hasattr(os, "replace"):
+        os.replace(tmp, path)
+    else:
+        if os.path.isfile(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+
+def write_csv(path, stats=None):
+    if stats is None:
+        stats = aggregate()
+    # the csv module writes its own line endings
+    if sys.version_info[0] >= 3:
+        fp = open(path, "w", newline="")
+    else:
+        fp = open(path, "wb")
+    with fp:
+        writer = csv.writer(fp)
+        writer.writerow(CSV_COLUMNS)
+        for row in csv_rows(stats):
+            writer.writerow(["" if i is None else i for i in row])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export spool metrics")
+    parser.add_argument("--spool", help="spool directory, default: " + queue.SPOOL)
+    parser.add_argument("--prom", help="prometheus text file to write")
+    parser.add_argument("--csv", help="csv file to write")
+    parser.add_argument("--every", type=float, help="keep writing every this many seconds")
+    args = parser.parse_args()
+
+    if args.spool:
+        queue.SPOOL = args.spool
+
+    while True:
+        stats = aggregate()
+        if args.prom:
+            write_prometheus(args.prom, stats)
+        if args.csv:
+            write_csv(args.csv, stats)
+        if not args.prom and not args.csv:
+            print(prometheus(stats))
+        if not args.every:
+            break
+        time.sleep(args.every)
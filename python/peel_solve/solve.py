@@ -21,11 +21,14 @@
 
 from __future__ import print_function
 import math
+import multiprocessing
+import time
 
 from maya import mel
 import maya.cmds as m
+import maya.OpenMaya as om
 
-from peel_solve import roots, node_list
+from peel_solve import roots, node_list, dirty, dag, anim_index
 
 """ Runs the maya peelsolver """
 
@@ -50,34 +53,113 @@ def load_plugin():
     m.loadPlugin("peelsolve_" + ver + "_2540." + os)
 
 
-def go_to_pref_action(sel, trans, rot):
-    for j in sel:
-        if m.objExists(j + '.peelType') and m.getAttr(j + '.peelType') > 0:
-            continue
+class PoseCache(object):
+    """ The preferred pose of a set of joints, read once through the API and applied as a single batch.
 
-        if rot:
-            for attr in ['X', 'Y', 'Z']:
-                if not m.objExists(j + '.jointType' + attr):
-                    continue
-                if not m.getAttr(j + '.jointType' + attr):
-                    continue
-                if m.getAttr(j + '.rotateX', lock=True):
-                    continue
-                val = m.getAttr(j + '.preferredAngle' + attr)
-                try:
-                    m.setAttr(j + '.rotate' + attr, val)
-                except:
-                    pass
-
-        if trans:
-            for attr in ['X', 'Y', 'Z']:
-                if not m.objExists(j + '.preferredTrans' + attr):
-                    continue
-                val = m.getAttr(j + '.preferredTrans')
-                try:
-                    m.setAttr(j + '.translate' + attr, val)
-                except:
-                    pass
+    * self.pose - dict of joint -> list of (MPlug, value) in internal units
+
+    Joints with a peelType (markers) are skipped, as are rotations for axes without a jointType dof and
+    channels that are locked or driven by something other than an anim curve.
+    """
+
+    def __init__(self, joints=None, trans=True, rot=True):
+        self.pose = {}
+        if joints:
+            self.read(joints, trans, rot)
+
+    @staticmethod
+    def settable(plug):
+        """ returns True if the plug can be set """
+        if plug.isLocked():
+            return False
+        if plug.isDestination():
+            src = om.MPlugArray()
+            plug.connectedTo(src, True, False)
+            if src.length() and not src[0].node().hasFn(om.MFn.kAnimCurve):
+                return False
+        return True
+
+    def read(self, joints, trans=True, rot=True):
+        """ read the preferred angles/translations for the joints """
+
+        for j in joints:
+            dep = dag.dep_fn(j)
+            if dep is None:
+                continue
+
+            if dep.hasAttribute('peelType') and dep.findPlug('peelType').asInt() > 0:
+                continue
+
+            items = []
+
+            if rot:
+                for axis in ['X', 'Y', 'Z']:
+                    if not dep.hasAttribute('jointType' + axis):
+                        continue
+                    if not dep.findPlug('jointType' + axis).asBool():
+                        continue
+                    # both doubleAngle, so the values are already in radians
+                    value = dep.findPlug('preferredAngle' + axis).asDouble()
+                    items.append((dep.findPlug('rotate' + axis), value))
+
+            if trans:
+                for axis in ['X', 'Y', 'Z']:
+                    if not dep.hasAttribute('preferredTrans' + axis):
+                        continue
+                    plug = dep.findPlug('preferredTrans' + axis)
+                    value = plug.asDouble()
+                    if not plug.attribute().hasFn(om.MFn.kUnitAttribute):
+                        # plain double, stored in ui units
+                        value = om.MDistance(value, om.MDistance.uiUnit()).asUnits(om.MDistance.internalUnit())
+                    items.append((dep.findPlug('translate' + axis), value))
+
+            self.pose[j] = [(plug, value) for plug, value in items if self.settable(plug)]
+
+    def read_current(self, joints):
+        """ read the current rotations and translations of the joints, so apply() puts them back """
+
+        for j in joints:
+            dep = dag.dep_fn(j)
+            if dep is None:
+                continue
+            items = []
+            for attr in ['rotate', 'translate']:
+                for axis in ['X', 'Y', 'Z']:
+                    plug = dep.findPlug(attr + axis)
+                    items.append((plug, plug.asDouble()))
+            self.pose[j] = [(plug, value) for plug, value in items if self.settable(plug)]
+
+    def apply(self, undoable=False):
+        """ set all the joints to the cached pose.  By default this is one MDGModifier, which is fast but is not
+        on the undo queue.  With undoable the values are set with setAttr in a single undo chunk instead """
+
+        if not undoable:
+            mod = om.MDGModifier()
+            for items in self.pose.values():
+                for plug, value in items:
+                    mod.newPlugValueDouble(plug, value)
+            mod.doIt()
+            return
+
+        m.undoInfo(openChunk=True)
+        try:
+            for j, items in self.pose.items():
+                for plug, value in items:
+                    attr = plug.attribute()
+                    # the cached values are in internal units, setAttr takes ui units
+                    if attr.hasFn(om.MFn.kUnitAttribute):
+                        unit = om.MFnUnitAttribute(attr).unitType()
+                        if unit == om.MFnUnitAttribute.kAngle:
+                            value = om.MAngle(value).asUnits(om.MAngle.uiUnit())
+                        elif unit == om.MFnUnitAttribute.kDistance:
+                            value = om.MDistance(value).asUnits(om.MDistance.uiUnit())
+                    m.setAttr(j + "." + om.MFnAttribute(attr).name(), value)
+        finally:
+            m.undoInfo(closeChunk=True)
+
+
+def go_to_pref_action(sel, trans, rot):
+    PoseCache(sel, trans, rot).apply(undoable=True)
 
 
 def solve_args(solve_type):
@@ -161,7 +243,7 @@ def solve(solve_type=None):
         if delete_keys == 2:
             m.delete(transforms, channels=True, unitlessAnimationCurves=False, hierarchy='none', at=at)
         elif delete_keys == 1:
-            tr = (args['start'], args['end'])
+            tr = (args['st'], args['end'])
             m.cutKey(transforms, clear=True, time=tr, option='keys', hierarchy='none', at=at)
 
     if pre_solve_root is True:
@@ -180,10 +262,325 @@ def solve(solve_type=None):
     if solve_type != 'single':
         chan = m.peelSolve(s=rn, ns=True, lc=True)
         m.filterCurve(chan, filter='euler')
+        dirty.clean()
+
+    m.select(sels)
+
+
+def solve_dirty(pad=5):
+    """ Re-solve only the frames where the optical markers have changed since the last solve.
+    Tracking must have been started with dirty.track().  The dirty ranges are padded by pad frames and
+    solved in to the existing keys.  Returns the list of ranges that were solved. """
+
+    rn = roots.ls()
+
+    if len(rn) == 0:
+        m.error("No skeleton top node defined")
+        return None
+
+    ranges = dirty.ranges(pad)
+    if ranges is None:
+        raise RuntimeError("Marker tracking is not active, use dirty.track() and run a full solve first")
+
+    if not ranges:
+        print("No marker changes to solve")
+        return []
+
+    sels = m.ls(sl=True)
+
+    args = solve_args(None)
+    start, end = args['st'], args['end']
+
+    transforms = m.peelSolve(s=rn, lt=True, ns=True)
+    at = ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']
+
+    solved = []
+    try:
+        m.refresh(su=True)
+        for st, en in ranges:
+            st = max(st, start)
+            en = min(en, end)
+            if st > en:
+                continue
+
+            # only the keys in the dirty range are replaced, deleteKeys=2 would remove the whole solve
+            if m.getAttr("peelSolveOptions.deleteKeys") > 0:
+                m.cutKey(transforms, clear=True, time=(st, en), option='keys', hierarchy='none', at=at)
+
+            print("Solving dirty range: %d - %d" % (st, en))
+            args['st'] = st
+            args['end'] = en
+            m.peelSolve(s=rn, e=True, **args)
+            solved.append((st, en))
+    finally:
+        m.refresh(su=False)
+
+    if solved:
+        chan = m.peelSolve(s=rn, ns=True, lc=True)
+        m.filterCurve(chan, filter='euler')
+
+    dirty.clean()
+
+    m.select(sels)
+
+    return solved
+
+
+def seed_channels(rn):
+    """ returns the MFnAnimCurve objects for the animated, unlocked channels of the solve joints """
+    curves = []
+    for j in m.peelSolve(s=rn, lp=True, ns=True):
+        for attr in ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']:
+            if m.getAttr(j + '.' + attr, lock=True):
+                continue
+            if not m.listConnections(j + '.' + attr, s=True, d=False, type='animCurve'):
+                continue
+            curves.append(dag.anim_curve(j, attr))
+    return curves
+
+
+def seed_velocity(curves, previous, frames):
+    """ Key a constant velocity prediction for each frame, extrapolated from the two previous solved frames.
+    @param curves: list of MFnAnimCurve objects, see seed_channels()
+    @param previous: the two previous solved frames (t0, t1)
+    @param frames: frames to key the prediction on
+    """
+
+    unit = om.MTime.uiUnit()
+    t0, t1 = previous
+    for fn in curves:
+        v0 = fn.evaluate(om.MTime(t0, unit))
+        v1 = fn.evaluate(om.MTime(t1, unit))
+        rate = (v1 - v0) / (t1 - t0)
+        for f in frames:
+            t = om.MTime(f, unit)
+            value = v1 + rate * (f - t1)
+            if fn.numKeys() > 0:
+                index = fn.findClosest(t)
+                if fn.time(index) == t:
+                    fn.setValue(index, value)
+                    continue
+            fn.addKey(t, value)
+
+
+def solve_seeded(seed='velocity', chunk=10, solve_type=None):
+    """ Run a range solve where each frame starts from a predicted pose rather than the pose left on the joints.
+    The solve is run with readDirect so the solver picks up the predicted pose.
+
+    @param seed: 'velocity' solves the range in chunks, keying a constant velocity prediction from the two previous
+                 solved frames before each chunk.  'coarse' runs a quick solve every chunk frames first, the
+                 interpolated keys from that pass become the starting pose for the full solve.
+    @param chunk: frames per chunk for 'velocity', frame step for the 'coarse' pass
+    @param solve_type: passed to solve_args
+    """
+
+    if seed not in ['velocity', 'coarse']:
+        raise ValueError("Invalid seed type: " + str(seed))
+
+    rn = roots.ls()
+
+    if len(rn) == 0:
+        m.error("No skeleton top node defined")
+        return None
+
+    sels = m.ls(sl=True)
+
+    args = solve_args(solve_type)
+    args['rd'] = True
+    start, end, inc = args['st'], args['end'], args['inc']
+
+    transforms = m.peelSolve(s=rn, lt=True, ns=True)
+    at = ['tx', 'ty', 'tz', 'rx', 'ry', 'rz']
+    if m.getAttr("peelSolveOptions.deleteKeys") > 0:
+        m.cutKey(transforms, clear=True, time=(start, end), option='keys', hierarchy='none', at=at)
+
+    if m.getAttr("peelSolveOptions.preSolvePose") is True:
+        go_to_pref_not_root()
+
+    try:
+        m.refresh(su=True)
+
+        if seed == 'coarse':
+            coarse = dict(args)
+            coarse.update({'inc': inc * chunk, 'i': 50, 'm': 0})
+            coarse.pop('ref', None)
+            m.peelSolve(s=rn, e=True, **coarse)
+            m.peelSolve(s=rn, e=True, **args)
+        else:
+            curves = None
+            st = start
+            while st <= end:
+                en = min(st + inc * (chunk - 1), end)
+                if st - inc * 2 >= start:
+                    if curves is None:
+                        curves = seed_channels(rn)
+                    frames = []
+                    f = st
+                    while f <= en:
+                        frames.append(f)
+                        f += inc
+                    seed_velocity(curves, (st - inc * 2, st - inc), frames)
+                args['st'] = st
+                args['end'] = en
+                m.peelSolve(s=rn, e=True, **args)
+                st = en + inc
+    finally:
+        m.refresh(su=False)
+
+    chan = m.peelSolve(s=rn, ns=True, lc=True)
+    m.filterCurve(chan, filter='euler')
+    dirty.clean()
 
     m.select(sels)
 
 
+def marker_error(frames=None, rn=None):
+    """ returns the mean distance between the active markers and the markers they are connected to,
+    sampled at each of the frames, or the current pose if frames is None.  Used to compare the quality of solves """
+
+    if rn is None:
+        rn = roots.ls()
+
+    pairs = []
+    for root in rn:
+        for active in m.peelSolve(s=root, la=True, ns=True) or []:
+            src = m.listConnections(active + ".peelTarget", s=True, d=False)
+            if src:
+                pairs.append((active, src[0]))
+
+    if not pairs:
+        raise RuntimeError("No connected active markers to measure")
+
+    total = 0.0
+    for f in frames or [None]:
+        for active, src in pairs:
+            if f is None:
+                a = m.xform(active, q=True, ws=True, t=True)
+                b = m.xform(src, q=True, ws=True, t=True)
+            else:
+                a = m.getAttr(active + ".worldMatrix", t=f)[12:15]
+                b = m.getAttr(src + ".worldMatrix", t=f)[12:15]
+            total += math.sqrt(sum((i - j) ** 2 for i, j in zip(a, b)))
+
+    return total / (len(pairs) * len(frames or [None]))
+
+
+def sample_frames(start, end, samples):
+    """ returns one frame from the middle of each of samples equal slices of the range """
+    width = (end - start) / float(samples)
+    return sorted(set(math.floor(start + width * (i + 0.5)) for i in range(samples)))
+
+
+def benchmark_settings(rn, frames, settings, pose=None, start=None, runs=3):
+    """ solves each frame on its own from the preferred pose with the settings, runs times.
+    @param pose: optional PoseCache of the preferred pose
+    @param start: optional dict of frame -> PoseCache (see read_current) applied before each solve, so the roots
+        and joints start from the scene's own values rather than the last solve's result
+    returns (median seconds, mean marker error) """
+
+    args = solve_args('single')
+    args.update(settings)
+
+    times = []
+    error = 0.0
+    for _ in range(max(1, runs)):
+        elapsed = 0.0
+        error = 0.0
+        for f in frames:
+            m.currentTime(f)
+            if start is not None and f in start:
+                start[f].apply()
+            go_to_pref_not_root(pose, undoable=False)
+            t = time.time()
+            m.peelSolve(s=rn, e=True, **args)
+            elapsed += time.time() - t
+            error += marker_error(rn=rn)
+        times.append(elapsed)
+
+    times.sort()
+    return times[len(times) // 2], error / len(frames)
+
+
+def auto_tune(samples=10, tolerance=0.05, runs=3):
+    """ Find the cheapest solver settings that keep the marker error within tolerance of the current settings.
+
+    Each setting (method, gradient samples, threads, iterations) is tried in turn with the others fixed, solving
+    samples frames spread over the solve range.  The fastest value whose error is no more than (1 + tolerance)
+    times the error of the current settings is kept.  Each trial is timed runs times and the median is used.
+    The result is written to the options node.
+    """
+
+    rn = roots.ls()
+
+    if len(rn) == 0:
+        m.error("No skeleton top node defined")
+        return None
+
+    on = node_list.options_node()
+    current = solve_args(None)
+    frames = sample_frames(current['st'], current['end'], samples)
+
+    # option node attribute, solve_args flag, option node value -> flag value (None to leave the flag out, as
+    # solve_args does for gradient sample values it does not know)
+    gs_flag = {0: 1, 1: 2, 2: 4}
+    params = [('method', 'm', [0, 1, 2, 3], lambda v: v),
+              ('gradientSamples', 'gs', [0, 1, 2], lambda v: gs_flag.get(v)),
+              ('threads', 'threads', sorted(set([1, 2, 4, multiprocessing.cpu_count()])), lambda v: v),
+              ('iterations', 'i', [25, 50, 100, 200, 400], lambda v: v)]
+
+    best = dict((attr, m.getAttr(on + '.' + attr)) for attr, _, _, _ in params)
+
+    def flags(values):
+        ret = dict((flag, convert(values[attr])) for attr, flag, _, convert in params)
+        return dict((k, v) for k, v in ret.items() if v is not None)
+
+    pose = PoseCache(pref_joints(rn))
+
+    # the trial solves move the joints, put the scene back as it was
+    now = m.currentTime(q=True)
+    sels = m.ls(sl=True)
+    nodes = pref_joints(rn) + m.ls(rn, long=True)
+    scene_pose = PoseCache()
+    scene_pose.read_current(nodes)
+    try:
+        m.refresh(su=True)
+
+        # the pose of the roots and joints on each frame before any solve, every trial starts from it
+        start = {}
+        for f in frames:
+            m.currentTime(f)
+            start[f] = PoseCache()
+            start[f].read_current(nodes)
+
+        best_time, reference = benchmark_settings(rn, frames, flags(best), pose, start, runs)
+        limit = reference * (1.0 + tolerance)
+        print("Current settings: %s  time: %.3fs  error: %f" % (str(best), best_time, reference))
+
+        for attr, _, candidates, _ in params:
+            for value in candidates:
+                if value == best[attr]:
+                    continue
+                trial = dict(best)
+                trial[attr] = value
+                elapsed, error = benchmark_settings(rn, frames, flags(trial), pose, start, runs)
+                print("  %s=%s  time: %.3fs  error: %f" % (attr, str(value), elapsed, error))
+                if error <= limit and elapsed < best_time:
+                    best = trial
+                    best_time = elapsed
+    finally:
+        m.refresh(su=False)
+        m.currentTime(now)
+        scene_pose.apply()
+        m.select(sels)
+
+    for attr, value in best.items():
+        m.setAttr(on + '.' + attr, value)
+
+    print("Tuned settings: %s  time: %.3fs  (error limit %f)" % (str(best), best_time, limit))
+
+    return best
+
+
 def run(iterations=500, inc=1, root_nodes=None, start=None, end=None):
     """
     :param iterations: passed to peelsolve
@@ -230,15 +627,22 @@ def frame(iterations=500, root_nodes=None):
     # mel.eval("peelSolve2Run(4);")
 
 
-def go_to_pref_not_root():
-    rn = roots.ls()
-    jnts = m.peelSolve(lp=True, ns=True, s=rn)
-    sel = m.ls(sl=True)
-    m.select(jnts)
-    for r in rn: m.select(r, tgl=True)
-    joints = m.ls(sl=True)
-    go_to_pref_action(joints, True, True)
-    m.select(sel)
+def pref_joints(rn=None):
+    """ returns the solve joints, excluding the roots """
+    if rn is None:
+        rn = roots.ls()
+    jnts = m.ls(m.peelSolve(lp=True, ns=True, s=rn), long=True)
+    root_nodes = set(m.ls(rn, long=True))
+    return [i for i in jnts if i not in root_nodes]
+
+
+def go_to_pref_not_root(pose=None, undoable=True):
+    """ move the solve joints (other than the roots) to the preferred pose.
+    @param pose: optional PoseCache to apply, to avoid reading the pose again
+    @param undoable: put the change on the undo queue (see PoseCache.apply) """
+    if pose is None:
+        pose = PoseCache(pref_joints())
+    pose.apply(undoable)
 
 
 def find_char_top():
@@ -254,9 +658,11 @@ def find_char_top():
 
 
 def set_mocap_range():
-    keys = m.keyframe(node_list.all_markers(), q=True)
-    start = math.floor(min(keys))
-    end = math.ceil(max(keys))
+    keys = anim_index.time_range(node_list.all_markers())
+    if keys is None:
+        return
+    start = math.floor(keys[0])
+    end = math.ceil(keys[1])
     m.playbackOptions(min=start, max=end, ast=start, aet=end)
 
 
@@ -266,6 +672,6 @@ def range_selected():
         m.confirmDialog(m="Nothing Selected")
         return
 
-    keys = m.keyframe(sel, q=True)
-    if keys is None or len(keys) == 0: return
-    m.playbackOptions(min=math.floor(min(keys)), max=math.ceil(max(keys)))
+    keys = anim_index.time_range(sel)
+    if keys is None: return
+    m.playbackOptions(min=math.floor(keys[0]), max=math.ceil(keys[1]))
@@ -23,16 +23,23 @@ import maya.cmds as m
 from maya import mel
 import json
 import math
-from peel_solve import locator, roots, rigidbody, dag, joint, matrix, solve
+from peel_solve import locator, roots, rigidbody, dag, joint, matrix, solve, templates
 import maya.OpenMaya as om
 import maya.OpenMayaAnim as oma
 import os.path
 import subprocess
 import tempfile
+import multiprocessing
+import threading
+import maya.utils
 
 """ Collection of utilities for creating a solve setup"""
 
 
+# Standalone solver, set PEELSOLVE_EXE to use another build
+PEELSOLVE_EXE = os.environ.get("PEELSOLVE_EXE", "m:/bin/peelsolve.exe")
+
+
 def four_points(joint, rb):
 
     """ Constrain a joint to a rigibody by using 4 markers """
@@ -131,7 +138,7 @@ def strip_left(source, value):
     return source[len(value):]
 
 
-def save(file_path=None, strip_marker=None, strip_joint=None, rb=True, skel=True):
+def save(file_path=None, strip_marker=None, strip_joint=None, rb=True, skel=True, setups=None):
 
     """ Save the solve setup as a json file
     @param file_path: file to save the json data to, defaults to current scene path with .json extension
@@ -139,8 +146,13 @@ def save(file_path=None, strip_marker=None, strip_joint=None, rb=True, skel=True
     @param strip_joint: prefix to remove from the joint names
     @param rb: list of rigidbodies to solve, or True = All, False = None
     @param skel: list of skeleton roots to solve, or True = All, False = None
+    @param setups: dict of root -> serialized setup to use instead of reading the scene, defaults to the cached
+                   setups of the templates the open rig was built from, see templates.activate()
     """
 
+    if setups is None:
+        setups = templates.active_setups(strip_marker, strip_joint)
+
     all_roots = roots.ls(extend=False)
 
     if not rb and not skel:
@@ -158,6 +170,9 @@ def save(file_path=None, strip_marker=None, strip_joint=None, rb=True, skel=True
         ret['rigidbodies'] = rigidbody.serialize(sel=rb)
         count += len(ret['rigidbodies'])
 
+    if isinstance(skel, list):
+        all_roots = skel
+
     if skel and all_roots:
         solvers = {}
         for root in all_roots:
@@ -165,7 +180,10 @@ def save(file_path=None, strip_marker=None, strip_joint=None, rb=True, skel=True
                 print("Could not find root: " + str(root))
                 continue
             print("Saving root: " + root)
-            solvers[root] = serialize(root, strip_marker, strip_joint)
+            if setups and root in setups:
+                solvers[root] = setups[root]
+            else:
+                solvers[root] = serialize(root, strip_marker, strip_joint)
         ret['solvers'] = solvers
         count += len(solvers)
 
@@ -195,10 +213,93 @@ def solve(file_path=None, rb=True, skel=True):
     c3d = m.getAttr(roots.optical() + ".C3dFile")
     print("C3d: " + c3d)
     print("Config: " + solve_config)
-    subprocess.call(["m:/bin/peelsolve.exe", c3d, solve_config, solve_config + ".out"])
+    subprocess.call([PEELSOLVE_EXE, c3d, solve_config, solve_config + ".out"])
     import_solved(solve_config + ".out")
 
 
+def run_solves(c3d, configs, workers):
+    """ run the standalone solver on each config, workers at a time.  Blocks until they have all finished and
+    returns the configs that failed.  Does not use maya, so it can be run from a thread """
+
+    lock = threading.Lock()
+    pending = list(configs)
+    failed = []
+
+    def work():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                config = pending.pop(0)
+            if subprocess.call([PEELSOLVE_EXE, c3d, config, config + ".out"]) != 0:
+                with lock:
+                    failed.append(config)
+
+    threads = [threading.Thread(target=work) for _ in range(max(1, min(workers, len(configs))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return [i for i in configs if i in failed]
+
+
+def import_parallel(configs, failed):
+    """ import the results of solve_parallel, skipping the failed configs """
+    for config in configs:
+        if config in failed:
+            print("Solve failed: " + config)
+        else:
+            import_solved(config + ".out")
+
+
+def solve_parallel(file_path=None, rb=True, workers=None, wait=None):
+    """ Run the standalone solver with one process per skeleton root and merge the results back in to the scene.
+    @param file_path: base path for the solve configs, defaults to a temp file per root
+    @param rb: solve the rigidbodies as a separate process (see save)
+    @param workers: maximum number of solver processes to run at once, defaults to the number of cores
+    @param wait: block until the solves are done and return the failed configs.  Otherwise the solvers run
+        from a thread and the results are imported on the main thread when they have all finished, so the ui
+        is not held up; the thread is returned.  Defaults to waiting in batch mode only
+    """
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if wait is None:
+        wait = m.about(batch=True)
+
+    c3d = m.getAttr(roots.optical() + ".C3dFile")
+    print("C3d: " + c3d)
+
+    configs = []
+
+    if rb and list(rigidbody.ls()):
+        path = None if file_path is None else file_path + ".rb"
+        configs.append(save(file_path=path, rb=rb, skel=False))
+
+    for i, root in enumerate(roots.ls(extend=False)):
+        path = None if file_path is None else "%s.%d" % (file_path, i)
+        configs.append(save(file_path=path, rb=False, skel=[root]))
+
+    for config in configs:
+        print("Solving: " + config)
+
+    if wait:
+        failed = run_solves(c3d, configs, workers)
+        import_parallel(configs, failed)
+        return failed
+
+    def background():
+        failed = run_solves(c3d, configs, workers)
+        maya.utils.executeDeferred(import_parallel, configs, failed)
+
+    t = threading.Thread(target=background)
+    t.daemon = True
+    t.start()
+    return t
+
+
 def solve_rb():
     """ Solve selected rigidbodies """
     solve(rb=m.ls(sl=True), skel=False)
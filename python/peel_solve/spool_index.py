@@ -0,0 +1,370 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import errno
+import heapq
+import json
+import os
+import os.path
+import socket
+import time
+
+""" Append only journal of the job states in a spool directory (see queue.py), so the oldest job can be found
+ and the spool listed without scanning and stat'ing every job file.  The job files in the todo, working and
+ finished directories remain the truth: the journal is rebuilt from them if it is lost or damaged.
+
+ Appends and rewrites of the journal hold journal.lock, so a compaction never drops lines another worker is
+ adding. """
+
+
+JOURNAL = "journal.log"
+LOCK = "journal.lock"
+
+# Seconds a lock can be seen unchanged before it is treated as left behind by a dead process
+LOCK_STALE = 30.0
+
+# Directories that hold jobs
+SECTIONS = ["waiting", "todo", "working", "finished"]
+
+
+def job_fields(path):
+    """ returns the journal fields kept from a job file, its 'resources' and 'not_before' if set, as the queue
+    adds them when it writes a job to todo """
+    try:
+        with open(path, "r") as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {}
+    return dict((k, data[k]) for k in ['resources', 'not_before'] if data.get(k))
+
+
+class FileLock(object):
+    """ Lock shared by processes on any machine using the spool, held by creating the file exclusively.
+    Can be nested within a process, and used as a context manager.  A lock that has not changed for LOCK_STALE
+    seconds, measured on this machine's clock, is removed """
+
+    def __init__(self, path):
+        self.path = path
+        self.locked = 0
+
+    def lock(self):
+        """ take the lock, waiting for other processes """
+
+        if self.locked:
+            self.locked += 1
+            return
+
+        seen = None
+        since = time.time()
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, ("%s:%d %f" % (socket.gethostname(), os.getpid(), time.time())).encode("utf8"))
+                os.close(fd)
+                self.locked = 1
+                return
+            except OSError as e:
+                # windows gives access denied while the lock is being removed
+                if e.errno not in (errno.EEXIST, errno.EACCES):
+                    raise
+
+            try:
+                with open(self.path, "r") as fp:
+                    holder = fp.read()
+            except (IOError, OSError):
+                continue
+
+            if holder != seen:
+                seen = holder
+                since = time.time()
+            elif time.time() - since > LOCK_STALE:
+                print("Removing stale lock %s: %s" % (self.path, holder))
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                seen = None
+                continue
+
+            time.sleep(0.01)
+
+    def unlock(self):
+        self.locked -= 1
+        if self.locked == 0:
+            os.remove(self.path)
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, *args):
+        self.unlock()
+
+
+class SpoolIndex(object):
+    """ In memory view of the journal, updated by reading only the lines added since the last read.
+
+    * self.jobs - dict of job file name -> {'state', 't', 'worker' (when running), 'resources' (if declared),
+      'not_before' (retries waiting to start)}
+    * self.heaps - dict of job kind (file suffix) -> heap of (time, name) of jobs added to todo, oldest first
+    * self.offset - bytes of the journal that have been read
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, JOURNAL)
+        self.file_lock = FileLock(os.path.join(root, LOCK))
+        self.scanned = 0
+        self.reset()
+
+    def reset(self):
+        self.jobs = {}
+        self.heaps = {}
+        self.offset = 0
+        self.ino = None
+
+    # Lock
+
+    def lock(self):
+        """ take the journal lock, waiting for other processes.  Can be nested within a process """
+        self.file_lock.lock()
+
+    def unlock(self):
+        self.file_lock.unlock()
+
+    # Journal
+
+    def append(self, job, state, t=None, worker=None, resources=None, not_before=None):
+        """ record a job changing state.  Lines are short and written in one call so appends from
+        several processes do not interleave """
+        record = {'job': job, 'state': state, 't': time.time() if t is None else t}
+        if worker is not None:
+            record['worker'] = worker
+        if resources:
+            record['resources'] = resources
+        if not_before:
+            record['not_before'] = not_before
+        self.lock()
+        try:
+            with open(self.path, "a") as fp:
+                fp.write(json.dumps(record) + "\n")
+        finally:
+            self.unlock()
+
+    def apply(self, record):
+        name = record['job']
+        state = record['state']
+        if state == 'archived':
+            self.jobs.pop(name, None)
+            return
+        self.jobs[name] = {'state': state, 't': record['t']}
+        for key in ['worker', 'resources', 'not_before']:
+            if key in record:
+                self.jobs[name][key] = record[key]
+        if state == 'todo':
+            heapq.heappush(self.heaps.setdefault(os.path.splitext(name)[1], []), (record['t'], name))
+
+    def refresh(self):
+        """ read any new lines from the journal, rebuilding it if it is missing """
+
+        if not os.path.isfile(self.path):
+            self.rebuild()
+            return
+
+        st = os.stat(self.path)
+        if st.st_size < self.offset or (self.ino is not None and st.st_ino != self.ino):
+            # compacted or replaced by another process
+            self.reset()
+        self.ino = st.st_ino
+
+        if st.st_size == self.offset:
+            return
+
+        with open(self.path, "rb") as fp:
+            fp.seek(self.offset)
+            chunk = fp.read()
+
+        # only complete lines, a writer may be part way through the last one
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+
+        for raw in chunk[:end].split(b"\n"):
+            if not raw.strip():
+                continue
+            try:
+                self.apply(json.loads(raw.decode("utf8")))
+            except (ValueError, KeyError):
+                print("Ignoring invalid journal line: " + repr(raw))
+
+        self.offset += end + 1
+
+    def write(self, records):
+        """ replace the journal with the records, the caller holds the lock """
+        tmp = self.path + ".%d.tmp" % os.getpid()
+        with open(tmp, "w") as fp:
+            for record in records:
+                fp.write(json.dumps(record) + "\n")
+        if hasattr(os, "replace"):
+            os.replace(tmp, self.path)
+        else:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        self.reset()
+        self.refresh()
+
+    def rebuild(self):
+        """ recreate the journal from the job files in the spool directories when it is missing """
+        self.lock()
+        try:
+            if os.path.isfile(self.path):
+                # rebuilt by another process while waiting for the lock
+                self.refresh()
+                return
+            records = []
+            for state in SECTIONS:
+                directory = os.path.join(self.root, state)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    full_path = os.path.join(directory, name)
+                    if name.startswith(".") or name.endswith(".tmp") or not os.path.isfile(full_path):
+                        continue
+                    record = {'job': name, 'state': state, 't': os.stat(full_path).st_ctime}
+                    if state in ['waiting', 'todo']:
+                        record.update(job_fields(full_path))
+                    records.append(record)
+            records.sort(key=lambda r: r['t'])
+            self.write(records)
+        finally:
+            self.unlock()
+
+    def compact(self):
+        """ rewrite the journal with one line per job """
+        self.lock()
+        try:
+            self.refresh()
+            records = [dict(v, job=k) for k, v in self.jobs.items()]
+            records.sort(key=lambda r: r['t'])
+            self.write(records)
+        finally:
+            self.unlock()
+
+    # Queries
+
+    def next_todo(self, kinds=None, fits=None):
+        """ returns the name of the oldest job in todo of one of the kinds (file suffixes, None for any),
+        removing it from the heap.  fits is called with the job's resources, jobs it returns False for and
+        retries that can not start yet are passed over for younger ones and stay in the heap.
+        None if there are none """
+        self.refresh()
+        now = time.time()
+        passed = []
+        try:
+            while True:
+                heaps = [h for k, h in self.heaps.items() if h and (kinds is None or k in kinds)]
+                if not heaps:
+                    return None
+                heap = min(heaps, key=lambda h: h[0])
+                item = heapq.heappop(heap)
+                job = self.jobs.get(item[1])
+                if job is None or job['state'] != 'todo' or job['t'] != item[0]:
+                    continue
+                waiting = job.get('not_before', 0) > now
+                if waiting or (fits is not None and not fits(job.get('resources') or {})):
+                    passed.append((heap, item))
+                    continue
+                return item[1]
+        finally:
+            for heap, item in passed:
+                heapq.heappush(heap, item)
+
+    def push(self, name):
+        """ put a job taken with next_todo() back in the heap, e.g. when it could not be moved to working """
+        job = self.jobs.get(name)
+        if job is not None and job['state'] == 'todo':
+            heapq.heappush(self.heaps.setdefault(os.path.splitext(name)[1], []), (job['t'], name))
+
+    def delayed(self):
+        """ returns the number of jobs in todo that are waiting to be retried """
+        now = time.time()
+        return len([i for i in self.jobs.values() if i['state'] == 'todo' and i.get('not_before', 0) > now])
+
+    def scan_todo(self, interval=None):
+        """ add any files in todo the journal does not know about, e.g. written by an older version.  With
+        interval the directory is listed at most once in that many seconds.  Returns True if any were found """
+        if interval is not None and time.time() - self.scanned < interval:
+            return False
+        self.scanned = time.time()
+        self.refresh()
+        directory = os.path.join(self.root, "todo")
+        if not os.path.isdir(directory):
+            return False
+        found = False
+        for name in os.listdir(directory):
+            if name.startswith(".") or name.endswith(".tmp"):
+                continue
+            job = self.jobs.get(name)
+            if job is None or job['state'] != 'todo':
+                fields = job_fields(os.path.join(directory, name))
+                self.append(name, 'todo', resources=fields.get('resources'), not_before=fields.get('not_before'))
+                found = True
+        return found
+
+    def status(self):
+        """ returns a dict of state -> job names, oldest first """
+        self.refresh()
+        ret = dict((i, []) for i in SECTIONS)
+        for name, job in sorted(self.jobs.items(), key=lambda v: v[1]['t']):
+            ret.setdefault(job['state'], []).append(name)
+        return ret
+
+    def archive(self, days=7.0, compact=True):
+        """ move finished jobs older than days to archive/<yyyy-mm-dd>/ and optionally compact the journal.
+        Returns the number of jobs archived """
+
+        self.refresh()
+        cutoff = time.time() - days * 24 * 60 * 60
+        count = 0
+        for name, job in list(self.jobs.items()):
+            if job['state'] != 'finished' or job['t'] > cutoff:
+                continue
+            directory = os.path.join(self.root, "archive", time.strftime("%Y-%m-%d", time.localtime(job['t'])))
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            try:
+                os.rename(os.path.join(self.root, "finished", name), os.path.join(directory, name))
+            except OSError as e:
+                print("Could not archive %s: %s" % (name, str(e)))
+                continue
+            self.append(name, 'archived')
+            count += 1
+
+        if compact:
+            self.compact()
+
+        return count
@@ -0,0 +1,262 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import csv
+import json
+import os
+import os.path
+
+from peel_solve import c3d, probe, timecode
+
+""" Index of the c3d takes, reference movies and shot list ranges of a shoot by absolute time, so sources that
+ overlap can be found without opening them.  Does not depend on maya. """
+
+
+MOVIE_EXTENSIONS = ['.mov', '.mp4', '.mxf', '.avi']
+
+
+class Interval(object):
+    """ A source in the index.
+
+    * self.kind - 'c3d', 'movie' or 'range'
+    * self.name - name of the take/movie/range
+    * self.start, self.end - first and last frame (inclusive) at the index rate
+    * self.data - anything else, e.g. the path
+    """
+
+    def __init__(self, kind, name, start, end, data=None):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.data = data or {}
+
+    def __repr__(self):
+        return "Interval(%s, %s, %d, %d)" % (self.kind, self.name, self.start, self.end)
+
+    def covers(self, start, end):
+        return self.start <= start and self.end >= end
+
+    def serialize(self):
+        return {'kind': self.kind, 'name': self.name, 'start': self.start, 'end': self.end, 'data': self.data}
+
+
+class IntervalTree(object):
+    """ Static interval tree.  The intervals are sorted by start and stored as an implicit balanced tree where each
+    node records the largest end below it, so overlap queries are O(log n + number of results) """
+
+    def __init__(self, intervals):
+        self.items = sorted(intervals, key=lambda i: (i.start, i.end))
+        self.max_end = [0] * len(self.items)
+        self.build(0, len(self.items))
+
+    def build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        ret = self.items[mid].end
+        for child in [self.build(lo, mid), self.build(mid + 1, hi)]:
+            if child is not None and child > ret:
+                ret = child
+        self.max_end[mid] = ret
+        return ret
+
+    def overlapping(self, start, end):
+        """ returns the intervals that overlap start - end (inclusive) """
+        ret = []
+        self.search(0, len(self.items), start, end, ret)
+        return ret
+
+    def search(self, lo, hi, start, end, ret):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self.max_end[mid] < start:
+            # nothing below here reaches the range
+            return
+        self.search(lo, mid, start, end, ret)
+        item = self.items[mid]
+        if item.start > end:
+            # everything to the right starts later still
+            return
+        if item.end >= start:
+            ret.append(item)
+        self.search(mid + 1, hi, start, end, ret)
+
+
+class SyncIndex(object):
+    """ c3d takes, movies and ranges for a shoot, in absolute frames at a common rate
+
+    * self.rate - the rate all the intervals are stored at
+    * self.items - list of Interval
+    """
+
+    def __init__(self, rate=120.0):
+        self.rate = float(rate)
+        self.items = []
+        self.tree = None
+
+    def to_frames(self, tc, rate, drop=None):
+        """ converts a timecode string at rate to a frame at the index rate """
+        frame = timecode.parse([tc], rate, drop)[0]
+        return timecode.convert([frame], rate, self.rate)[0][0]
+
+    def add(self, kind, name, start, end, data=None):
+        self.items.append(Interval(kind, name, int(start), int(end), data))
+        self.tree = None
+
+    def add_c3d(self, path, tc_rate=None):
+        """ add a c3d file.  tc_rate overrides the timecode rate in the file """
+
+        details = c3d.info(path)
+        if details['timecode'] is None:
+            raise RuntimeError("No timecode in c3d: " + str(path))
+
+        rate = tc_rate or details['tc_rate']
+        if rate is None:
+            raise RuntimeError("Could not determine timecode rate for: " + str(path))
+
+        # the same as time_util.c3d_start: recording start + first field at the point rate
+        start = self.to_frames(details['timecode'], rate, details['drop'])
+        start += timecode.convert([details['first_field']], details['rate'], self.rate)[0][0]
+        length = timecode.convert([details['frames']], details['rate'], self.rate)[0][0]
+
+        name = os.path.splitext(os.path.split(path)[1])[0]
+        self.add('c3d', name, start, start + length - 1, {'path': path, 'rate': details['rate']})
+
+    def add_movie(self, path, data=None):
+        """ add a movie file.  data is the probe result, probe.probe() is used if it is not given """
+
+        if data is None:
+            data = probe.probe(path)
+
+        if data['timecode'] is None or data['rate'] is None:
+            raise RuntimeError("No timecode or rate for movie: " + str(path))
+
+        start = self.to_frames(data['timecode'], data['rate'])
+        frames = data['frames'] or 1
+        length = timecode.convert([frames], data['rate'], self.rate)[0][0]
+
+        name = os.path.splitext(os.path.split(path)[1])[0]
+        self.add('movie', name, start, start + length - 1, {'path': path, 'rate': data['rate']})
+
+    def add_range(self, name, start_tc, end_tc, rate):
+        """ add a range, e.g. from a shot list """
+        self.add('range', name, self.to_frames(start_tc, rate), self.to_frames(end_tc, rate), {'rate': rate})
+
+    def add_shot_list(self, path, rate):
+        """ add the ranges from a csv file with name, start timecode, end timecode columns """
+        with open(path, "r") as fp:
+            for row in csv.reader(fp):
+                if len(row) < 3 or ':' not in row[1]:
+                    # header or blank line
+                    continue
+                self.add_range(row[0].strip(), row[1].strip(), row[2].strip(), rate)
+
+    def scan(self, directory, tc_rate=None, shot_list_rate=None, workers=8):
+        """ add all the c3d files, movies and shot lists (csv, needs shot_list_rate) below a directory.
+        Movies are probed in parallel and cached, see probe.py """
+
+        movies = []
+        for root, dirs, files in os.walk(directory):
+            for f in files:
+                path = os.path.join(root, f)
+                ext = os.path.splitext(f)[1].lower()
+                try:
+                    if ext == '.c3d':
+                        self.add_c3d(path, tc_rate)
+                    elif ext in MOVIE_EXTENSIONS:
+                        movies.append(path)
+                    elif ext == '.csv' and shot_list_rate is not None:
+                        self.add_shot_list(path, shot_list_rate)
+                except (RuntimeError, ValueError, IOError) as e:
+                    print("Skipping %s: %s" % (path, str(e)))
+
+        for path, data in probe.probe_many(movies, workers=workers).items():
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                self.add_movie(path, data)
+            except (RuntimeError, OSError, ValueError) as e:
+                print("Skipping %s: %s" % (path, str(e)))
+
+    # Queries
+
+    def overlapping(self, start, end, kind=None):
+        """ returns the intervals overlapping the frame range (at the index rate) """
+        if self.tree is None:
+            self.tree = IntervalTree(self.items)
+        ret = self.tree.overlapping(start, end)
+        if kind is not None:
+            ret = [i for i in ret if i.kind == kind]
+        return ret
+
+    def find(self, name, kind=None):
+        """ returns the first interval with the name """
+        for i in self.items:
+            if i.name == name and (kind is None or i.kind == kind):
+                return i
+        return None
+
+    def covering(self, start, end, kind=None):
+        """ returns the intervals that cover the whole frame range """
+        return [i for i in self.overlapping(start, end, kind) if i.covers(start, end)]
+
+    def movies_for(self, name, whole=False):
+        """ returns the movies that overlap the take or range called name, or only those that cover all of it """
+        item = self.find(name)
+        if item is None:
+            raise KeyError("Not in the index: " + str(name))
+        if whole:
+            return self.covering(item.start, item.end, 'movie')
+        return self.overlapping(item.start, item.end, 'movie')
+
+    def ranges_in(self, name):
+        """ returns the shot list ranges that fall within the c3d take called name """
+        item = self.find(name, 'c3d')
+        if item is None:
+            raise KeyError("Not in the index: " + str(name))
+        return [i for i in self.overlapping(item.start, item.end, 'range') if item.covers(i.start, i.end)]
+
+    # Persistence
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            json.dump({'rate': self.rate, 'items': [i.serialize() for i in self.items]}, fp, indent=1)
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        ret = SyncIndex(data['rate'])
+        for i in data['items']:
+            ret.add(i['kind'], i['name'], i['start'], i['end'], i['data'])
+        return ret
+
+
+def build(directory, index_path=None, rate=120.0, tc_rate=None, shot_list_rate=None):
+    """ scan the directory and return the index, saving it to index_path if given """
+    ret = SyncIndex(rate)
+    ret.scan(directory, tc_rate=tc_rate, shot_list_rate=shot_list_rate)
+    if index_path:
+        ret.save(index_path)
+    return ret
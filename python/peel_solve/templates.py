@@ -0,0 +1,289 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from __future__ import print_function
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import stat
+import tempfile
+
+import maya.cmds as m
+
+""" Cache of the actor template scenes, for building and batch solving many takes with the same templates:
+
+ * INDEX lists each template directory once, and again only when the directory has changed
+ * local_copy() keeps a copy of a template on the local disk, so it is not read over the network for every take
+ * rig_scene() imports a set of templates in to one scene once and keeps it, so a worker can get back to a clean
+   rig with a single open of a local file instead of opening and importing each template again
+ * RigSnapshot puts an opened rig scene back as it was between takes, without opening the file again
+ * setups() keeps the solve setup of each root in a template (solve_setup.serialize) as json, and activate()
+   makes solve_setup.save() use them while the rig is the open scene
+
+ Cached files are named after the path, modification time and size of their templates, so an edited template
+ is picked up.  They are read only, so a scene opened from the cache can not be saved over it.  The cache is in
+ PEEL_TEMPLATE_CACHE, default peel_templates in the temp directory. """
+
+
+CACHE_DIR = os.environ.get("PEEL_TEMPLATE_CACHE", os.path.join(tempfile.gettempdir(), "peel_templates"))
+
+
+class TemplateIndex(object):
+    """ Listings of template directories, re-read only when the directory's modification time changes.
+
+    * self.dirs - dict of directory -> (mtime, list of names)
+    """
+
+    def __init__(self):
+        self.dirs = {}
+
+    def list(self, directory):
+        mtime = os.stat(directory).st_mtime
+        cached = self.dirs.get(directory)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, os.listdir(directory))
+            self.dirs[directory] = cached
+        return cached[1]
+
+    def find(self, basedir, actor):
+        """ returns the latest template for the actor in basedir/actor (see build.find_template), or None """
+        actor_dir = os.path.join(basedir, actor)
+        res = [i for i in self.list(actor_dir) if i.lower().startswith(actor.lower())]
+        if len(res) == 0:
+            return None
+        return os.path.join(actor_dir, sorted(res)[-1])
+
+
+INDEX = TemplateIndex()
+
+
+def key(paths, *extra):
+    """ a name for a cache entry made from the paths, their modification times and sizes """
+    h = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        h.update(("%s|%d|%d|" % (os.path.abspath(path).lower(), st.st_mtime, st.st_size)).encode("utf8"))
+    for i in extra:
+        h.update(("%s|" % i).encode("utf8"))
+    return h.hexdigest()[:16]
+
+
+def cache_file(name):
+    if not os.path.isdir(CACHE_DIR):
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError:
+            if not os.path.isdir(CACHE_DIR):
+                raise
+    return os.path.join(CACHE_DIR, name)
+
+
+def publish(tmp, path):
+    """ move a finished cache file in to place and make it read only.  Another process may have got there
+    first, then the file is left as it is """
+    if os.path.isfile(path):
+        os.remove(tmp)
+        return
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # windows does not rename over an existing file
+        if not os.path.isfile(path):
+            raise
+        os.remove(tmp)
+        return
+    os.chmod(path, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+
+def local_copy(path):
+    """ returns a copy of the file on the local disk, copying it if the cache does not have this version """
+
+    base, ext = os.path.splitext(os.path.split(path)[1])
+    ret = cache_file("%s_%s%s" % (base, key([path]), ext))
+    if not os.path.isfile(ret):
+        print("Caching template: " + path)
+        tmp = ret + ".%d.tmp" % os.getpid()
+        shutil.copyfile(path, tmp)
+        publish(tmp, ret)
+    return ret
+
+
+def rig_scene(paths, force=False):
+    """ returns a local scene with the templates in it: the first one opened (for its fps settings, etc) and
+    the rest imported.  The scene is built once for each set of templates, which opens it, discarding changes
+    to the current scene if force is set """
+
+    if len(paths) == 1:
+        return local_copy(paths[0])
+
+    ext = os.path.splitext(paths[0])[1]
+    ret = cache_file("rig_%s%s" % (key(paths), ext))
+    if os.path.isfile(ret):
+        return ret
+
+    print("Building rig from: " + ", ".join(paths))
+    m.file(local_copy(paths[0]), o=True, f=force)
+    for path in paths[1:]:
+        m.file(local_copy(path), i=True)
+
+    # maya picks the file type from the extension, so the temporary name keeps it
+    tmp = ret[:-len(ext)] + ".%d.tmp%s" % (os.getpid(), ext)
+    m.file(rename=tmp)
+    m.file(save=True, type="mayaAscii" if ext.lower() == ".ma" else "mayaBinary")
+    publish(tmp, ret)
+    return ret
+
+
+def open_rig(paths, force=False):
+    """ open a scene with the templates in it, from the cache.  The scene is named after the first template, as
+    when it was opened directly, so it is not saved to the cache """
+    m.file(rig_scene(paths, force), o=True, f=force)
+    m.file(rename=paths[0])
+
+
+# Setups read by this process, json cache file -> setups
+SETUPS = {}
+
+# The templates of the open rig whose setups solve_setup.save() uses, see activate()
+ACTIVE = None
+
+
+def setups(path, strip_marker=None, strip_joint=None, force=False):
+    """ returns the solve setup of each root in a template, dict of root -> solve_setup.serialize() data.
+    If it is not in the cache the template is read from the open scene when that is its local copy, otherwise
+    it is opened, discarding changes to the current scene if force is set """
+
+    from peel_solve import roots, solve_setup
+
+    json_file = cache_file("setup_%s.json" % key([path], strip_marker, strip_joint))
+    if json_file in SETUPS:
+        return SETUPS[json_file]
+
+    if os.path.isfile(json_file):
+        with open(json_file, "r") as fp:
+            SETUPS[json_file] = json.load(fp)
+        return SETUPS[json_file]
+
+    scene = local_copy(path)
+    if os.path.normcase(os.path.abspath(m.file(q=True, sn=True) or "")) != os.path.normcase(scene):
+        m.file(scene, o=True, f=force)
+
+    ret = {}
+    for root in roots.ls(extend=False):
+        ret[root] = solve_setup.serialize(root, strip_marker, strip_joint)
+
+    tmp = json_file + ".%d.tmp" % os.getpid()
+    with open(tmp, "w") as fp:
+        json.dump(ret, fp)
+    publish(tmp, json_file)
+    SETUPS[json_file] = ret
+    return ret
+
+
+def activate(paths):
+    """ use the cached setups of the templates in solve_setup.save() while the open scene is the rig built from
+    them.  For workers that only import and solve takes in the rig, the setups could be stale if the rig is
+    edited.  None to stop """
+    global ACTIVE
+    if paths is None:
+        ACTIVE = None
+    else:
+        ACTIVE = {'paths': list(paths), 'scene': m.file(q=True, sn=True)}
+
+
+def active_setups(strip_marker=None, strip_joint=None):
+    """ returns the setups of the active templates (see activate) as dict of root -> setup, or None if there are
+    none or the open scene is not the rig they were activated with """
+    if ACTIVE is None or m.file(q=True, sn=True) != ACTIVE['scene']:
+        return None
+    ret = {}
+    for path in ACTIVE['paths']:
+        ret.update(setups(path, strip_marker, strip_joint))
+    return ret
+
+
+class RigSnapshot(object):
+    """ The state of a freshly opened rig scene, so a worker can put it back between takes instead of opening
+    the file again.  Nodes added since are deleted, renamed nodes get their names back and transforms their
+    values, and the scene name, playback range and time are reset.
+
+    * self.uuids - the nodes in the scene
+    * self.names - their names, in the same order
+    * self.values - dict of transform uuid -> [(attr, value)]
+    """
+
+    def __init__(self):
+        self.scene = m.file(q=True, sn=True)
+        self.range = [m.playbackOptions(q=True, **{i: True}) for i in ['ast', 'min', 'max', 'aet']]
+        self.time = m.currentTime(q=True)
+        self.uuids = m.ls(uuid=True)
+        self.names = m.ls(self.uuids)
+        if len(self.names) != len(self.uuids):
+            raise RuntimeError("Could not read the names of the nodes in the rig")
+
+        self.values = {}
+        for uuid in m.ls(type="transform", uuid=True):
+            node = m.ls(uuid)[0]
+            items = []
+            for attr in ["translate", "rotate", "scale"]:
+                if m.getAttr(node + "." + attr, lock=True):
+                    continue
+                items.append((attr, m.getAttr(node + "." + attr)[0]))
+            self.values[uuid] = items
+
+    def restore(self):
+        """ put the scene back to the snapshot.  Raises RuntimeError if it can not, e.g. a node of the rig has
+        been deleted, then the rig needs opening again """
+
+        known = set(self.uuids)
+        added = [i for i in m.ls(uuid=True) if i not in known]
+        for node in m.ls(added, long=True):
+            if not m.objExists(node) or m.lockNode(node, q=True, lock=True)[0]:
+                continue
+            try:
+                m.delete(node)
+            except (RuntimeError, ValueError):
+                # e.g. default nodes created by maya, or removed with their parent
+                pass
+
+        names = m.ls(self.uuids)
+        if len(names) != len(self.uuids):
+            raise RuntimeError("Nodes of the rig have been deleted")
+        for uuid, name, old in zip(self.uuids, names, self.names):
+            if name != old:
+                m.rename(m.ls(uuid, long=True)[0], old.split("|")[-1])
+
+        for uuid, items in self.values.items():
+            node = m.ls(uuid, long=True)[0]
+            for attr, value in items:
+                try:
+                    m.setAttr(node + "." + attr, *value)
+                except RuntimeError:
+                    # connected or locked children
+                    pass
+
+        ast, start, end, aet = self.range
+        m.playbackOptions(ast=ast, min=start, max=end, aet=aet)
+        m.currentTime(self.time)
+        m.file(rename=self.scene)
+        m.flushUndo()
@@ -1,5 +1,6 @@
 import maya.cmds as m
-from peel_solve import locator
+import time
+from peel_solve import locator, solve, node_list, roots, dirty
 
 def load():
     p = r'E:/git/amazon/peelsolve/build_2020/peelsolve2020/Debug/peelsolve2020d.mll'
@@ -68,3 +69,115 @@ def lendof():
     m.setAttr(m2 + ".tx", 6)
 
 
+def seeding_benchmark(iterations=(25, 50, 100, 200, 400), seed='velocity', chunk=10, samples=20):
+    """ Compares solve.solve() with solve.solve_seeded() on the current scene at each iteration count,
+    printing the time and marker error for both.  The solve keys in the playback range are replaced. """
+
+    on = node_list.options_node()
+    saved = {attr: m.getAttr(on + '.' + attr) for attr in ['iterations', 'deleteKeys']}
+
+    start = m.playbackOptions(q=True, min=True)
+    end = m.playbackOptions(q=True, max=True)
+    step = max(1, int((end - start) / samples))
+    frames = [start + i for i in range(0, int(end - start) + 1, step)]
+
+    results = {}
+    try:
+        m.setAttr(on + '.deleteKeys', 1)
+        for i in iterations:
+            m.setAttr(on + '.iterations', i)
+            for mode in ['plain', seed]:
+                t = time.time()
+                if mode == 'plain':
+                    solve.solve()
+                else:
+                    solve.solve_seeded(seed=seed, chunk=chunk)
+                elapsed = time.time() - t
+                err = solve.marker_error(frames)
+                results[(mode, i)] = (elapsed, err)
+                print("%-10s iterations: %4d   time: %8.2fs   error: %f" % (mode, i, elapsed, err))
+    finally:
+        for attr, value in saved.items():
+            m.setAttr(on + '.' + attr, value)
+
+    # the fewest iterations each mode needs to match the plain solve at the highest iteration count
+    target = results[('plain', iterations[-1])][1] * 1.01
+    for mode in ['plain', seed]:
+        for i in iterations:
+            elapsed, err = results[(mode, i)]
+            if err <= target:
+                print("%-10s reaches error %f at %d iterations in %.2fs" % (mode, target, i, elapsed))
+                break
+        else:
+            print("%-10s does not reach error %f" % (mode, target))
+
+    return results
+
+
+def animated_markers(frames=20):
+    """ four mocap markers keyed over frames, connected to a single root joint that is set as the solve root.
+    returns (root, markers) """
+
+    m.file(f=True, new=True)
+
+    markers = []
+    for name, x, y in [("m1", 3, 3), ("m2", -4, 4), ("m3", 4, -4), ("m4", -4, -4)]:
+        marker = m.createNode("transform", name=name)
+        m.createNode("peelSquareLocator", parent=marker)
+        for f in range(1, frames + 1):
+            m.setKeyframe(marker, at="tx", t=f, v=x + f * 0.1)
+            m.setKeyframe(marker, at="ty", t=f, v=y)
+        markers.append(marker)
+
+    m.select(cl=True)
+    root = m.joint(name="root")
+    for marker in markers:
+        locator.line(marker, root)
+
+    roots.set_roots([root])
+    m.setAttr("peelSolveOptions.timeMode", 0)
+    m.playbackOptions(min=1, max=frames)
+
+    return root, markers
+
+
+def dirty_solve():
+    """ solve.solve_dirty() re-solves only the padded range around an edited marker key """
+
+    root, markers = animated_markers()
+
+    dirty.track()
+    try:
+        solve.solve()
+        assert solve.solve_dirty() == [], "nothing should be dirty after a full solve"
+
+        m.setKeyframe(markers[0], at="tx", t=10, v=10)
+        solved = solve.solve_dirty(pad=2)
+        assert solved == [(8, 12)], solved
+        assert m.keyframe(root + ".tx", q=True, t=(8, 12)), "no keys in the re-solved range"
+
+        assert solve.solve_dirty() == [], "the range should be clean after the re-solve"
+    finally:
+        dirty.stop()
+
+    print("dirty_solve ok")
+
+
+def seeded_solve(frames=20):
+    """ solve.solve_seeded() keys the whole range with both seed modes and tracks the markers as closely as
+    a plain solve """
+
+    root, markers = animated_markers(frames)
+
+    solve.solve()
+    reference = solve.marker_error(range(1, frames + 1))
+
+    for seed in ['velocity', 'coarse']:
+        m.cutKey(root, clear=True)
+        solve.solve_seeded(seed=seed, chunk=5)
+        keys = m.keyframe(root + ".tx", q=True) or []
+        assert len(keys) == frames, "%s: %d keys for %d frames" % (seed, len(keys), frames)
+        error = solve.marker_error(range(1, frames + 1))
+        assert error <= reference * 1.05 + 1e-6, "%s: error %f, plain solve %f" % (seed, error, reference)
+
+    print("seeded_solve ok")
@@ -2,7 +2,7 @@ from PySide2 import QtWidgets, QtCore, QtGui
 from maya import OpenMayaUI as omui
 import maya.cmds as m
 from shiboken2 import wrapInstance
-from peel_solve import time_util, roots, solve
+from peel_solve import time_util, timecode, roots, solve
 import math
 
 
@@ -104,24 +104,18 @@ class TimeRangeWidget(QtWidgets.QWidget):
         tc_rate = float(self.tc_rate.text())
 
         c3d_start = time_util.c3d_start(roots.optical())
+        c3d_start.set_rate(tc_rate)
 
-        start_tc = time_util.Timecode(str(self.ranges.item(row, 1).text()), tc_rate)
-        end_tc = time_util.Timecode(str(self.ranges.item(row, 2).text()), tc_rate)
+        items = [str(self.ranges.item(row, 1).text()), str(self.ranges.item(row, 2).text())]
+        offset = c3d_start.whole_frame() + c3d_start.fraction
+        frames = [i - offset for i in timecode.parse(items, tc_rate)]
 
-        print("Start:  " + start_tc.info())
-        print("End:    " + end_tc.info())
-        print("Offset: " + c3d_start.info())
+        whole, fractions = timecode.convert(frames, tc_rate, time_util.fps())
+        a, b = [w + f for w, f in zip(whole, fractions)]
 
-        a = start_tc - c3d_start
-        b = end_tc - c3d_start
+        print("Range: %s - %s  Offset: %s   Frames: %f - %f" % (items[0], items[1], c3d_start.info(), a, b))
 
-        a.set_rate(time_util.fps())
-        b.set_rate(time_util.fps())
-
-        print("Start: " + a.info())
-        print("End:   " + b.info())
-
-        return a.frame(), b.frame()
+        return a, b
 
     def select_event(self, row):
         start, end = self.get_range(row)
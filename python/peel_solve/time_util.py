@@ -26,14 +26,30 @@ import json
 import subprocess
 import os.path
 
+from peel_solve import timecode, dag, probe
+
+try:
+    long, basestring
+except NameError:
+    long, basestring = int, str
+
 
 class Timecode(object):
-    def __init__(self, value=None, rate=None, fraction=0.0):
+    """ A single timecode value.  The conversions are done by the timecode module, this is a scalar view of it.
+
+    * self.h, self.m, self.s, self.f - timecode components (ints)
+    * self.rate - frame rate, e.g. 30, 29.97
+    * self.fraction - sub frame remainder, e.g. after a rate change
+    * self.drop - drop frame, if None it is assumed for 29.97/59.94
+    """
+
+    def __init__(self, value=None, rate=None, fraction=0.0, drop=None):
         self.h = None
         self.m = None
         self.s = None
         self.f = None
         self.fraction = fraction
+        self.drop = drop
         if rate is not None:
             self.rate = float(rate)
         else:
@@ -46,42 +62,47 @@ class Timecode(object):
             self.f = value.f
             self.fraction = value.fraction
             self.rate = value.rate
+            self.drop = value.drop
 
         if rate is not None:
             self.rate = float(rate)
-            if isinstance(value, str):
-                self.set_timecode(value)
+            if isinstance(value, basestring):
+                self.set_timecode(str(value))
+
+            if isinstance(value, (int, long, float)):
+                self.set_frame(value + fraction)
 
-            if isinstance(value, float):
-                self.set_frame(value)
+    def is_drop(self):
+        if self.drop is None:
+            return timecode.default_drop(self.rate)
+        return self.drop
 
     def set_timecode(self, value):
 
-        if not isinstance(value, str):
+        if not isinstance(value, basestring):
             raise RuntimeError("Invalid value passed to set_timecode: " + str(value))
 
         if ':' not in value:
             raise ValueError("Invalid timecode string: " + value)
-        sp = value.split(':')
-        if len(sp) != 4:
-            raise ValueError("Cannot parse timecode: " + value)
 
-        self.h, self.m, self.s, self.f = [int(i) for i in sp]
+        (self.h, self.m, self.s, self.f), drop = timecode.split(value)
+        if drop is not None:
+            self.drop = drop
 
     def set_frame(self, value):
 
-        if not isinstance(value, float):
+        if not isinstance(value, (int, long, float)):
             raise RuntimeError("Invalid value passed to set_frame: " + str(value))
 
-        self.f = value % self.rate
-        value = (value - self.f) / self.rate
-        self.s = value % 60
-        value = (value - self.s) / 60
-        self.m = value % 60
-        self.h = (value - self.m) / 60
+        whole = int(math.floor(value))
+        self.fraction = value - whole
+        hh, mm, ss, ff = timecode.to_components([whole], self.rate, self.is_drop())
+        self.h, self.m, self.s, self.f = hh[0], mm[0], ss[0], ff[0]
 
     def __str__(self):
-        return "%02d:%02d:%02d:%02d" % (self.h, self.m, self.s, self.f)
+        """ drop frame timecode uses ; before the frames, as timecode.to_strings does, so it parses back """
+        drop = self.drop if self.rate is None else self.is_drop()
+        return "%02d:%02d:%02d%s%02d" % (self.h, self.m, self.s, ';' if drop else ':', self.f)
 
     def info(self):
         ret = str(self) + "  Fps: " + str(self.rate)
@@ -90,31 +111,33 @@ class Timecode(object):
         ret += "   Frame: %d" % self.frame()
         return ret
 
+    def whole_frame(self):
+        """ returns the frame number as an int, without the fraction """
+        return timecode.to_frames([self.h], [self.m], [self.s], [self.f], self.rate, self.is_drop())[0]
+
     def frame(self):
-        ret = self.f
-        ret += self.s * self.rate
-        ret += self.m * self.rate * 60
-        ret += self.h * self.rate * 60 * 60
-        return float(ret) + self.fraction
+        return float(self.whole_frame()) + self.fraction
 
     def set_rate(self, rate):
         if rate == self.rate:
             return
 
-        scaled = self.frame() * float(rate) / self.rate
-        self.fraction = scaled % 1
-        self.rate = rate
-        self.set_frame(scaled // 1)
+        whole, fraction = timecode.convert([self.whole_frame()], self.rate, rate)
+        scale = timecode.exact_rate(rate) / timecode.exact_rate(self.rate)
+        self.rate = float(rate)
+        self.set_frame(whole[0] + fraction[0] + self.fraction * float(scale))
 
     def __add__(self, other):
         t = Timecode(other)
         t.set_rate(self.rate)
+        t.drop = self.drop
         t.set_frame(self.frame() + t.frame())
         return t
 
     def __sub__(self, other):
         t = Timecode(other)
         t.set_rate(self.rate)
+        t.drop = self.drop
         t.set_frame(self.frame() - t.frame())
         return t
 
@@ -179,62 +202,109 @@ def set_range(dot):
 
 def mov_start(file_path, rate=None):
 
-    if not os.path.isfile(file_path):
-        raise RuntimeError("Could not find: " + file_path)
+    """ Returns the start Timecode of a movie.  The ffprobe result is cached, see probe.py """
 
-    cmd = ["M:\\bin\\ffprobe.exe", "-print_format", "json", "-show_streams", file_path]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out, err = proc.communicate()
-    data = json.loads(out)
-    tc = None
+    data = probe.probe(file_path)
+    probe.cache().save()
+    return probe_timecode(file_path, data, rate)
 
-    if 'streams' not in data:
-        print(json)
-        raise RuntimeError("Invalid file: " + str(file_path))
 
-    print(data)
+def mov_starts(file_paths, rate=None, workers=8):
 
-    for i in data['streams']:
-        if 'tags' not in i: continue
-        if 'timecode' not in i['tags']: continue
-        if rate is None and 'r_frame_rate' in i and i['r_frame_rate'] != "0/0":
-            rate = i['r_frame_rate']
-            if '/' in rate:
-                sp = rate.split('/')
-                if sp[1] != "0":
-                    rate = float(sp[0]) / float(sp[1])
+    """ Returns a dict of path -> start Timecode for many movies, probing them in parallel.
+    Files that cannot be read are reported and left out """
 
-        tc = str(i['tags']['timecode'])
+    ret = {}
+    for path, data in probe.probe_many(file_paths, workers=workers).items():
+        try:
+            if isinstance(data, Exception):
+                raise data
+            ret[path] = probe_timecode(path, data, rate)
+        except (RuntimeError, OSError, ValueError) as e:
+            print(str(e))
 
-    if tc is None:
-        raise RuntimeError("No timecode")
+    return ret
+
+
+def probe_timecode(file_path, data, rate=None):
+
+    if data['timecode'] is None:
+        raise RuntimeError("No timecode: " + str(file_path))
+
+    if rate is None:
+        rate = data['rate']
 
     if rate is None:
         raise RuntimeError("Could not determine frame rate for movie: " + str(file_path))
 
-    print("TC: " + str(tc))
+    return Timecode(data['timecode'], rate)
 
-    return Timecode(tc, rate)
 
+def tc_node(start=None, compact=False):
 
-def tc_node():
+    """ Creates a timecode node in the scene based on the current frame range
 
-    """ Creates a timecode node in the scene based on the current frame range """
+    @param start: timecode (string) of the first frame, defaults to the frame number as timecode
+    @param compact: if True the start timecode and rate are stored as attributes on the node rather than keying
+                    h/m/s/f on every frame, see node_timecode()
+    """
 
     if m.objExists("TIMECODE"):
         m.delete("TIMECODE")
 
     tc = m.group(name="TIMECODE", em=True)
 
-    st = m.playbackOptions(q=True, min=True)
-    en = m.playbackOptions(q=True, max=True)
+    st = int(m.playbackOptions(q=True, min=True))
+    en = int(m.playbackOptions(q=True, max=True))
+    rate = fps()
+
+    if start is None:
+        start = timecode.to_strings([st], rate)[0]
+    first = timecode.parse([start], rate)[0]
 
-    for i in range(int(st), int(en)):
-        t = Timecode(float(i), fps())
-        m.setKeyframe(tc, at="tx", v=t.h, t=(i))
-        m.setKeyframe(tc, at="ty", v=t.m, t=(i))
-        m.setKeyframe(tc, at="tz", v=t.s, t=(i))
-        m.setKeyframe(tc, at="rx", v=t.f, t=(i))
+    if compact:
+        m.addAttr(tc, ln="tcStart", dt="string")
+        m.setAttr(tc + ".tcStart", start, type="string")
+        m.addAttr(tc, ln="tcFrame", at="double")
+        m.setAttr(tc + ".tcFrame", st)
+        m.addAttr(tc, ln="tcRate", at="double")
+        m.setAttr(tc + ".tcRate", rate)
+        return tc
+
+    frames = list(range(st, en + 1))
+    hh, mm, ss, ff = timecode.to_components([first + i - st for i in frames], rate)
+
+    # the curves take internal units
+    linear = om.MDistance(1.0, om.MDistance.uiUnit()).asCentimeters()
+    angular = om.MAngle(1.0, om.MAngle.uiUnit()).asRadians()
+
+    for attr, values, scale in [("tx", hh, linear), ("ty", mm, linear), ("tz", ss, linear), ("rx", ff, angular)]:
+        data = dict((t, v * scale) for t, v in zip(frames, values))
+        dag.apply_curve(tc, attr, data, stepped=True)
+
+    return tc
+
+
+def node_timecode(frame=None, node="TIMECODE"):
+
+    """ Returns the Timecode stored on the timecode node at frame (defaults to the current frame).
+    Works with both the keyed and compact forms of tc_node() """
+
+    if frame is None:
+        frame = m.currentTime(q=True)
+
+    if m.objExists(node + ".tcStart"):
+        rate = m.getAttr(node + ".tcRate")
+        first = timecode.parse([m.getAttr(node + ".tcStart")], rate)[0]
+        return Timecode(float(first + frame - m.getAttr(node + ".tcFrame")), rate)
+
+    t = Timecode()
+    t.h = int(round(m.getAttr(node + ".tx", t=frame)))
+    t.m = int(round(m.getAttr(node + ".ty", t=frame)))
+    t.s = int(round(m.getAttr(node + ".tz", t=frame)))
+    t.f = int(round(m.getAttr(node + ".rx", t=frame)))
+    t.rate = fps()
+    return t
 
 
 def timecode_start(optical_root):
@@ -274,6 +344,11 @@ def now():
 
 
 def now_alt(rate):
+    if m.objExists("TIMECODE.tcStart"):
+        t = node_timecode()
+        t.set_rate(rate)
+        return t
+
     t = Timecode()
     t.h = m.getAttr("TIMECODE.tx")
     t.m = m.getAttr("TIMECODE.ty")
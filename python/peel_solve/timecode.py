@@ -0,0 +1,168 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from fractions import Fraction
+import math
+
+""" Timecode conversions for lists of frames.  Frames are integers, rates can be any frame rate including the
+ NTSC (29.97, 59.94) drop frame rates.  Does not depend on maya so it can be used outside of it """
+
+
+# Video rates that are labelled with their rounded value, mapped to the exact rate
+NTSC = {23.976: Fraction(24000, 1001),
+        29.97:  Fraction(30000, 1001),
+        47.952: Fraction(48000, 1001),
+        59.94:  Fraction(60000, 1001),
+        119.88: Fraction(120000, 1001)}
+
+
+def exact_rate(rate):
+    """ returns the rate as a Fraction, 29.97 -> 30000/1001 """
+    if isinstance(rate, Fraction):
+        return rate
+    for k, v in NTSC.items():
+        if abs(float(rate) - k) < 0.001:
+            return v
+    return Fraction(rate).limit_denominator(1001)
+
+
+def nominal(rate):
+    """ returns the number of frames counted per timecode second, 29.97 -> 30 """
+    return int(round(float(rate)))
+
+
+def default_drop(rate):
+    """ drop frame is assumed for 29.97 and 59.94 """
+    rate = float(rate)
+    return abs(rate - 29.97) < 0.001 or abs(rate - 59.94) < 0.001
+
+
+def dropped(rate, drop=None):
+    """ returns the number of frame numbers skipped each minute (except every tenth).  Drop frame only applies
+    to 30 and 60 frame timecode, 29.97 labelled as 30 is counted the same way """
+    if drop is None:
+        drop = default_drop(rate)
+    if not drop or nominal(rate) not in (30, 60):
+        return 0
+    return nominal(rate) // 15
+
+
+def to_components(frames, rate, drop=None):
+    """ Converts a list of frame numbers to timecode.  returns lists of (hours, minutes, seconds, frames) """
+
+    fps = nominal(rate)
+    d = dropped(rate, drop)
+
+    if d:
+        per_min = fps * 60 - d
+        per_ten = fps * 600 - d * 9
+        counted = []
+        for frame in frames:
+            tens, rem = divmod(int(frame), per_ten)
+            if rem < d:
+                counted.append(int(frame) + d * 9 * tens)
+            else:
+                counted.append(int(frame) + d * 9 * tens + d * ((rem - d) // per_min))
+        frames = counted
+
+    hh, mm, ss, ff = [], [], [], []
+    for frame in frames:
+        s, f = divmod(int(frame), fps)
+        mi, s = divmod(s, 60)
+        h, mi = divmod(mi, 60)
+        hh.append(h)
+        mm.append(mi)
+        ss.append(s)
+        ff.append(f)
+
+    return hh, mm, ss, ff
+
+
+def to_frames(hh, mm, ss, ff, rate, drop=None):
+    """ Converts lists of timecode components to a list of frame numbers """
+
+    fps = nominal(rate)
+    d = dropped(rate, drop)
+
+    ret = []
+    for h, mi, s, f in zip(hh, mm, ss, ff):
+        frame = ((int(h) * 60 + int(mi)) * 60 + int(s)) * fps + int(f)
+        if d:
+            minutes = int(h) * 60 + int(mi)
+            frame -= d * (minutes - minutes // 10)
+        ret.append(frame)
+
+    return ret
+
+
+def split(value):
+    """ Splits a timecode string in to ((h, m, s, f), drop).  A ; or . before the frames marks drop frame """
+
+    value = value.strip()
+    drop = None
+    if ';' in value or '.' in value:
+        drop = True
+        value = value.replace(';', ':').replace('.', ':')
+
+    sp = value.split(':')
+    if len(sp) != 4:
+        raise ValueError("Cannot parse timecode: " + value)
+
+    return tuple(int(i) for i in sp), drop
+
+
+def parse(values, rate, drop=None):
+    """ Converts a list of timecode strings to frame numbers """
+
+    ret = []
+    for value in values:
+        parts, is_drop = split(value)
+        if drop is not None:
+            is_drop = drop
+        ret += to_frames(*([[i] for i in parts] + [rate, is_drop]))
+    return ret
+
+
+def to_strings(frames, rate, drop=None):
+    """ Converts frame numbers to timecode strings, drop frame timecode uses ; before the frames """
+
+    if drop is None:
+        drop = default_drop(rate)
+    sep = ';' if drop else ':'
+    return ["%02d:%02d:%02d%s%02d" % (h, mi, s, sep, f)
+            for h, mi, s, f in zip(*to_components(frames, rate, drop))]
+
+
+def convert(frames, src_rate, dst_rate):
+    """ Converts frame numbers from one rate to another.
+    returns (whole frames, fractions) where the fractions are the remainder as floats in the range 0 to 1 """
+
+    scale = exact_rate(dst_rate) / exact_rate(src_rate)
+
+    whole = []
+    fractions = []
+    for frame in frames:
+        value = Fraction(frame) * scale
+        w = int(math.floor(value))
+        whole.append(w)
+        fractions.append(float(value - w))
+
+    return whole, fractions
@@ -2,16 +2,24 @@ from peel_solve import queue
 from peel_solve import solve_setup
 from peel_solve import solve
 from peel_solve import roots
+from peel_solve import playblast
 
 import maya.cmds as m
 
 import os.path
+import tempfile
+
+# maya.exe for the jobs that need the ui (playblasts), set PEEL_MAYA to use another version
+MAYA_EXE = os.environ.get("PEEL_MAYA", r'C:\Program Files\Autodesk\Maya2020\bin\maya.exe')
+FFMPEG_EXE = os.environ.get("PEEL_FFMPEG", r'd:\bin\ffmpeg.exe')
+
 
 def peelsolve_exe():
-    return "m:/bin/peelsolve.exe"
+    return solve_setup.PEELSOLVE_EXE
 
 
 def solve(file_path=None, rb=True, skel=True):
+    """ spool a standalone solve of the current scene, returns the job id """
 
     if file_path is None:
         sn = m.file(q=True, sn=True)
@@ -29,5 +37,78 @@ def solve(file_path=None, rb=True, skel=True):
     print("Config: " + solve_config)
 
     args = [peelsolve_exe(), c3d, solve_config, solve_config + ".out"]
-    queue.add_job(name, args, data)
+    return queue.add_job(name, args, data)
+
+
+def playblast_job(scene, view, file_name, depends):
+    """ spool a playblast of one view of a scene.  Playblasts need the maya ui, so this runs maya.exe with a
+    script that quits when it is done """
+
+    lines = ['python("from peel_solve import playblast");',
+             'python("playblast.render_view(\'%s\', r\'%s\')");' % (view, file_name.replace("\\", "/")),
+             'quit -f;']
+    with tempfile.NamedTemporaryFile(dir=queue.spool_file("scripts"), delete=False, mode="w+",
+                                     suffix=".mel") as script:
+        for line in lines:
+            script.write(line + "\n")
+
+    name = "PLAYBLAST: %s %s" % (os.path.splitext(os.path.split(scene)[1])[0], view)
+    return queue.add_job(name, [MAYA_EXE, "-file", scene, "-script", script.name], depends=depends,
+                         resources={'maya': 1})
+
+
+def pipeline(file_path=None, rb=True, skel=True, views=None, output=None, warm=True):
+    """ spool the whole chain for the current scene as jobs that start as soon as their inputs exist:
+
+    solve -> import the solve and save -> playblast each view -> encode each view
+
+    The scene must be saved.  The solved scene is saved next to it with a _solved suffix, image sequences and
+    movies go in output (default: a playblasts folder next to the scene).
+
+    With warm the import is a .maya job, which only a maya_worker runs (mayapy -m peel_solve.maya_worker
+    --supervise), do_work passes over it, so the chain waits at the import until a worker is started.
+    warm=False runs the import in mayabatch (queue.MAYA_BATCH) from any do_work worker instead.
+    Returns a dict of the job ids """
+
+    scene = m.file(q=True, sn=True)
+    if not scene:
+        raise RuntimeError("Save the scene before spooling the pipeline")
+
+    base, ext = os.path.splitext(scene)
+    shot = os.path.split(base)[1]
+    solved = base + "_solved" + ext
+
+    if output is None:
+        output = os.path.join(os.path.dirname(scene), "playblasts", shot)
+
+    if views is None:
+        views = ["top", "side", "front", "persp"]
+
+    start = m.playbackOptions(q=True, min=True)
+    end = m.playbackOptions(q=True, max=True)
+
+    if file_path is None:
+        file_path = scene + ".solve"
+    out = file_path + ".out"
+
+    ret = {'solve': solve(file_path, rb=rb, skel=skel), 'playblast': {}, 'encode': {}}
+
+    python = ["from peel_solve import solve_setup",
+              "solve_setup.import_solved(r'%s')" % out.replace("\\", "/")]
+    ret['import'] = queue.add_maya(scene, solved, [], warm=warm, name="IMPORT: " + shot, python=python,
+                                   depends=[ret['solve']], run=False)
+    if warm:
+        print("The import runs in a maya_worker, start one if none are running: "
+              "mayapy -m peel_solve.maya_worker --supervise")
+
+    # fan out: the views are independent of each other
+    for view in views:
+        file_name = os.path.join(output, view, shot + "_" + view)
+        ret['playblast'][view] = playblast_job(solved, view, file_name, [ret['import']])
+
+        args = playblast.ffmpeg_args(file_name + ".%04d.jpg", os.path.join(output, shot + "_" + view + ".mp4"),
+                                     start, end, ffmpeg=FFMPEG_EXE)
+        ret['encode'][view] = queue.add_job("ENCODE: %s %s" % (shot, view), args,
+                                            depends=[ret['playblast'][view]])
 
+    return ret